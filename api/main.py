@@ -5,6 +5,9 @@ import os
 # "from app.core..." imports inside backend/ resolve correctly.
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
 
+# Serverless instances never serve scan analysis, so don't preload AI models.
+os.environ.setdefault("AI_PRELOAD_MODELS", "false")
+
 from app.main import app  # noqa: E402
 
 # This file exposes the FastAPI `app` instance for Vercel.
@@ -1,6 +1,8 @@
+from bson import ObjectId
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
+from app.core.cache import TTLCache
 from app.core.config import settings
 from app.core.database import get_database
 from app.models.user import TokenData, UserRole
@@ -8,6 +10,15 @@ from app.models.user import TokenData, UserRole
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# User documents by token subject (email), without the password hash.
+PRINCIPAL_CACHE = TTLCache(settings.AUTH_PRINCIPAL_CACHE_ENTRIES, settings.AUTH_PRINCIPAL_CACHE_TTL_SECONDS)
+
+
+def invalidate_principal(email: str) -> None:
+    """Drop a cached user after its record changes, so the next request reloads it."""
+    PRINCIPAL_CACHE.pop(email)
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get_database)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -24,13 +35,18 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get
     except JWTError:
         raise credentials_exception
     
-    user = await db["users"].find_one({"email": email})
-    if user is None:
-        raise credentials_exception
-    
-    # Convert _id to str for convenience in logic
-    user["id"] = str(user["_id"])
-    return user
+    principal = PRINCIPAL_CACHE.get(email)
+    if principal is None:
+        user = await db["users"].find_one({"email": email})
+        if user is None:
+            raise credentials_exception
+        user.pop("hashed_password", None)
+        # Convert _id to str for convenience in logic
+        user["id"] = str(user["_id"])
+        PRINCIPAL_CACHE.set(email, user)
+        principal = user
+    # Handlers get their own copy, so changes to it never reach the cache.
+    return dict(principal)
 
 def get_current_active_user(current_user: dict = Depends(get_current_user)):
     return current_user
@@ -59,3 +75,18 @@ def require_any_role(roles: list[UserRole]):
         return current_user
 
     return role_checker
+
+
+async def authorize_lab_report(db, report: dict, current_user: dict) -> None:
+    """Raise 403 unless the user may see ``report`` and what is derived from it:
+    the patient or doctor on its lab request, or any lab technician or admin."""
+    if current_user["role"] in {UserRole.PATIENT.value, UserRole.DOCTOR.value}:
+        try:
+            lab_request = await db["lab_requests"].find_one({"_id": ObjectId(report["lab_request_id"])})
+        except Exception:
+            lab_request = None
+        owner_field = "patient_id" if current_user["role"] == UserRole.PATIENT.value else "doctor_id"
+        if not lab_request or lab_request.get(owner_field) != str(current_user["_id"]):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view this report")
+    elif current_user["role"] not in {UserRole.LAB_TECHNICIAN.value, UserRole.ADMIN.value}:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view this report")
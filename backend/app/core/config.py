@@ -9,6 +9,17 @@ class Settings(BaseSettings):
     DATA_ENCRYPTION_KEY: str = ""
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Authenticated users are cached per token subject so protected routes skip the
+    # users lookup. Admin changes invalidate this process's entry; other workers
+    # see them once the TTL runs out.
+    AUTH_PRINCIPAL_CACHE_ENTRIES: int = 4096
+    AUTH_PRINCIPAL_CACHE_TTL_SECONDS: float = 30.0
+    # bcrypt runs on its own bounded thread pool; logins past the queue limit get a
+    # 503. Stored hashes with a different cost factor are upgraded on login.
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = 2
     ALLOWED_ORIGINS: list[str] = [
         "http://localhost:5173",
         "http://127.0.0.1:5173",
@@ -24,12 +35,173 @@ class Settings(BaseSettings):
     
     # Gemini API
     GEMINI_API_KEY: str = ""
+    GEMINI_BASE_URL: str = "https://generativelanguage.googleapis.com/v1beta"
+    GEMINI_MODEL: str = "gemini-2.0-flash"
+    # Shared HTTP client for Gemini (pooled, kept alive for the app lifetime)
+    GEMINI_HTTP2: bool = True
+    GEMINI_MAX_CONNECTIONS: int = 20
+    GEMINI_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    GEMINI_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    GEMINI_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    GEMINI_READ_TIMEOUT_SECONDS: float = 30.0
+    GEMINI_POOL_TIMEOUT_SECONDS: float = 5.0
+    GEMINI_MAX_CONCURRENCY: int = 16
+    # Chatbot answer cache (keyed by the masked question + recent history)
+    CHAT_CACHE_ENABLED: bool = True
+    CHAT_CACHE_MAX_ENTRIES: int = 1024
+    CHAT_CACHE_TTL_SECONDS: int = 6 * 3600
+    CHAT_CACHE_HISTORY_TURNS: int = 4
+    # Server-side chat sessions. History past the token budget is folded into a
+    # short summary, so each turn sends a bounded prompt however long the chat runs.
+    CHAT_SESSIONS_ENABLED: bool = True
+    CHAT_SESSION_MEMORY_ENTRIES: int = 2048
+    CHAT_SESSION_TTL_SECONDS: int = 24 * 3600
+    CHAT_HISTORY_TOKEN_BUDGET: int = 1500
+    CHAT_HISTORY_MIN_TURNS: int = 2
+    CHAT_SUMMARY_TOKEN_BUDGET: int = 300
+    # PII masking for chat text, in priority order (email, mrn, phone, id)
+    PII_DETECTORS: str = "email,mrn,phone,id"
+    # Offline BM25 retrieval used for chatbot fallback answers. The bundled corpus is
+    # always indexed; a prebuilt index file, if present, is loaded instead.
+    CHAT_RETRIEVAL_INDEX_PATH: str = ""
+    CHAT_RETRIEVAL_CORPUS_PATH: str = ""
+    CHAT_RETRIEVAL_MIN_SCORE: float = 0.3
 
     # AI model paths
     CNN_MODEL_PATH: str = ""
     SEGMENT_MODEL_PATH: str = ""
     SLICE_MODEL_PATH: str = ""
     VLM_MODEL_PATH: str = ""
+    # Inference backend per model: "torchscript" (the *_MODEL_PATH file), "onnx" or
+    # "onnx_int8" (ONNX Runtime, int8 dynamically quantized). The ONNX files are made
+    # by export_models.py next to the TorchScript file; if one is missing, or
+    # onnxruntime is not installed, that model falls back to torchscript.
+    CNN_MODEL_BACKEND: str = "torchscript"
+    SEGMENT_MODEL_BACKEND: str = "torchscript"
+    SLICE_MODEL_BACKEND: str = "torchscript"
+    # LLM provider for the chatbot and the VLM report stage ("gemini" or "local")
+    LLM_PROVIDER: str = "gemini"
+    VLM_PROVIDER: str = ""
+    # Self-hosted causal LM (e.g. the StableLM fine-tuned in Dr_Tmuor.ipynb); defaults to VLM_MODEL_PATH
+    LOCAL_LLM_MODEL_PATH: str = ""
+    LOCAL_LLM_ADAPTER_PATH: str = ""
+    LOCAL_LLM_QUANTIZE: bool = True
+    LOCAL_LLM_MAX_NEW_TOKENS: int = 256
+    LOCAL_LLM_MAX_BATCH_SIZE: int = 4
+    LOCAL_LLM_BATCH_WAIT_MS: float = 20.0
+    LOCAL_LLM_KV_CACHE_TOKENS: int = 8192
+    # Upstream (Gemini) resilience: circuit breaker, adaptive concurrency cap, hedging.
+    # Calls slower than LLM_SLOW_CALL_SECONDS count as failures for the breaker.
+    LLM_BREAKER_FAILURE_RATIO: float = 0.5
+    LLM_BREAKER_MIN_CALLS: int = 5
+    LLM_BREAKER_WINDOW: int = 20
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0
+    LLM_BREAKER_HALF_OPEN_CALLS: int = 2
+    LLM_SLOW_CALL_SECONDS: float = 10.0
+    LLM_CONCURRENCY_INITIAL: int = 8
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 16
+    LLM_CONCURRENCY_QUEUE_SECONDS: float = 2.0
+    # Hedging sends a second request if the first is slower than the delay
+    # (0 = recent p95 latency). Off by default since it costs extra API calls.
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_DELAY_MS: float = 0.0
+    # Load models in the background at startup; otherwise on first analysis.
+    AI_PRELOAD_MODELS: bool = True
+    AI_MODEL_WAIT_SECONDS: float = 10.0
+
+    # Field decryption on list endpoints: batches with at least this many values
+    # to decrypt run on a worker thread; recent plaintexts are cached briefly
+    # (DECRYPT_CACHE_MAX_ENTRIES=0 turns the cache off)
+    DECRYPT_OFFLOAD_THRESHOLD: int = 64
+    DECRYPT_CACHE_MAX_ENTRIES: int = 4096
+    DECRYPT_CACHE_TTL_SECONDS: float = 60.0
+
+    # Encrypted report files are written in segments of this much plaintext, so
+    # uploads and range reads only hold one segment in memory
+    ENCRYPTION_SEGMENT_BYTES: int = 256 * 1024
+
+    # Upload ingestion: chunked reads, spooled to disk past the memory threshold
+    UPLOAD_MAX_BYTES: int = 512 * 1024 * 1024
+    AI_UPLOAD_MAX_BYTES: int = 64 * 1024 * 1024
+    AI_VOLUME_MAX_BYTES: int = 512 * 1024 * 1024
+    UPLOAD_SPOOL_MEMORY_BYTES: int = 4 * 1024 * 1024
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+
+    # AI inference batching
+    AI_INPUT_SIZE: int = 224
+    AI_BATCH_MAX_SIZE: int = 8
+    AI_BATCH_MAX_WAIT_MS: float = 5.0
+    AI_VOLUME_BATCH_SIZE: int = 16
+    AI_SLICE_THRESHOLD: float = 0.5
+
+    # Segmentation masks (compactly encoded, served in tiles)
+    AI_MASK_DIR: str = "uploads/masks"
+    AI_MASK_MAX_TILE_PIXELS: int = 512 * 512
+
+    # AI inference worker pool ("thread" or "process")
+    AI_EXECUTOR: str = "thread"
+    AI_WORKERS: int = 2
+    AI_MAX_PENDING: int = 32
+    # Torch intra-op threads for the whole process (pipeline models and the
+    # local LLM); 0 keeps torch's default.
+    AI_TORCH_THREADS: int = 0
+    AI_RETRY_AFTER_SECONDS: int = 5
+
+    # Bulk analysis (/ai/analyze-batch): files in flight per request, and how much
+    # of each queued file stays in memory before it spools to disk
+    AI_BATCH_CONCURRENCY: int = 8
+    AI_BATCH_MAX_FILES: int = 500
+    AI_BATCH_MAX_BYTES: int = 512 * 1024 * 1024
+    AI_BATCH_SPOOL_MEMORY_BYTES: int = 256 * 1024
+
+    # AI analysis result cache (in-memory LRU + Mongo TTL collection)
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_MEMORY_ENTRIES: int = 512
+    AI_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+
+    # Background analysis jobs (Mongo-backed queue). A claimed job is leased for
+    # the visibility timeout, renewed by heartbeats; if its worker dies the job is
+    # picked up again once the lease expires. Failed attempts back off exponentially.
+    JOB_WORKERS: int = 2
+    JOB_POLL_SECONDS: float = 2.0
+    JOB_VISIBILITY_TIMEOUT_SECONDS: float = 300.0
+    JOB_HEARTBEAT_SECONDS: float = 30.0
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BACKOFF_SECONDS: float = 10.0
+    JOB_RETENTION_SECONDS: int = 7 * 24 * 3600
+    JOB_EVENTS_POLL_SECONDS: float = 1.0
+
+    # Admission control: a token bucket per client (token subject, or IP when
+    # anonymous) and route class, plus per-process concurrency caps on the heavy
+    # classes; refused requests get 429 + Retry-After. "mongo" shares the buckets
+    # between workers.
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"
+    # Proxies in front of the app that append to X-Forwarded-For (1 on Vercel
+    # or behind one reverse proxy). At 0 the header is ignored, so behind a
+    # proxy all clients share one IP bucket (e.g. 10 logins a minute site-wide).
+    RATE_LIMIT_TRUSTED_PROXIES: int = 0
+    RATE_LIMIT_MEMORY_KEYS: int = 100_000
+    RATE_LIMIT_IDLE_SECONDS: int = 3600
+    RATE_LIMIT_CONCURRENCY_RETRY_AFTER_SECONDS: int = 2
+    RATE_LIMIT_AI_PER_MINUTE: float = 30
+    RATE_LIMIT_AI_BURST: int = 10
+    RATE_LIMIT_AI_CONCURRENCY: int = 32
+    RATE_LIMIT_CHAT_PER_MINUTE: float = 20
+    RATE_LIMIT_CHAT_BURST: int = 5
+    RATE_LIMIT_CHAT_CONCURRENCY: int = 64
+    RATE_LIMIT_AUTH_PER_MINUTE: float = 10
+    RATE_LIMIT_AUTH_BURST: int = 5
+    RATE_LIMIT_PUBLIC_PER_MINUTE: float = 30
+    RATE_LIMIT_PUBLIC_BURST: int = 10
+    RATE_LIMIT_DEFAULT_PER_MINUTE: float = 600
+    RATE_LIMIT_DEFAULT_BURST: int = 120
+
+    # Prometheus scrape endpoint (/metrics). If METRICS_TOKEN is set, scrapers must
+    # send it as a bearer token.
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str = ""
 
     @field_validator("ALLOWED_ORIGINS", mode="before")
     @classmethod
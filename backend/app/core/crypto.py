@@ -1,18 +1,40 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 import hashlib
 import os
-from typing import Any, Optional
+import struct
+from typing import Any, BinaryIO, Iterator, Optional, Sequence, Union
 
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+from app.core.cache import TTLCache
 from app.core.config import settings
 
 ENCRYPTED_TEXT_PREFIX = "encaes::"
 
+# Segmented streaming format for files: a 16-byte header (magic, version, plaintext
+# segment size, random 7-byte nonce prefix), then segments of at most
+# `segment_size` plaintext bytes, each sealed on its own with the header as
+# associated data. Segment nonce = prefix + 4-byte index + 1-byte final flag, so
+# segments cannot be reordered, and dropping trailing segments is detected
+# because the new last one does not carry the final flag. Segment i always
+# starts at HEADER + i * (segment_size + 16), so any range can be decrypted
+# without touching the rest of the file.
+STREAM_MAGIC = b"DTSE"
+STREAM_VERSION = 1
+_STREAM_HEADER = struct.Struct(">4sBI7s")
+STREAM_HEADER_BYTES = _STREAM_HEADER.size
+TAG_BYTES = 16
+
 _cipher_instance: Optional[Any] = None
 
+# Plaintext of recently decrypted fields, keyed by the stored ciphertext (each
+# encryption uses a fresh nonce, so a key never maps to two plaintexts). Kept
+# short-lived since it holds patient data in memory.
+DECRYPTED_TEXT_CACHE = TTLCache(settings.DECRYPT_CACHE_MAX_ENTRIES, settings.DECRYPT_CACHE_TTL_SECONDS)
+
 
 def _derive_key(secret: str) -> bytes:
     return hashlib.sha256(secret.encode("utf-8")).digest()
@@ -77,6 +99,10 @@ def decrypt_text(value: Optional[str]) -> Optional[str]:
     if not cipher:
         return value
 
+    return _decrypt_field(cipher, value)
+
+
+def _decrypt_field(cipher: Any, value: str) -> str:
     encrypted = value[len(ENCRYPTED_TEXT_PREFIX) :]
     try:
         payload = _decode_blob(encrypted)
@@ -86,6 +112,60 @@ def decrypt_text(value: Optional[str]) -> Optional[str]:
         return value
 
 
+def _decrypt_misses(cipher: Any, values: list[str], use_cache: bool) -> list[str]:
+    plaintexts = [_decrypt_field(cipher, value) for value in values]
+    if use_cache:
+        for value, plaintext in zip(values, plaintexts):
+            # Undecryptable values come back unchanged and are not cached.
+            if plaintext is not value:
+                DECRYPTED_TEXT_CACHE.set(value, plaintext)
+    return plaintexts
+
+
+def _plan_batch(values: Sequence[Optional[str]], use_cache: bool) -> tuple[list[Optional[str]], list[int]]:
+    """Resolve what needs no decryption (plain values, cache hits); returns the
+    partial result and the indexes still to decrypt."""
+    results = list(values)
+    pending = []
+    for index, value in enumerate(values):
+        if not value or not value.startswith(ENCRYPTED_TEXT_PREFIX):
+            continue
+        cached = DECRYPTED_TEXT_CACHE.get(value) if use_cache else None
+        if cached is None:
+            pending.append(index)
+        else:
+            results[index] = cached
+    return results, pending
+
+
+def decrypt_texts(values: Sequence[Optional[str]], use_cache: bool = True) -> list[Optional[str]]:
+    """:func:`decrypt_text` over many values in one call, with the plaintext cache."""
+    cipher = get_cipher()
+    if not cipher:
+        return list(values)
+    results, pending = _plan_batch(values, use_cache)
+    for index, plaintext in zip(pending, _decrypt_misses(cipher, [values[index] for index in pending], use_cache)):
+        results[index] = plaintext
+    return results
+
+
+async def decrypt_texts_async(values: Sequence[Optional[str]], use_cache: bool = True) -> list[Optional[str]]:
+    """Like :func:`decrypt_texts`; cache misses past DECRYPT_OFFLOAD_THRESHOLD are
+    decrypted on a worker thread instead of the event loop."""
+    cipher = get_cipher()
+    if not cipher:
+        return list(values)
+    results, pending = _plan_batch(values, use_cache)
+    misses = [values[index] for index in pending]
+    if len(misses) >= settings.DECRYPT_OFFLOAD_THRESHOLD:
+        plaintexts = await asyncio.to_thread(_decrypt_misses, cipher, misses, use_cache)
+    else:
+        plaintexts = _decrypt_misses(cipher, misses, use_cache)
+    for index, plaintext in zip(pending, plaintexts):
+        results[index] = plaintext
+    return results
+
+
 def encrypt_bytes(payload: bytes) -> tuple[bytes, bool]:
     cipher = get_cipher()
     if not cipher:
@@ -103,3 +183,146 @@ def decrypt_bytes(payload: bytes) -> bytes:
         return cipher.decrypt(nonce, ciphertext, None)
     except Exception:
         return payload
+
+
+def _segment_nonce(prefix: bytes, index: int, final: bool) -> bytes:
+    return prefix + struct.pack(">IB", index, 1 if final else 0)
+
+
+class StreamEncryptor:
+    """Incremental encryption into the segmented format.
+
+    Feed plaintext with :meth:`update` and write out what it returns; the
+    output of :meth:`finalize` completes the file. At most one segment plus
+    the latest input is buffered.
+    """
+
+    def __init__(self, cipher: Optional[Any] = None, segment_size: Optional[int] = None) -> None:
+        self.cipher = cipher or get_cipher()
+        if self.cipher is None:
+            raise RuntimeError("No encryption key configured")
+        self.segment_size = segment_size or settings.ENCRYPTION_SEGMENT_BYTES
+        self._prefix = os.urandom(7)
+        self.header = _STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, self.segment_size, self._prefix)
+        self._buffer = bytearray()
+        self._index = 0
+        self._started = False
+
+    def _seal(self, plaintext: Union[bytes, bytearray, memoryview], final: bool) -> bytes:
+        nonce = _segment_nonce(self._prefix, self._index, final)
+        self._index += 1
+        return self.cipher.encrypt(nonce, bytes(plaintext), self.header)
+
+    def _start(self) -> bytes:
+        if self._started:
+            return b""
+        self._started = True
+        return self.header
+
+    def update(self, data: Union[bytes, bytearray, memoryview]) -> bytes:
+        out = bytearray(self._start())
+        self._buffer += data
+        # Keep the last (possibly full) segment back: only finalize knows it is the last.
+        size = self.segment_size
+        consumed = 0
+        while len(self._buffer) - consumed > size:
+            out += self._seal(memoryview(self._buffer)[consumed : consumed + size], final=False)
+            consumed += size
+        del self._buffer[:consumed]
+        return bytes(out)
+
+    def finalize(self) -> bytes:
+        out = self._start() + self._seal(self._buffer, final=True)
+        self._buffer = bytearray()
+        return out
+
+
+def is_stream_encrypted(header: bytes) -> bool:
+    return header[:5] == STREAM_MAGIC + bytes([STREAM_VERSION])
+
+
+class StreamDecryptor:
+    """Random-access reader for a file in the segmented format."""
+
+    def __init__(self, handle: BinaryIO, cipher: Optional[Any] = None) -> None:
+        self.cipher = cipher or get_cipher()
+        if self.cipher is None:
+            raise RuntimeError("No encryption key configured")
+        self._handle = handle
+        handle.seek(0)
+        self.header = handle.read(STREAM_HEADER_BYTES)
+        if len(self.header) < STREAM_HEADER_BYTES or not is_stream_encrypted(self.header):
+            raise ValueError("Not a segmented encrypted file")
+        _, _, self.segment_size, self._prefix = _STREAM_HEADER.unpack(self.header)
+        body = os.fstat(handle.fileno()).st_size - STREAM_HEADER_BYTES
+        stride = self.segment_size + TAG_BYTES
+        self.segments = max(1, -(-body // stride))
+        last = body - (self.segments - 1) * stride - TAG_BYTES
+        if self.segment_size <= 0 or last < 0:
+            raise ValueError("Truncated encrypted file")
+        self.size = (self.segments - 1) * self.segment_size + last
+
+    def read_segment(self, index: int) -> bytes:
+        """Decrypt one segment; raises ``cryptography.exceptions.InvalidTag`` if it was tampered with."""
+        stride = self.segment_size + TAG_BYTES
+        self._handle.seek(STREAM_HEADER_BYTES + index * stride)
+        sealed = self._handle.read(stride)
+        nonce = _segment_nonce(self._prefix, index, index == self.segments - 1)
+        return self.cipher.decrypt(nonce, sealed, self.header)
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Plaintext bytes ``[start, end)`` in segment-sized pieces."""
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        for index in range(start // self.segment_size, (end - 1) // self.segment_size + 1):
+            offset = index * self.segment_size
+            plaintext = self.read_segment(index)
+            yield plaintext[max(0, start - offset) : end - offset]
+
+
+class _SingleShotFile:
+    """A file written by :func:`encrypt_bytes`: decrypted in one piece on open."""
+
+    def __init__(self, handle: BinaryIO) -> None:
+        handle.seek(0)
+        self._plaintext = decrypt_bytes(handle.read())
+        self.size = len(self._plaintext)
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        end = self.size if end is None else min(end, self.size)
+        if start < end:
+            yield self._plaintext[start:end]
+
+
+class EncryptedFile:
+    """Reads an encrypted file in either format: segmented, or single-shot ``.enc``.
+
+    ``size`` is the plaintext size and :meth:`iter_range` yields plaintext;
+    only segmented files avoid loading the whole file. Single-shot files start
+    with a random nonce, so one passes for segmented with odds of 2**-40.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._handle = open(path, "rb")
+        try:
+            if is_stream_encrypted(self._handle.read(5)):
+                self._reader: Any = StreamDecryptor(self._handle)
+            else:
+                self._reader = _SingleShotFile(self._handle)
+        except BaseException:
+            self._handle.close()
+            raise
+        self.size = self._reader.size
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        return self._reader.iter_range(start, end)
+
+    def close(self) -> None:
+        self._handle.close()
+
+    def __enter__(self) -> "EncryptedFile":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
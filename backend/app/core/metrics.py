@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterable, Iterator, Optional
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow upstream calls.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str, quotes: bool = True) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _format_labels(labels: dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self._lock:
+            items = list(self._values.items())
+        return [{"labels": dict(zip(self.labelnames, key)), "value": value} for key, value in items]
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_format_labels(item['labels'])} {_format_value(item['value'])}" for item in self.snapshot()]
+
+
+class Gauge(Counter):
+    """A value that can go up and down (e.g. a state or a current limit)."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple[str, ...], list[Any]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self._lock:
+            items = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        result = []
+        for key, counts, total, count in items:
+            cumulative, running = {}, 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                running += bucket_count
+                cumulative["+Inf" if bound == float("inf") else repr(bound)] = running
+            result.append(
+                {
+                    "labels": dict(zip(self.labelnames, key)),
+                    "count": count,
+                    "sum": round(total, 6),
+                    "buckets": cumulative,
+                }
+            )
+        return result
+
+    def render(self) -> list[str]:
+        lines = []
+        for item in self.snapshot():
+            for bound, running in item["buckets"].items():
+                labels = _format_labels({**item["labels"], "le": bound})
+                lines.append(f"{self.name}_bucket{labels} {running}")
+            labels = _format_labels(item["labels"])
+            lines.append(f"{self.name}_sum{labels} {_format_value(item['sum'])}")
+            lines.append(f"{self.name}_count{labels} {item['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide collection of named metrics; repeated registration returns the same metric."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls: type, name: str, help_text: str, **kwargs: Any) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, labelnames=labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help_text, labelnames=labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram, name, help_text, labelnames=labelnames, buckets=buckets)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def snapshot(self, prefix: str = "") -> dict[str, Any]:
+        with self._lock:
+            metrics = [metric for name, metric in self._metrics.items() if name.startswith(prefix)]
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help, quotes=False)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Per-request stage timings, collected only while a caller asked for them
+# (see collect_timings); histograms are observed either way.
+_request_timings: ContextVar[Optional[dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def collect_timings() -> Iterator[dict[str, float]]:
+    """Gather ``record_timing`` calls made in this context into a dict of milliseconds."""
+    timings: dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def record_timing(name: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[f"{name}_ms"] = round(timings.get(f"{name}_ms", 0.0) + seconds * 1000, 3)
+
+
+@contextmanager
+def timed(histogram: Histogram, name: str, **labels: Any) -> Iterator[None]:
+    """Observe the block's wall time in ``histogram`` and record it as ``name`` for this request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, **labels)
+        record_timing(name, elapsed)
@@ -1,8 +1,28 @@
+import asyncio
+import time
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Optional
 from jose import jwt, JWTError
 from app.core.config import settings
+from app.core.metrics import REGISTRY
+
+PASSWORD_HASH_SECONDS = REGISTRY.histogram(
+    "auth_password_hash_seconds",
+    "bcrypt hash/verify time including the wait for a hashing worker.",
+    labelnames=("operation",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+PASSWORD_HASH_REJECTED = REGISTRY.counter(
+    "auth_password_hash_rejected_total", "bcrypt operations refused because the hashing queue was full."
+)
+PASSWORD_HASH_PENDING = REGISTRY.gauge(
+    "auth_password_hash_pending", "bcrypt operations queued or running on the hashing pool."
+)
+PASSWORD_REHASHED = REGISTRY.counter(
+    "auth_password_rehashed_total", "Password hashes upgraded to the configured cost factor at login."
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a bcrypt hash."""
@@ -10,12 +30,95 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     hash_bytes = hashed_password.encode('utf-8')
     return bcrypt.checkpw(pwd_bytes, hash_bytes)
 
-def get_password_hash(password: str) -> str:
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
     """Hash a password using bcrypt."""
     pwd_bytes = password.encode('utf-8')[:72]  # bcrypt max is 72 bytes
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or settings.BCRYPT_ROUNDS)
     return bcrypt.hashpw(pwd_bytes, salt).decode('utf-8')
 
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """Cost factor of a ``$2b$12$...`` bcrypt hash, or ``None`` if it cannot be read."""
+    parts = hashed_password.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the password hashing queue is full."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool so it never blocks the event loop.
+
+    bcrypt releases the GIL while it works, so threads give real parallelism.
+    At most ``max_pending`` operations are queued or running; past that
+    :class:`PasswordHasherBusy` is raised so a login burst is shed instead of
+    piling up behind the workers.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32, rounds: int = 12) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.rounds = rounds
+        self.pending = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, operation: str, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.pending >= self.max_pending:
+            PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHasherBusy(f"password hashing queue full ({self.max_pending} pending)")
+        self.pending += 1
+        PASSWORD_HASH_PENDING.inc()
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            PASSWORD_HASH_PENDING.dec()
+            PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started, operation=operation)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", verify_password, password, hashed_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """True if the hash was made with a different cost factor than the configured one."""
+        rounds = hash_rounds(hashed_password)
+        return rounds is not None and rounds != self.rounds
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "rounds": self.rounds,
+            "pending": self.pending,
+            "rejected": PASSWORD_HASH_REJECTED.value(),
+            "rehashed": PASSWORD_REHASHED.value(),
+        }
+
+
+password_hasher = PasswordHasher(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    rounds=settings.BCRYPT_ROUNDS,
+)
+
+def shutdown_password_hasher() -> None:
+    password_hasher.shutdown()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -1,10 +1,19 @@
+import hmac
 import os
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.core.config import settings
 from app.core.database import connect_to_mongo, close_mongo_connection
+from app.core.metrics import REGISTRY
+from app.core.security import shutdown_password_hasher
 from app.routers import auth, users, appointments, medical, ai, admin
+from app.services.gemini import close_gemini_client, start_gemini_client
+from app.services.jobs import ensure_job_indexes, start_job_workers, stop_job_workers
+from app.services.llm import start_llm_providers
+from app.services.rate_limit import RateLimitMiddleware, ensure_rate_limit_indexes, rate_limit_backend
+from app.services.uploads import UploadSizeLimitMiddleware
 
 app = FastAPI(title="Hospital Management System API")
 
@@ -15,6 +24,27 @@ origins = list(settings.ALLOWED_ORIGINS)
 if frontend_origin:
     origins.append(frontend_origin.strip())
 
+# Reject oversized uploads from Content-Length, or while the body is still
+# arriving, before it is parsed; the AI routes get their own limits
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_bytes=settings.UPLOAD_MAX_BYTES,
+    path_limits={
+        "/ai/analyze-image": settings.AI_UPLOAD_MAX_BYTES,
+        "/ai/analyze-volume": settings.AI_VOLUME_MAX_BYTES,
+        "/ai/analyze-batch": settings.AI_BATCH_MAX_BYTES,
+    },
+)
+
+# Shed excess load with 429 before it reaches the routes (inside CORS, so
+# rejections still carry CORS headers)
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(
+        RateLimitMiddleware,
+        backend=rate_limit_backend,
+        trusted_proxies=settings.RATE_LIMIT_TRUSTED_PROXIES,
+    )
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -22,11 +52,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Mask-X", "X-Mask-Y", "X-Mask-Width", "X-Mask-Height", "X-Mask-Downsample"],
 )
 
 # Events
 app.add_event_handler("startup", connect_to_mongo)
+app.add_event_handler("startup", ai.ensure_analysis_cache_indexes)
+app.add_event_handler("startup", ai.ensure_chat_session_indexes)
+app.add_event_handler("startup", ai.ensure_segmentation_mask_indexes)
+app.add_event_handler("startup", ai.start_model_loading)
+app.add_event_handler("startup", start_gemini_client)
+app.add_event_handler("startup", ai.load_retrieval_index)
+app.add_event_handler("startup", start_llm_providers)
+app.add_event_handler("startup", ensure_job_indexes)
+app.add_event_handler("startup", ensure_rate_limit_indexes)
+app.add_event_handler("startup", start_job_workers)
+# Stop job workers before the database and inference pool they use go away
+app.add_event_handler("shutdown", stop_job_workers)
 app.add_event_handler("shutdown", close_mongo_connection)
+app.add_event_handler("shutdown", ai.shutdown_inference)
+app.add_event_handler("shutdown", close_gemini_client)
+app.add_event_handler("shutdown", shutdown_password_hasher)
 
 # Routers
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
@@ -39,3 +85,10 @@ app.include_router(admin.router, prefix="/admin", tags=["Admin"])
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Hospital Management System API"}
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics(authorization: str = Header("")):
+        if settings.METRICS_TOKEN and not hmac.compare_digest(authorization, f"Bearer {settings.METRICS_TOKEN}"):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+        return PlainTextResponse(REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -37,6 +37,10 @@ class LabReport(BaseModel):
     lab_request_id: str
     report_url: Optional[str] = None
     ai_analysis_result: Optional[Dict[str, Any]] = None
+    # "pending" while the analysis job runs, then "completed" or "failed"
+    ai_analysis_status: Optional[str] = None
+    ai_analysis_job_id: Optional[str] = None
+    ai_analysis_error: Optional[str] = None
     technician_id: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
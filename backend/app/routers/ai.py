@@ -1,26 +1,97 @@
 from hashlib import sha256
 from pathlib import Path
-from typing import Any, List, Optional
-import re
-
-from fastapi import APIRouter, Depends, File, UploadFile
+from contextlib import AsyncExitStack, aclosing
+from typing import Any, Awaitable, Callable, List, Optional
+import asyncio
+import functools
+import json
+import threading
+import time
+import zipfile
+import zlib
+
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Query, UploadFile, status
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
+from bson import ObjectId
 import httpx
 
 from app.core.config import settings
-from app.auth.dependencies import require_any_role
+from app.core.crypto import EncryptedFile
+from app.core.database import db
+from app.core.metrics import REGISTRY, collect_timings, record_timing, timed
+from app.core.security import password_hasher
+from app.auth.dependencies import authorize_lab_report, require_any_role, require_role
 from app.models.user import UserRole
+from app.services.analysis_cache import AnalysisCache
+from app.services.chat_cache import ChatAnswerCache
+from app.services.chat_sessions import ChatSessionStore, compact_history, summary_text
+from app.services.llm import GenerationOptions, LLMProvider, active_providers, get_provider
+from app.services.pii import PIIMasker, detectors_by_name
+from app.services.retrieval import FallbackRetriever
+from app.services.model_backends import BackendUnavailable, load_model, onnxruntime
+from app.services.masks import MaskNotFound, pack_rows, rle_runs, load_mask, read_mask_region, save_mask
+from app.services.inference import InferenceOverloaded, InferencePool, MicroBatcher, configure_torch_threads
+from app.services.jobs import LAB_REPORT_ANALYSIS, Job, job_queue
+from app.services.uploads import SpooledUpload, ingest_upload
+from app.services.volume import PLANE_AXES, NiftiVolume, VolumeError, is_nifti_filename, open_volume
 
 try:
     import torch  # type: ignore
 except Exception:
     torch = None
 
+try:
+    from PIL import Image  # type: ignore
+except Exception:
+    Image = None
+
 router = APIRouter()
 
 
+# Bump when stage logic changes so cached analysis results are not reused.
+PIPELINE_VERSION = "2"
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "ai_pipeline_stage_seconds",
+    "Wall time per analysis stage as seen by the request (model stages include micro-batch queueing).",
+    labelnames=("stage",),
+)
+PIPELINE_RUNS = REGISTRY.counter(
+    "ai_pipeline_runs_total", "Pipeline runs by outcome (full or skipped_after_cnn).", labelnames=("outcome",)
+)
+ANALYSES = REGISTRY.counter("ai_analyses_total", "Image analyses served, by whether the result was cached.", labelnames=("cached",))
+STAGE_ITEMS = REGISTRY.counter(
+    "ai_stage_items_total",
+    "Images processed per stage, by whether a loaded model (vs fallback logic) served them.",
+    labelnames=("stage", "model_loaded"),
+)
+VLM_REPORTS = REGISTRY.counter("ai_vlm_reports_total", "VLM stage reports by provider.", labelnames=("provider",))
+MODEL_LOADED = REGISTRY.gauge(
+    "ai_model_loaded", "1 if the pipeline model is loaded, 0 if fallback logic is used.", labelnames=("model",)
+)
+
+
 class PipelineModels:
-    """Holds loaded models for the 4-stage AI pipeline."""
+    """Holds loaded models for the 4-stage AI pipeline.
+
+    Models are loaded lazily: :meth:`start_loading` runs :meth:`load` in a
+    background thread (kicked off by the startup hook), and anything that needs
+    the models either awaits :meth:`wait_ready` or calls :meth:`ensure_loaded`.
+    """
+
+    MODEL_SETTINGS = {
+        "CNN": "CNN_MODEL_PATH",
+        "SEGMENT": "SEGMENT_MODEL_PATH",
+        "SLICE": "SLICE_MODEL_PATH",
+    }
+    BACKEND_SETTINGS = {
+        "CNN": "CNN_MODEL_BACKEND",
+        "SEGMENT": "SEGMENT_MODEL_BACKEND",
+        "SLICE": "SLICE_MODEL_BACKEND",
+    }
+    # Stages that take a 1xSxS image batch and can be warmed up synthetically.
+    WARMUP_MODELS = ("CNN", "SEGMENT", "SLICE")
 
     def __init__(self) -> None:
         self.device = (
@@ -28,31 +99,125 @@ class PipelineModels:
             if torch is not None and torch.cuda.is_available()
             else "cpu"
         )
-        self.cnn = self._load_model(settings.CNN_MODEL_PATH, "CNN")
-        self.segment = self._load_model(settings.SEGMENT_MODEL_PATH, "SEGMENT")
-        self.slice = self._load_model(settings.SLICE_MODEL_PATH, "SLICE")
-        self.vlm = self._load_model(settings.VLM_MODEL_PATH, "VLM")
+        self.cnn = None
+        self.segment = None
+        self.slice = None
+        self.versions: dict[str, str] = {name: "fallback" for name in self.MODEL_SETTINGS}
+        self.status: dict[str, dict[str, Any]] = {
+            name: {
+                "state": "pending",
+                "path": getattr(settings, key) or None,
+                "backend": (getattr(settings, self.BACKEND_SETTINGS[name]) or "torchscript").strip().lower(),
+                "file": None,
+                "load_seconds": None,
+                "warmup_ms": None,
+                "error": None,
+            }
+            for name, key in self.MODEL_SETTINGS.items()
+        }
+        self.ready = False
+        self._lock = threading.Lock()
+        self._load_future: Optional[asyncio.Future] = None
+
+    def load(self) -> None:
+        with self._lock:
+            if self.ready:
+                return
+            for name, key in self.MODEL_SETTINGS.items():
+                model = self._load_model(getattr(settings, key), name)
+                if model is not None and name in self.WARMUP_MODELS:
+                    self._warmup(model, name)
+                setattr(self, name.lower(), model)
+                MODEL_LOADED.set(int(model is not None), model=name.lower())
+            self.ready = True
+
+    def ensure_loaded(self) -> None:
+        if not self.ready:
+            self.load()
+
+    def start_loading(self) -> asyncio.Future:
+        if self._load_future is None or self._load_future.get_loop().is_closed():
+            self._load_future = asyncio.get_running_loop().run_in_executor(None, self.load)
+        return self._load_future
+
+    async def wait_ready(self, timeout: float) -> bool:
+        if self.ready:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(self.start_loading()), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.ready
 
     def _load_model(self, model_path: str, model_name: str) -> Any:
+        status_entry = self.status[model_name]
         if torch is None or not model_path:
+            status_entry["state"] = "fallback"
             return None
-        path = Path(model_path)
-        if not path.exists():
+        backend = status_entry["backend"]
+        status_entry["state"] = "loading"
+        started = time.perf_counter()
+        try:
+            try:
+                model, path = load_model(backend, model_path, self.device, settings.AI_TORCH_THREADS)
+            except BackendUnavailable as exc:
+                if backend == "torchscript":
+                    raise
+                print(f"[AI] {model_name} {backend} backend unavailable ({exc}). Using torchscript.")
+                status_entry.update(backend="torchscript", error=f"{backend} unavailable: {exc}")
+                model, path = load_model("torchscript", model_path, self.device)
+        except BackendUnavailable:
             print(f"[AI] {model_name} model not found at {model_path}. Using fallback logic.")
+            status_entry.update(state="fallback", error="model file not found")
             return None
-        try:
-            model = torch.jit.load(str(path), map_location=self.device)
-            model.eval()
-            print(f"[AI] Loaded {model_name} model on {self.device}: {model_path}")
-            return model
         except Exception as exc:
             print(f"[AI] Failed loading {model_name} model ({model_path}): {exc}")
+            status_entry.update(state="failed", error=str(exc))
             return None
+        stat = path.stat()
+        self.versions[model_name] = f"{path.name}:{stat.st_size}:{int(stat.st_mtime)}"
+        status_entry.update(state="loaded", file=str(path), load_seconds=round(time.perf_counter() - started, 3))
+        print(f"[AI] Loaded {model_name} model ({status_entry['backend']}) on {self.device}: {path}")
+        return model
+
+    def _warmup(self, model: Any, model_name: str) -> None:
+        size = settings.AI_INPUT_SIZE
+        try:
+            sample = torch.zeros(1, 1, size, size, device=self.device)
+            started = time.perf_counter()
+            with torch.inference_mode():
+                model(sample)
+            self.status[model_name]["warmup_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        except Exception as exc:
+            print(f"[AI] Warmup failed for {model_name} model: {exc}")
+            self.status[model_name]["error"] = f"warmup failed: {exc}"
+
+    @property
+    def fingerprint(self) -> str:
+        """Short hash identifying the pipeline code and the model files in use."""
+        parts = [PIPELINE_VERSION] + [f"{name}={version}" for name, version in sorted(self.versions.items())]
+        return sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "device": self.device,
+            "torch_available": torch is not None,
+            "onnxruntime_available": onnxruntime is not None,
+            "fingerprint": self.fingerprint,
+            "models": {name: dict(entry) for name, entry in self.status.items()},
+        }
 
 
-# Loaded once at import time so models stay in memory/VRAM between requests.
+# Created empty at import; the startup hook loads models in the background.
 PIPELINE_MODELS = PipelineModels()
 
+
+async def start_model_loading() -> None:
+    if settings.AI_PRELOAD_MODELS:
+        PIPELINE_MODELS.start_loading()
+
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -60,179 +225,362 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     history: Optional[List[ChatMessage]] = []
+    # Returned by the previous turn; when set the server keeps the history and ``history`` is ignored.
+    session_id: Optional[str] = None
+    # Clients set this to false for follow-ups whose answer depends on earlier turns.
+    use_cache: bool = True
 
 SYSTEM_PROMPT = """You are a Medical Education Assistant specialized in tumor and brain-related diseases. Provide educational, accurate medical information suitable for students. Use clear, professional medical terminology with explanations. Always remind users that this is for educational purposes only."""
 
 # Fallback responses when API is unavailable
+# Topic answers live in the retrieval corpus (app/data/medical_corpus.jsonl);
+# this is what users get when nothing there matches the question.
 FALLBACK_RESPONSES = {
-    "brain tumor": """Brain tumors are abnormal growths of cells in the brain. They can be:
+    "default": """Thank you for your question about medical topics.
 
-**Primary brain tumors** - originate in the brain itself
-- Gliomas (astrocytomas, oligodendrogliomas, glioblastomas)
-- Meningiomas (arising from meninges)
-- Pituitary adenomas
-- Schwannomas
+I can help you learn about:
+- Types of brain tumors (gliomas, meningiomas, etc.)
+- Diagnostic methods (MRI, CT, biopsy)
+- Treatment options (surgery, radiation, chemotherapy)
+- Neurological conditions and their mechanisms
 
-**Secondary/Metastatic tumors** - spread from cancers elsewhere in the body
+Please ask a specific question about tumors, brain diseases, or oncology, and I'll provide educational information to help you learn.
 
-**Symptoms** may include headaches, seizures, vision problems, personality changes, and motor difficulties.
+Note: This is for educational purposes only. For medical concerns, please consult a healthcare professional."""
+}
 
-**Diagnosis** typically involves MRI, CT scans, and sometimes biopsy.
+PII_MASKER = PIIMasker(detectors_by_name(settings.PII_DETECTORS))
 
-Note: This is educational information only. Please consult healthcare professionals for medical advice.""",
-    
-    "glioblastoma": """Glioblastoma (GBM) is the most aggressive type of primary brain tumor.
 
-**Key Facts:**
-- Grade IV astrocytoma (highest grade)
-- Most common malignant brain tumor in adults
-- Originates from astrocytes (support cells)
+def _mask_sensitive_text(text: str) -> str:
+    return PII_MASKER.mask(text)
 
-**Characteristics:**
-- Rapid growth and invasion of surrounding tissue
-- High vascularization
-- Areas of necrosis within the tumor
+FALLBACK_RETRIEVER = FallbackRetriever(
+    index_path=settings.CHAT_RETRIEVAL_INDEX_PATH,
+    corpus_paths=[settings.CHAT_RETRIEVAL_CORPUS_PATH] if settings.CHAT_RETRIEVAL_CORPUS_PATH else [],
+    min_score=settings.CHAT_RETRIEVAL_MIN_SCORE,
+)
+FALLBACK_DISCLAIMER = "Note: This is educational information only."
 
-**Treatment approaches:**
-- Surgical resection (when possible)
-- Radiation therapy
-- Temozolomide chemotherapy
-- Tumor treating fields (TTFields)
 
-**Prognosis:** Median survival is approximately 14-16 months with standard treatment.
+def get_fallback_response(message: str) -> str:
+    """Best-matching answer from the local retrieval index, or the generic default."""
+    try:
+        answer = FALLBACK_RETRIEVER.best_answer(message)
+    except Exception as exc:
+        print(f"[AI] Retrieval fallback failed: {exc}")
+        answer = None
+    if not answer:
+        return FALLBACK_RESPONSES["default"]
+    if "educational" not in answer.lower():
+        answer = f"{answer}\n\n{FALLBACK_DISCLAIMER}"
+    return answer
 
-Note: This is educational information only.""",
 
-    "mri": """MRI (Magnetic Resonance Imaging) is a key diagnostic tool for brain tumors.
+async def load_retrieval_index() -> None:
+    # Build (or load) the index off the event loop so the first outage answer is instant.
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, FALLBACK_RETRIEVER.ensure_loaded)
+    except Exception as exc:
+        print(f"[AI] Could not load retrieval index: {exc}")
 
-**Advantages for brain imaging:**
-- Excellent soft tissue contrast
-- No ionizing radiation
-- Multiplanar imaging capability
 
-**Common sequences:**
-- T1-weighted: anatomy, post-contrast enhancement
-- T2-weighted: edema, tumor boundaries
-- FLAIR: suppresses CSF signal, highlights lesions
-- DWI: cellular density, acute changes
-- MR Spectroscopy: metabolic information
+def _confidence_from_digest(digest: bytes, low: float, high: float) -> float:
+    value = int.from_bytes(digest[:4], byteorder="big")
+    ratio = value / 0xFFFFFFFF
+    return round(low + (high - low) * ratio, 4)
 
-**Contrast enhancement** with gadolinium helps identify:
-- Blood-brain barrier disruption
-- Tumor vascularity
-- Active tumor vs. edema
 
-Note: This is educational information only.""",
+def _preprocess(upload: SpooledUpload) -> Any:
+    """Decode an upload into a 1xSxS grayscale tensor in [0, 1]."""
+    size = settings.AI_INPUT_SIZE
+    pixels = None
+    if Image is not None:
+        try:
+            with Image.open(upload.reader()) as image:
+                pixels = image.convert("L").resize((size, size)).tobytes()
+        except Exception:
+            pixels = None
+    if pixels is None:
+        # Undecodable input (or no Pillow): feed the raw bytes as pixels.
+        pixels = bytes(upload.view()[: size * size]).ljust(size * size, b"\0")
+    tensor = torch.frombuffer(bytearray(pixels), dtype=torch.uint8)
+    return tensor.view(1, size, size).float().div_(255.0)
+
+
+def _forward_tensor(model: Any, inputs: Any) -> Any:
+    with torch.inference_mode():
+        outputs = model(inputs.to(PIPELINE_MODELS.device))
+    if isinstance(outputs, (tuple, list)):
+        outputs = outputs[0]
+    return outputs.float().cpu()
+
+
+def _forward(model: Any, batch: list[SpooledUpload]) -> tuple[Any, list[float]]:
+    """Run one forward pass over the whole batch; returns CPU float outputs and
+    the seconds spent preprocessing each item."""
+    inputs, preprocess_seconds = [], []
+    for item in batch:
+        started = time.perf_counter()
+        inputs.append(_preprocess(item))
+        preprocess_seconds.append(time.perf_counter() - started)
+    return _forward_tensor(model, torch.stack(inputs)), preprocess_seconds
+
+
+def _tumor_probabilities(logits: Any) -> list[float]:
+    logits = logits.reshape(logits.shape[0], -1)
+    if logits.shape[1] == 1:
+        return torch.sigmoid(logits[:, 0]).tolist()
+    # Class 0 is "normal"; every other class is a tumor type.
+    return (1.0 - torch.softmax(logits, dim=1)[:, 0]).tolist()
+
+
+def _cnn_batch(batch: list[SpooledUpload]) -> list[dict[str, Any]]:
+    PIPELINE_MODELS.ensure_loaded()
+    model = PIPELINE_MODELS.cnn
+    preprocess_seconds = [0.0] * len(batch)
+    if model is None:
+        confidences = [_confidence_from_digest(item.digest, 0.7, 0.99) for item in batch]
+        detections = [confidence >= 0.84 for confidence in confidences]
+    else:
+        logits, preprocess_seconds = _forward(model, batch)
+        tumor_prob = _tumor_probabilities(logits)
+        detections = [prob >= 0.5 for prob in tumor_prob]
+        confidences = [
+            round(prob if detected else 1.0 - prob, 4)
+            for prob, detected in zip(tumor_prob, detections)
+        ]
+
+    return [
+        {
+            "label": "tumor" if tumor_detected else "normal",
+            "confidence": confidence,
+            "tumor_detected": tumor_detected,
+            "model_loaded": model is not None,
+            "device": PIPELINE_MODELS.device,
+            "_preprocess_seconds": seconds,
+        }
+        for confidence, tumor_detected, seconds in zip(confidences, detections, preprocess_seconds)
+    ]
 
-    "treatment": """Brain tumor treatment depends on type, location, and grade.
 
-**Surgical options:**
-- Craniotomy for tumor resection
-- Stereotactic biopsy for diagnosis
-- Debulking for symptom relief
+def _store_segmentation_mask(upload: SpooledUpload, mask: Any) -> Optional[str]:
+    """Persist a compact encoding of the mask and return the URL it is served from."""
+    mask_id = sha256(upload.digest + PIPELINE_MODELS.fingerprint.encode("utf-8")).hexdigest()[:32]
+    try:
+        save_mask(mask_id, mask)
+    except Exception as exc:
+        print(f"[AI] Could not store segmentation mask {mask_id}: {exc}")
+        return None
+    return f"/ai/masks/{mask_id}"
 
-**Radiation therapy:**
-- External beam radiation
-- Stereotactic radiosurgery (Gamma Knife, CyberKnife)
-- Proton beam therapy
 
-**Chemotherapy:**
-- Temozolomide (most common for GBM)
-- PCV regimen (procarbazine, CCNU, vincristine)
-- Bevacizumab (anti-angiogenic)
+MASK_VIEWERS_COLLECTION = "segmentation_masks"
 
-**Emerging treatments:**
-- Immunotherapy
-- Targeted molecular therapy
-- Tumor treating fields
 
-Note: This is educational information only.""",
+def _mask_id(result: dict[str, Any]) -> Optional[str]:
+    url = result.get("segmentation_mask_url")
+    return url.rsplit("/", 1)[-1] if url else None
 
-    "default": """Thank you for your question about medical topics.
 
-I can help you learn about:
-- Types of brain tumors (gliomas, meningiomas, etc.)
-- Diagnostic methods (MRI, CT, biopsy)
-- Treatment options (surgery, radiation, chemotherapy)
-- Neurological conditions and their mechanisms
+async def _grant_mask_access(result: dict[str, Any], user: dict) -> None:
+    """Let the user the analysis result was returned to fetch its mask.
 
-Please ask a specific question about tumors, brain diseases, or oncology, and I'll provide educational information to help you learn.
+    Masks are keyed by content, so a cache hit for another user's scan hands
+    out the same mask id; each recipient is recorded.
+    """
+    mask_id = _mask_id(result)
+    if mask_id is None or db.client is None:
+        return
+    try:
+        await db.client[settings.DATABASE_NAME][MASK_VIEWERS_COLLECTION].update_one(
+            {"_id": mask_id}, {"$addToSet": {"viewer_ids": str(user["_id"])}}, upsert=True
+        )
+    except Exception as exc:
+        print(f"[AI] Could not record access to segmentation mask {mask_id}: {exc}")
 
-Note: This is for educational purposes only. For medical concerns, please consult a healthcare professional."""
-}
 
-SENSITIVE_PATTERNS = [
-    (re.compile(r"\b[\w\.-]+@[\w\.-]+\.\w+\b", flags=re.IGNORECASE), "[EMAIL_MASKED]"),
-    (re.compile(r"\b(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?){2,4}\d{2,4}\b"), "[PHONE_MASKED]"),
-    (re.compile(r"\b\d{3,4}[-\s]?\d{3,4}[-\s]?\d{3,4}\b"), "[ID_MASKED]"),
-]
+async def _authorize_mask(mask_id: str, user: dict) -> None:
+    """Raise 403 unless the mask was returned to the user or belongs to a lab report they may see."""
+    database = db.client[settings.DATABASE_NAME]
+    if await database[MASK_VIEWERS_COLLECTION].find_one(
+        {"_id": mask_id, "viewer_ids": str(user["_id"])}, {"_id": 1}
+    ):
+        return
+    async for report in database["lab_reports"].find({"segmentation_mask_id": mask_id}):
+        try:
+            await authorize_lab_report(database, report, user)
+            return
+        except HTTPException:
+            continue
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view this mask")
 
 
-def _mask_sensitive_text(text: str) -> str:
-    if not text:
-        return text
+async def ensure_segmentation_mask_indexes() -> None:
+    if db.client is None:
+        return
+    try:
+        await db.client[settings.DATABASE_NAME]["lab_reports"].create_index("segmentation_mask_id", sparse=True)
+    except Exception as exc:
+        print(f"[AI] Could not create segmentation mask indexes: {exc}")
+
 
-    masked = text
-    for pattern, replacement in SENSITIVE_PATTERNS:
-        masked = pattern.sub(replacement, masked)
+def _segment_batch(batch: list[SpooledUpload]) -> list[dict[str, Any]]:
+    PIPELINE_MODELS.ensure_loaded()
+    model = PIPELINE_MODELS.segment
+    preprocess_seconds = [0.0] * len(batch)
+    if model is None:
+        area_ratios = [_confidence_from_digest(item.reverse_digest(), 0.01, 0.24) for item in batch]
+        mask_urls = [None] * len(batch)
+    else:
+        masks, preprocess_seconds = _forward(model, batch)
+        if masks.dim() == 4 and masks.shape[1] > 1:
+            foreground = masks.argmax(dim=1) > 0
+        else:
+            foreground = torch.sigmoid(masks) > 0.5
+            if foreground.dim() == 4:
+                foreground = foreground[:, 0]
+        area_ratios = [round(ratio, 4) for ratio in foreground.reshape(len(batch), -1).float().mean(dim=1).tolist()]
+        mask_urls = [_store_segmentation_mask(item, mask.numpy()) for item, mask in zip(batch, foreground)]
+
+    return [
+        {
+            "mask_generated": True,
+            "tumor_area_ratio": area_ratio,
+            "segmentation_mask_url": mask_url,
+            "model_loaded": model is not None,
+            "_preprocess_seconds": seconds,
+        }
+        for area_ratio, mask_url, seconds in zip(area_ratios, mask_urls, preprocess_seconds)
+    ]
 
-    return masked
 
-def get_fallback_response(message: str) -> str:
-    """Get a relevant fallback response based on keywords in the message."""
-    message_lower = message.lower()
-    
-    if "glioblastoma" in message_lower or "gbm" in message_lower:
-        return FALLBACK_RESPONSES["glioblastoma"]
-    elif "mri" in message_lower or "scan" in message_lower or "diagnos" in message_lower:
-        return FALLBACK_RESPONSES["mri"]
-    elif "treatment" in message_lower or "surgery" in message_lower or "chemotherapy" in message_lower or "radiation" in message_lower:
-        return FALLBACK_RESPONSES["treatment"]
-    elif "brain tumor" in message_lower or "tumour" in message_lower or "tumor" in message_lower or "cancer" in message_lower:
-        return FALLBACK_RESPONSES["brain tumor"]
+def _slice_batch(batch: list[SpooledUpload]) -> list[dict[str, Any]]:
+    PIPELINE_MODELS.ensure_loaded()
+    model = PIPELINE_MODELS.slice
+    planes = ["axial", "coronal", "sagittal"]
+    digests = [_slice_digest(item) for item in batch]
+    preprocess_seconds = [0.0] * len(batch)
+    if model is None:
+        dominant = [planes[digest[0] % len(planes)] for digest in digests]
     else:
-        return FALLBACK_RESPONSES["default"]
+        outputs, preprocess_seconds = _forward(model, batch)
+        logits = outputs.reshape(len(batch), -1)[:, : len(planes)]
+        dominant = [planes[index] for index in logits.argmax(dim=1).tolist()]
+
+    return [
+        {
+            "dominant_plane": plane,
+            "suspicious_slices": max(1, digest[1] % 8),
+            "model_loaded": model is not None,
+            "_preprocess_seconds": seconds,
+        }
+        for plane, digest, seconds in zip(dominant, digests, preprocess_seconds)
+    ]
 
 
-def _confidence_from_bytes(file_bytes: bytes, low: float, high: float) -> float:
-    digest = sha256(file_bytes).digest()
-    value = int.from_bytes(digest[:4], byteorder="big")
-    ratio = value / 0xFFFFFFFF
-    return round(low + (high - low) * ratio, 4)
+def _volume_slice_batch(slices: list[Any]) -> list[float]:
+    """Tumor probability for each 2D volume slice, one CNN pass per batch."""
+    PIPELINE_MODELS.ensure_loaded()
+    model = PIPELINE_MODELS.cnn
+    if model is None:
+        return [_confidence_from_digest(sha256(item.tobytes()).digest(), 0.0, 1.0) for item in slices]
 
+    size = settings.AI_INPUT_SIZE
+    tensors = []
+    for item in slices:
+        tensor = torch.from_numpy(item)
+        low, high = tensor.min(), tensor.max()
+        tensor = (tensor - low) / (high - low) if high > low else torch.zeros_like(tensor)
+        tensors.append(torch.nn.functional.interpolate(tensor[None, None], size=(size, size), mode="bilinear"))
+    return [round(prob, 4) for prob in _tumor_probabilities(_forward_tensor(model, torch.cat(tensors)))]
 
-def _cnn_stage(file_bytes: bytes) -> dict[str, Any]:
-    confidence = _confidence_from_bytes(file_bytes, 0.7, 0.99)
-    tumor_detected = confidence >= 0.84
-    return {
-        "label": "tumor" if tumor_detected else "normal",
-        "confidence": confidence,
-        "tumor_detected": tumor_detected,
-        "model_loaded": PIPELINE_MODELS.cnn is not None,
-        "device": PIPELINE_MODELS.device,
-    }
 
+def _slice_digest(upload: SpooledUpload) -> bytes:
+    # Same value as sha256(file_bytes + b"slice"), without concatenating a copy.
+    hasher = upload.hasher()
+    hasher.update(b"slice")
+    return hasher.digest()
 
-def _segment_stage(file_bytes: bytes) -> dict[str, Any]:
-    area_ratio = _confidence_from_bytes(file_bytes[::-1], 0.01, 0.24)
-    return {
-        "mask_generated": True,
-        "tumor_area_ratio": area_ratio,
-        "segmentation_mask_url": None,
-        "model_loaded": PIPELINE_MODELS.segment is not None,
-    }
 
+def _cnn_stage(upload: SpooledUpload) -> dict[str, Any]:
+    return _cnn_batch([upload])[0]
+
+
+def _segment_stage(upload: SpooledUpload) -> dict[str, Any]:
+    return _segment_batch([upload])[0]
+
+
+def _slice_stage(upload: SpooledUpload) -> dict[str, Any]:
+    return _slice_batch([upload])[0]
 
-def _slice_stage(file_bytes: bytes) -> dict[str, Any]:
-    planes = ["axial", "coronal", "sagittal"]
-    digest = sha256(file_bytes + b"slice").digest()
-    plane = planes[digest[0] % len(planes)]
-    suspicious_slices = max(1, digest[1] % 8)
-    return {
-        "dominant_plane": plane,
-        "suspicious_slices": suspicious_slices,
-        "model_loaded": PIPELINE_MODELS.slice is not None,
-    }
+
+# Set once when the app is imported, before any pool runs a forward pass.
+configure_torch_threads(settings.AI_TORCH_THREADS)
+
+# Forward passes run in a bounded pool so inference never blocks the event loop.
+INFERENCE_POOL = InferencePool(
+    max_workers=settings.AI_WORKERS,
+    max_pending=settings.AI_MAX_PENDING,
+    kind=settings.AI_EXECUTOR,
+)
+
+
+def _make_batcher(name: str, batch_fn: Any) -> MicroBatcher:
+    return MicroBatcher(
+        name,
+        batch_fn,
+        max_batch_size=settings.AI_BATCH_MAX_SIZE,
+        max_wait_ms=settings.AI_BATCH_MAX_WAIT_MS,
+        runner=INFERENCE_POOL.run,
+        max_in_flight=settings.AI_WORKERS,
+    )
+
+
+# Concurrent requests are grouped so each stage runs one forward pass per batch.
+CNN_BATCHER = _make_batcher("cnn", _cnn_batch)
+SEGMENT_BATCHER = _make_batcher("segment", _segment_batch)
+SLICE_BATCHER = _make_batcher("slice", _slice_batch)
+
+
+def _overloaded_exception(detail: str = "AI analysis is at capacity. Please retry shortly.") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={"Retry-After": str(settings.AI_RETRY_AFTER_SECONDS)},
+    )
+
+
+def shutdown_inference() -> None:
+    INFERENCE_POOL.shutdown()
+
+
+ANALYSIS_CACHE = AnalysisCache(settings.AI_CACHE_MEMORY_ENTRIES, settings.AI_CACHE_TTL_SECONDS)
+
+
+async def ensure_analysis_cache_indexes() -> None:
+    if settings.AI_CACHE_ENABLED:
+        await ANALYSIS_CACHE.ensure_indexes()
+
+
+CHAT_PROVIDER = get_provider(settings.LLM_PROVIDER)
+VLM_PROVIDER = get_provider(settings.VLM_PROVIDER or settings.LLM_PROVIDER)
+CHAT_GENERATION = GenerationOptions(temperature=0.7, top_k=40, top_p=0.95, max_output_tokens=2048)
+
+
+def _llm_loaded(provider: LLMProvider) -> bool:
+    return getattr(provider, "loaded", provider.available)
+
+
+def _analysis_cache_key(content_digest: str) -> str:
+    return f"{content_digest}:{PIPELINE_MODELS.fingerprint}"
+
+
+def _is_cacheable(result: dict[str, Any]) -> bool:
+    # Don't pin a transient LLM failure: retry the VLM next time instead.
+    vlm = result["pipeline"]["vlm"]
+    return not (vlm and VLM_PROVIDER.available and vlm["provider"] != VLM_PROVIDER.name)
 
 
 def _local_vlm_summary(cnn: dict[str, Any], segment: dict[str, Any], slice_info: dict[str, Any]) -> str:
@@ -249,11 +597,11 @@ async def _vlm_stage(cnn: dict[str, Any], segment: dict[str, Any], slice_info: d
     # VLM stage is called only after positive CNN detection to reduce GPU/API cost.
     fallback_text = _local_vlm_summary(cnn, segment, slice_info)
 
-    if not settings.GEMINI_API_KEY:
+    if not VLM_PROVIDER.available:
         return {
             "report": fallback_text,
             "provider": "local-fallback",
-            "model_loaded": PIPELINE_MODELS.vlm is not None,
+            "model_loaded": _llm_loaded(VLM_PROVIDER),
         }
 
     prompt = (
@@ -266,165 +614,321 @@ async def _vlm_stage(cnn: dict[str, Any], segment: dict[str, Any], slice_info: d
     )
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                (
-                    "https://generativelanguage.googleapis.com/v1beta/models/"
-                    f"gemini-2.0-flash:generateContent?key={settings.GEMINI_API_KEY}"
-                ),
-                json={
-                    "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-                    "generationConfig": {
-                        "temperature": 0.3,
-                        "maxOutputTokens": 512,
-                    },
-                },
-                timeout=30.0,
-            )
-            if response.status_code == 200:
-                data = response.json()
-                candidates = data.get("candidates", [])
-                if candidates:
-                    text = (
-                        candidates[0]
-                        .get("content", {})
-                        .get("parts", [{}])[0]
-                        .get("text", "")
-                    )
-                    if text:
-                        return {
-                            "report": text,
-                            "provider": "gemini",
-                            "model_loaded": PIPELINE_MODELS.vlm is not None,
-                        }
+        text = await VLM_PROVIDER.generate(
+            [{"role": "user", "text": prompt}],
+            options=GenerationOptions(temperature=0.3, max_output_tokens=512),
+        )
+        if text:
+            return {
+                "report": text,
+                "provider": VLM_PROVIDER.name,
+                "model_loaded": _llm_loaded(VLM_PROVIDER),
+            }
     except Exception as exc:
         print(f"[AI] VLM stage fallback due to error: {exc}")
 
     return {
         "report": fallback_text,
         "provider": "local-fallback",
-        "model_loaded": PIPELINE_MODELS.vlm is not None,
+        "model_loaded": _llm_loaded(VLM_PROVIDER),
     }
 
+CHAT_ROLES = [
+    UserRole.PATIENT,
+    UserRole.DOCTOR,
+    UserRole.STUDENT,
+    UserRole.LAB_TECHNICIAN,
+    UserRole.PHARMACY,
+]
+
+CHAT_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "chatbot_time_to_first_token_seconds",
+    "Time from receiving a streaming chat request to sending its first text.",
+    labelnames=("provider",),
+)
+CHAT_STREAMS = REGISTRY.counter(
+    "chatbot_streams_total",
+    "Streaming chat responses by how they finished.",
+    labelnames=("outcome",),
+)
+CHAT_CACHE_LOOKUPS = REGISTRY.counter(
+    "chatbot_cache_lookups_total",
+    "Chatbot answer cache lookups by result.",
+    labelnames=("result",),
+)
+
+CHAT_CACHE = ChatAnswerCache(
+    settings.CHAT_CACHE_MAX_ENTRIES,
+    settings.CHAT_CACHE_TTL_SECONDS,
+    settings.CHAT_CACHE_HISTORY_TURNS,
+)
+# Answers depend on the model and the system prompt, so both are part of the key.
+CHAT_CACHE_NAMESPACE = f"{CHAT_PROVIDER.model_id}:{sha256(SYSTEM_PROMPT.encode()).hexdigest()[:12]}"
+
+
+CHAT_SESSIONS = ChatSessionStore(settings.CHAT_SESSION_MEMORY_ENTRIES, settings.CHAT_SESSION_TTL_SECONDS)
+
+
+async def ensure_chat_session_indexes() -> None:
+    if settings.CHAT_SESSIONS_ENABLED:
+        await CHAT_SESSIONS.ensure_indexes()
+
+
+class ChatTurn:
+    """One chatbot turn: the session it belongs to and the masked prompt for the provider."""
+
+    def __init__(self, session: dict[str, Any], masked_message: str) -> None:
+        self.session = session
+        self.masked_message = masked_message
+        self.messages = session["turns"] + [{"role": "user", "text": masked_message}]
+        summary = summary_text(session)
+        self.system = f"{SYSTEM_PROMPT}\n\n{summary}" if summary else SYSTEM_PROMPT
+        self.cache_namespace = (
+            f"{CHAT_CACHE_NAMESPACE}:{sha256(summary.encode()).hexdigest()[:12]}" if summary else CHAT_CACHE_NAMESPACE
+        )
+
+    @property
+    def session_id(self) -> Optional[str]:
+        return self.session["_id"] if settings.CHAT_SESSIONS_ENABLED else None
+
+    async def record(self, answer: str) -> None:
+        if not settings.CHAT_SESSIONS_ENABLED:
+            return
+        self.session["turns"] += [
+            {"role": "user", "text": self.masked_message},
+            {"role": "model", "text": answer},
+        ]
+        await CHAT_SESSIONS.save(self.session)
+
+
+async def _chat_turn(request: ChatRequest, current_user: dict) -> ChatTurn:
+    """Load or start the chat session and mask the new message.
+
+    Session turns are stored masked, so only the new message is masked here.
+    History sent by the client (no ``session_id``) is masked once and starts a
+    new session; either way older turns beyond the token budget are compacted.
+    """
+    owner = str(current_user["_id"])
+    masked_message = _mask_sensitive_text(request.message)
+    if settings.CHAT_SESSIONS_ENABLED and request.session_id:
+        session = await CHAT_SESSIONS.get(request.session_id, owner)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    else:
+        history = [
+            {"role": "user" if msg.role == "user" else "model", "text": _mask_sensitive_text(msg.content)}
+            for msg in request.history or []
+        ]
+        session = CHAT_SESSIONS.new(owner, history)
+        compact_history(
+            session,
+            settings.CHAT_HISTORY_TOKEN_BUDGET,
+            settings.CHAT_HISTORY_MIN_TURNS,
+            settings.CHAT_SUMMARY_TOKEN_BUDGET,
+        )
+    return ChatTurn(session, masked_message)
+
+
+def _chat_cache_lookup(request: ChatRequest, turn: ChatTurn) -> tuple[Optional[str], Optional[str]]:
+    """Return ``(cache_key, cached_answer)``; the key is ``None`` when the turn bypasses the cache."""
+    if not settings.CHAT_CACHE_ENABLED or not request.use_cache:
+        CHAT_CACHE.bypassed += 1
+        CHAT_CACHE_LOOKUPS.inc(result="bypass")
+        return None, None
+    key = CHAT_CACHE.key(turn.messages, turn.cache_namespace)
+    cached = CHAT_CACHE.get(key)
+    CHAT_CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    return key, cached
+
+
+def _sse_event(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.post("/chatbot")
 async def chatbot(
     request: ChatRequest,
-    current_user: dict = Depends(
-        require_any_role(
-            [
-                UserRole.PATIENT,
-                UserRole.DOCTOR,
-                UserRole.STUDENT,
-                UserRole.LAB_TECHNICIAN,
-                UserRole.PHARMACY,
-            ]
-        )
-    ),
+    current_user: dict = Depends(require_any_role(CHAT_ROLES)),
 ):
     """
-    Educational chatbot for tumor and brain disease information using Gemini API.
+    Educational chatbot for tumor and brain disease information, answered by the
+    configured LLM provider (Gemini API or the self-hosted model).
     """
+    turn = await _chat_turn(request, current_user)
+    cached = None
     try:
-        # Build conversation history for Gemini
-        contents = []
-        
-        # Add conversation history
-        for msg in request.history:
-            contents.append({
-                "role": "user" if msg.role == "user" else "model",
-                "parts": [{"text": _mask_sensitive_text(msg.content)}]
-            })
-        
-        # Add current message
-        masked_message = _mask_sensitive_text(request.message)
-        contents.append({
-            "role": "user",
-            "parts": [{"text": masked_message}]
-        })
-        
-        # Call Gemini API
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={settings.GEMINI_API_KEY}",
-                json={
-                    "contents": contents,
-                    "systemInstruction": {
-                        "parts": [{"text": SYSTEM_PROMPT}]
-                    },
-                    "generationConfig": {
-                        "temperature": 0.7,
-                        "topK": 40,
-                        "topP": 0.95,
-                        "maxOutputTokens": 2048,
-                    }
-                },
-                timeout=30.0
-            )
-            
-            if response.status_code != 200:
-                print(f"Gemini API Error: {response.status_code} - {response.text}")
-                # Use fallback response
-                return {"response": get_fallback_response(masked_message)}
-            
-            data = response.json()
-            
-            # Extract the response text
-            if "candidates" in data and len(data["candidates"]) > 0:
-                candidate = data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    ai_response = candidate["content"]["parts"][0].get("text", "")
-                    return {"response": ai_response}
-            
-            # Fallback if response format is unexpected
-            return {"response": get_fallback_response(masked_message)}
-            
+        cache_key, cached = _chat_cache_lookup(request, turn)
+        if cached is not None:
+            ai_response = cached
+        else:
+            ai_response = await CHAT_PROVIDER.generate(turn.messages, turn.system, CHAT_GENERATION)
+            if ai_response:
+                if cache_key:
+                    CHAT_CACHE.set(cache_key, ai_response)
+            else:
+                # Fallback if response format is unexpected
+                ai_response = get_fallback_response(turn.masked_message)
+
     except httpx.TimeoutException:
-        return {"response": get_fallback_response(_mask_sensitive_text(request.message))}
+        ai_response = get_fallback_response(turn.masked_message)
     except Exception as e:
         print(f"Chatbot error: {str(e)}")
-        return {"response": get_fallback_response(_mask_sensitive_text(request.message))}
+        ai_response = get_fallback_response(turn.masked_message)
 
-@router.post("/analyze-image")
-async def analyze_medical_image(
-    file: UploadFile = File(...),
-    current_user: dict = Depends(require_any_role([UserRole.DOCTOR, UserRole.LAB_TECHNICIAN])),
+    await turn.record(ai_response)
+    response = {"response": ai_response, "session_id": turn.session_id}
+    if cached is not None:
+        response["cached"] = True
+    return response
+
+
+@router.post("/chatbot/stream")
+async def chatbot_stream(
+    request: ChatRequest,
+    current_user: dict = Depends(require_any_role(CHAT_ROLES)),
 ):
     """
-    4-stage pipeline: CNN -> Segment -> Slice -> VLM.
-    The VLM stage runs only when CNN predicts tumor-positive to save compute.
+    Streaming variant of /chatbot as Server-Sent Events.
+
+    Emits ``token`` events (``{"text": ...}``) as the LLM produces them. If the
+    provider fails, a ``fallback`` event carries the local answer (``partial``
+    tells the client whether to replace text already shown). Always ends with
+    ``done``, which carries the ``session_id`` for the next turn.
     """
-    if not file.filename:
-        return {"error": "No file provided"}
+    started = time.perf_counter()
+    turn = await _chat_turn(request, current_user)
+    cache_key, cached = _chat_cache_lookup(request, turn)
+
+    async def events():
+        if cached is not None:
+            CHAT_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, provider="cache")
+            CHAT_STREAMS.inc(outcome="cached")
+            yield _sse_event("token", {"text": cached})
+            await turn.record(cached)
+            yield _sse_event("done", {"provider": "cache", "session_id": turn.session_id})
+            return
+
+        streamed = False
+        failed = False
+        answer: list[str] = []
+        try:
+            async with aclosing(CHAT_PROVIDER.stream(turn.messages, turn.system, CHAT_GENERATION)) as chunks:
+                async for text in chunks:
+                    if not text:
+                        continue
+                    if not streamed:
+                        streamed = True
+                        CHAT_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, provider=CHAT_PROVIDER.name)
+                    answer.append(text)
+                    yield _sse_event("token", {"text": text})
+        except Exception as exc:
+            print(f"Chatbot stream error: {exc}")
+            failed = True
+
+        if failed or not streamed:
+            if not streamed:
+                CHAT_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, provider="local-fallback")
+            CHAT_STREAMS.inc(outcome="fallback_mid_stream" if streamed else "fallback")
+            fallback_text = get_fallback_response(turn.masked_message)
+            yield _sse_event("fallback", {"text": fallback_text, "partial": streamed})
+            await turn.record(fallback_text)
+            yield _sse_event("done", {"provider": "local-fallback", "session_id": turn.session_id})
+            return
+
+        if cache_key:
+            CHAT_CACHE.set(cache_key, "".join(answer))
+        CHAT_STREAMS.inc(outcome="complete")
+        await turn.record("".join(answer))
+        yield _sse_event("done", {"provider": CHAT_PROVIDER.name, "session_id": turn.session_id})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    file_bytes = await file.read()
-    if not file_bytes:
-        return {"error": "Empty file uploaded"}
+@router.get("/chatbot/sessions/{session_id}")
+async def get_chat_session(
+    session_id: str,
+    current_user: dict = Depends(require_any_role(CHAT_ROLES)),
+):
+    """Stored (masked) turns of a chat session, plus the summary of compacted older turns."""
+    session = await CHAT_SESSIONS.get(session_id, str(current_user["_id"]))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return {
+        "session_id": session["_id"],
+        "turns": session["turns"],
+        "summary": session["summary"],
+        "compacted_turns": session["compacted_turns"],
+    }
 
-    cnn_result = _cnn_stage(file_bytes)
 
-    # Exit early for negative scans to avoid unnecessary compute.
-    if not cnn_result["tumor_detected"]:
-        return {
-            "filename": file.filename,
-            "classification": "Normal",
-            "confidence": cnn_result["confidence"],
-            "pipeline": {
-                "cnn": cnn_result,
-                "segment": None,
-                "slice": None,
-                "vlm": None,
-                "skipped_after_cnn": True,
-            },
-            "segmentation_mask_url": None,
-            "description": "CNN found no significant tumor signal. VLM report skipped to save compute.",
-        }
+@router.delete("/chatbot/sessions/{session_id}")
+async def delete_chat_session(
+    session_id: str,
+    current_user: dict = Depends(require_any_role(CHAT_ROLES)),
+):
+    if not await CHAT_SESSIONS.delete(session_id, str(current_user["_id"])):
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return {"message": "Chat session deleted"}
+
+
+async def _no_progress(stage: str, percent: int) -> None:
+    return None
+
+
+async def _timed_stage(stage: str, batcher: MicroBatcher, upload: SpooledUpload) -> dict[str, Any]:
+    with timed(STAGE_SECONDS, stage, stage=stage):
+        result = await batcher.submit(upload)
+    # Measured inside the batch function (possibly in a worker process).
+    preprocess_seconds = result.pop("_preprocess_seconds", 0.0)
+    if preprocess_seconds:
+        STAGE_SECONDS.observe(preprocess_seconds, stage="preprocess")
+        record_timing("preprocess", preprocess_seconds)
+    STAGE_ITEMS.inc(stage=stage, model_loaded=str(result["model_loaded"]).lower())
+    return result
+
+
+async def _run_pipeline(
+    upload: SpooledUpload, filename: str, progress: Callable[[str, int], Awaitable[None]] = _no_progress
+) -> dict[str, Any]:
+    async with INFERENCE_POOL.admission():
+        await progress("cnn", 20)
+        cnn_result = await _timed_stage("cnn", CNN_BATCHER, upload)
+
+        # Exit early for negative scans to avoid unnecessary compute.
+        if not cnn_result["tumor_detected"]:
+            PIPELINE_RUNS.inc(outcome="skipped_after_cnn")
+            return {
+                "filename": filename,
+                "classification": "Normal",
+                "confidence": cnn_result["confidence"],
+                "pipeline": {
+                    "cnn": cnn_result,
+                    "segment": None,
+                    "slice": None,
+                    "vlm": None,
+                    "skipped_after_cnn": True,
+                },
+                "segmentation_mask_url": None,
+                "description": "CNN found no significant tumor signal. VLM report skipped to save compute.",
+            }
+
+        await progress("segmentation", 40)
+        segment_result, slice_result = await asyncio.gather(
+            _timed_stage("segment", SEGMENT_BATCHER, upload),
+            _timed_stage("slice", SLICE_BATCHER, upload),
+        )
 
-    segment_result = _segment_stage(file_bytes)
-    slice_result = _slice_stage(file_bytes)
-    vlm_result = await _vlm_stage(cnn_result, segment_result, slice_result)
+    await progress("vlm_report", 70)
+    with timed(STAGE_SECONDS, "vlm", stage="vlm"):
+        vlm_result = await _vlm_stage(cnn_result, segment_result, slice_result)
+    VLM_REPORTS.inc(provider=vlm_result["provider"])
+    PIPELINE_RUNS.inc(outcome="full")
 
     return {
-        "filename": file.filename,
+        "filename": filename,
         "classification": "Tumor Detected",
         "confidence": cnn_result["confidence"],
         "pipeline": {
@@ -437,3 +941,525 @@ async def analyze_medical_image(
         "segmentation_mask_url": segment_result["segmentation_mask_url"],
         "description": vlm_result["report"],
     }
+
+
+def _wants_timings(header: Optional[str]) -> bool:
+    return (header or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+@router.post("/analyze-image")
+async def analyze_medical_image(
+    file: UploadFile = File(...),
+    debug_timings: Optional[str] = Header(None, alias="X-Debug-Timings"),
+    current_user: dict = Depends(require_any_role([UserRole.DOCTOR, UserRole.LAB_TECHNICIAN])),
+):
+    """
+    4-stage pipeline: CNN -> Segment -> Slice -> VLM.
+    The VLM stage runs only when CNN predicts tumor-positive to save compute.
+    Send `X-Debug-Timings: 1` to get a `timings` block (milliseconds per stage).
+    """
+    if not file.filename:
+        return {"error": "No file provided"}
+
+    started = time.perf_counter()
+    with collect_timings() as timings:
+        with timed(STAGE_SECONDS, "ingest", stage="ingest"):
+            upload = await ingest_upload(file, settings.AI_UPLOAD_MAX_BYTES)
+        with upload:
+            if not upload.size:
+                return {"error": "Empty file uploaded"}
+
+            with timed(STAGE_SECONDS, "model_wait", stage="model_wait"):
+                ready = await PIPELINE_MODELS.wait_ready(settings.AI_MODEL_WAIT_SECONDS)
+            if not ready:
+                raise _overloaded_exception("AI models are still loading. Please retry shortly.")
+
+            try:
+                result, cache_hit = await _analyze_upload(upload, file.filename)
+            except InferenceOverloaded:
+                raise _overloaded_exception()
+
+    ANALYSES.inc(cached=str(cache_hit).lower())
+    await _grant_mask_access(result, current_user)
+    result["filename"] = file.filename
+    result["cached"] = cache_hit
+    if _wants_timings(debug_timings):
+        result["timings"] = {**timings, "total_ms": round((time.perf_counter() - started) * 1000, 3)}
+    return result
+
+
+async def _analyze_upload(
+    upload: SpooledUpload, filename: str, progress: Callable[[str, int], Awaitable[None]] = _no_progress
+) -> tuple[dict[str, Any], bool]:
+    """Run the pipeline through the analysis cache; returns ``(result, cache_hit)``."""
+    if not settings.AI_CACHE_ENABLED:
+        return await _run_pipeline(upload, filename, progress), False
+
+    def compute() -> Awaitable[dict[str, Any]]:
+        # The shielded computation can outlive this request, whose upload is
+        # closed on the way out; hold the content until the pipeline is done.
+        release = upload.retain()
+
+        async def run() -> dict[str, Any]:
+            try:
+                return await _run_pipeline(upload, filename, progress)
+            finally:
+                release()
+
+        return run()
+
+    return await ANALYSIS_CACHE.get_or_compute(
+        _analysis_cache_key(upload.sha256), compute, should_store=_is_cacheable
+    )
+
+
+def _read_lab_report(path: str, encrypted: bool, filename: str) -> SpooledUpload:
+    """Load a stored report into a spooled upload, decrypting segment by segment."""
+    upload = SpooledUpload(filename=filename, memory_limit=settings.UPLOAD_SPOOL_MEMORY_BYTES)
+    try:
+        if encrypted:
+            with EncryptedFile(path) as report:
+                for chunk in report.iter_range():
+                    upload.write(chunk)
+        else:
+            with open(path, "rb") as handle:
+                while chunk := handle.read(settings.UPLOAD_CHUNK_BYTES):
+                    upload.write(chunk)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+async def run_lab_report_analysis(job: Job) -> dict[str, Any]:
+    """Background job: analyze an uploaded lab report and store the result on it."""
+    payload = job.payload
+
+    async def report_progress(stage: str, percent: int) -> None:
+        # Called from inside the analysis, which other requests for the same
+        # content may share, so a lost lease or a Mongo error must not fail it.
+        try:
+            await job.progress(stage, percent)
+        except Exception as exc:
+            print(f"[AI] Progress update for job {job.id} failed: {exc}")
+
+    await job.progress("reading_report", 5)
+    upload = await asyncio.to_thread(_read_lab_report, payload["report_url"], payload["encrypted"], payload["filename"])
+    with upload:
+        await job.progress("waiting_for_models", 10)
+        if not await PIPELINE_MODELS.wait_ready(settings.AI_MODEL_WAIT_SECONDS):
+            raise RuntimeError("AI models are still loading")
+        result, cache_hit = await _analyze_upload(upload, payload["filename"], report_progress)
+
+    result["filename"] = payload["filename"]
+    result["cached"] = cache_hit
+    # Raises JobLeaseLost if another worker took the job over meanwhile, so
+    # only the current lease holder writes the result.
+    await job.progress("saving_result", 95)
+    await db.client[settings.DATABASE_NAME]["lab_reports"].update_one(
+        {"_id": ObjectId(payload["report_id"])},
+        {
+            "$set": {
+                "ai_analysis_result": result,
+                "ai_analysis_status": "completed",
+                "ai_analysis_error": None,
+                "segmentation_mask_id": _mask_id(result),
+            }
+        },
+    )
+    return {
+        "report_id": payload["report_id"],
+        "classification": result["classification"],
+        "confidence": result["confidence"],
+        "segmentation_mask_url": result["segmentation_mask_url"],
+        "cached": cache_hit,
+    }
+
+
+async def _lab_report_analysis_failed(job: Job, error: str) -> None:
+    await db.client[settings.DATABASE_NAME]["lab_reports"].update_one(
+        {"_id": ObjectId(job.payload["report_id"])},
+        {"$set": {"ai_analysis_status": "failed", "ai_analysis_error": error}},
+    )
+
+
+job_queue.register(LAB_REPORT_ANALYSIS, run_lab_report_analysis, on_failed=_lab_report_analysis_failed)
+
+
+def _parse_planes(planes: str) -> list[str]:
+    selected = [plane.strip().lower() for plane in planes.split(",") if plane.strip()]
+    invalid = [plane for plane in selected if plane not in PLANE_AXES]
+    if invalid or not selected:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"planes must be a comma-separated subset of {', '.join(PLANE_AXES)}",
+        )
+    return list(dict.fromkeys(selected))
+
+
+async def _stream_volume_scores(
+    volume: NiftiVolume,
+    filename: str,
+    planes: list[str],
+    stride: int,
+    resources: AsyncExitStack,
+):
+    async with resources:
+        yield json.dumps({"type": "volume", "filename": filename, "planes": planes, **volume.describe()}) + "\n"
+
+        threshold = settings.AI_SLICE_THRESHOLD
+        suspicious = {plane: 0 for plane in planes}
+        scored = 0
+        max_score = 0.0
+        try:
+            for refs in volume.iter_slice_refs(planes, settings.AI_VOLUME_BATCH_SIZE, stride):
+                # Only this batch of slices is materialised; the volume stays mapped.
+                slices = await asyncio.to_thread(volume.get_slices, refs)
+                scores = await INFERENCE_POOL.run(_volume_slice_batch, slices)
+                del slices
+                for (plane, index), score in zip(refs, scores):
+                    is_suspicious = score >= threshold
+                    suspicious[plane] += int(is_suspicious)
+                    scored += 1
+                    max_score = max(max_score, score)
+                    yield json.dumps(
+                        {"type": "slice", "plane": plane, "index": index, "score": score, "suspicious": is_suspicious}
+                    ) + "\n"
+        except Exception as exc:
+            print(f"[AI] Volume analysis failed for {filename}: {exc}")
+            yield json.dumps({"type": "error", "detail": "Volume analysis failed"}) + "\n"
+            return
+
+        total_suspicious = sum(suspicious.values())
+        yield json.dumps(
+            {
+                "type": "summary",
+                "slices_scored": scored,
+                "dominant_plane": max(planes, key=lambda plane: suspicious[plane]),
+                "suspicious_slices": total_suspicious,
+                "suspicious_by_plane": suspicious,
+                "max_score": max_score,
+                "classification": "Tumor Detected" if total_suspicious else "Normal",
+                "model_loaded": PIPELINE_MODELS.cnn is not None,
+            }
+        ) + "\n"
+
+
+@router.post("/analyze-volume")
+async def analyze_volume(
+    file: UploadFile = File(...),
+    planes: str = Form("axial,coronal,sagittal"),
+    stride: int = Form(1),
+    current_user: dict = Depends(require_any_role([UserRole.DOCTOR, UserRole.LAB_TECHNICIAN])),
+):
+    """
+    Slice a NIfTI volume (.nii / .nii.gz) along the requested planes and score
+    every slice with the CNN in batches. Streams NDJSON: a `volume` header line,
+    one `slice` line per scored slice as it completes, then a `summary` line.
+    """
+    if not is_nifti_filename(file.filename):
+        raise HTTPException(status_code=400, detail="Upload a NIfTI volume (.nii or .nii.gz)")
+    selected_planes = _parse_planes(planes)
+    if stride < 1:
+        raise HTTPException(status_code=400, detail="stride must be at least 1")
+
+    resources = AsyncExitStack()
+    try:
+        upload = await ingest_upload(file, settings.AI_VOLUME_MAX_BYTES)
+        resources.callback(upload.close)
+        try:
+            volume, inflated = await asyncio.to_thread(open_volume, upload)
+        except VolumeError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        if inflated is not None:
+            resources.callback(inflated.close)
+
+        if not await PIPELINE_MODELS.wait_ready(settings.AI_MODEL_WAIT_SECONDS):
+            raise _overloaded_exception("AI models are still loading. Please retry shortly.")
+        try:
+            await resources.enter_async_context(INFERENCE_POOL.admission())
+        except InferenceOverloaded:
+            raise _overloaded_exception()
+    except BaseException:
+        await resources.aclose()
+        raise
+
+    return StreamingResponse(
+        _stream_volume_scores(volume, file.filename, selected_planes, stride, resources),
+        media_type="application/x-ndjson",
+    )
+
+
+def _is_zip_upload(file: UploadFile) -> bool:
+    return (file.filename or "").lower().endswith(".zip") or file.content_type in (
+        "application/zip",
+        "application/x-zip-compressed",
+    )
+
+
+def _zip_members(archive: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    """Regular files in an archive, skipping directories and macOS/hidden metadata."""
+    return [
+        info
+        for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and not Path(info.filename).name.startswith(".")
+    ]
+
+
+def _extract_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> SpooledUpload:
+    """Decompress one archive member in chunks; the declared size is not trusted."""
+    upload = SpooledUpload(filename=info.filename, memory_limit=settings.UPLOAD_SPOOL_MEMORY_BYTES)
+    try:
+        with archive.open(info) as member:
+            while True:
+                chunk = member.read(settings.UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if upload.size + len(chunk) > settings.AI_UPLOAD_MAX_BYTES:
+                    raise ValueError(f"File exceeds the upload limit of {settings.AI_UPLOAD_MAX_BYTES} bytes")
+                upload.write(chunk)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+def _ready(upload: SpooledUpload) -> Callable[[], Awaitable[SpooledUpload]]:
+    async def load() -> SpooledUpload:
+        return upload
+
+    return load
+
+
+def _batch_error(index: int, filename: str, detail: str) -> dict[str, Any]:
+    return {"type": "error", "index": index, "filename": filename, "detail": detail}
+
+
+async def _analyze_batch_item(
+    index: int, filename: str, load: Callable[[], Awaitable[SpooledUpload]], user: dict, with_timings: bool
+) -> dict[str, Any]:
+    def error(detail: str) -> dict[str, Any]:
+        return _batch_error(index, filename, detail)
+
+    started = time.perf_counter()
+    with collect_timings() as timings:
+        try:
+            upload = await load()
+        except (
+            zipfile.BadZipFile,
+            zlib.error,
+            EOFError,
+            OSError,
+            ValueError,
+            RuntimeError,
+            NotImplementedError,
+        ) as exc:
+            # Corrupt or truncated archive members fail here, one file at a time.
+            return error(str(exc) or "Could not read file from archive")
+        with upload:
+            if not upload.size:
+                return error("Empty file")
+            try:
+                result, cache_hit = await _analyze_upload(upload, filename)
+            except InferenceOverloaded:
+                return error("AI analysis is at capacity. Please retry this file.")
+            except Exception as exc:
+                print(f"[AI] Batch analysis failed for {filename}: {exc}")
+                return error("Analysis failed")
+    ANALYSES.inc(cached=str(cache_hit).lower())
+    await _grant_mask_access(result, user)
+    line = {**result, "type": "result", "index": index, "filename": filename, "cached": cache_hit}
+    if with_timings:
+        line["timings"] = {**timings, "total_ms": round((time.perf_counter() - started) * 1000, 3)}
+    return line
+
+
+async def _stream_batch_results(
+    items: list[tuple[str, Callable[[], Awaitable[SpooledUpload]]]],
+    resources: AsyncExitStack,
+    user: dict,
+    with_timings: bool = False,
+):
+    async with resources:
+        started = time.perf_counter()
+        yield json.dumps({"type": "batch", "files": len(items)}) + "\n"
+
+        # Only AI_BATCH_CONCURRENCY files are loaded and in the pipeline at once;
+        # results are written as each one finishes, not in upload order.
+        slots = asyncio.Semaphore(settings.AI_BATCH_CONCURRENCY)
+        finished: asyncio.Queue = asyncio.Queue()
+        tasks: list[asyncio.Task] = []
+
+        async def run(index: int, filename: str, load: Callable[[], Awaitable[SpooledUpload]]) -> None:
+            try:
+                line = await _analyze_batch_item(index, filename, load, user, with_timings)
+            except Exception as exc:
+                # Every file must produce a line, or the loop below waits forever.
+                print(f"[AI] Batch item {filename} failed: {exc}")
+                line = _batch_error(index, filename, "Analysis failed")
+            finally:
+                slots.release()
+            await finished.put(line)
+
+        async def feed() -> None:
+            for index, (filename, load) in enumerate(items):
+                await slots.acquire()
+                tasks.append(asyncio.create_task(run(index, filename, load)))
+
+        feeder = asyncio.create_task(feed())
+        succeeded = failed = 0
+        try:
+            for _ in items:
+                line = await finished.get()
+                if line["type"] == "result":
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield json.dumps(line) + "\n"
+        finally:
+            # Client went away (or we are done): stop feeding and drop in-flight work.
+            feeder.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(feeder, *tasks, return_exceptions=True)
+
+        yield json.dumps(
+            {
+                "type": "summary",
+                "files": len(items),
+                "succeeded": succeeded,
+                "failed": failed,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+        ) + "\n"
+
+
+@router.post("/analyze-batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    debug_timings: Optional[str] = Header(None, alias="X-Debug-Timings"),
+    current_user: dict = Depends(require_any_role([UserRole.DOCTOR, UserRole.LAB_TECHNICIAN])),
+):
+    """
+    Analyze many scans in one request: several files, zip archives of a study
+    folder, or both. Archive members are decompressed one at a time as they are
+    scheduled, never all at once. Files run concurrently through the
+    CNN -> Segment -> Slice -> VLM pipeline and stream back as NDJSON in
+    completion order: a `batch` header, one `result` or `error` line per file
+    (with its `index` and `filename`), then a `summary` line. A file that fails
+    only produces its own `error` line. `X-Debug-Timings: 1` adds `timings`
+    to each result.
+    """
+    resources = AsyncExitStack()
+    items: list[tuple[str, Callable[[], Awaitable[SpooledUpload]]]] = []
+    total_bytes = 0
+    try:
+        for file in files:
+            # The form's files are closed once this handler returns, so copy them
+            # into our own spools (mostly on disk) before streaming starts.
+            upload = await ingest_upload(
+                file,
+                settings.AI_BATCH_MAX_BYTES if _is_zip_upload(file) else settings.AI_UPLOAD_MAX_BYTES,
+                memory_limit=settings.AI_BATCH_SPOOL_MEMORY_BYTES,
+            )
+            resources.callback(upload.close)
+            total_bytes += upload.size
+            if total_bytes > settings.AI_BATCH_MAX_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Batch exceeds the limit of {settings.AI_BATCH_MAX_BYTES} bytes",
+                )
+
+            if not _is_zip_upload(file):
+                items.append((file.filename or f"file-{len(items)}", _ready(upload)))
+                continue
+
+            try:
+                archive = zipfile.ZipFile(upload.reader())
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not a valid zip archive")
+            resources.callback(archive.close)
+            for info in _zip_members(archive):
+                items.append((info.filename, functools.partial(asyncio.to_thread, _extract_member, archive, info)))
+
+        if not items:
+            raise HTTPException(status_code=400, detail="No files to analyze")
+        if len(items) > settings.AI_BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"A batch can contain at most {settings.AI_BATCH_MAX_FILES} files")
+        if not await PIPELINE_MODELS.wait_ready(settings.AI_MODEL_WAIT_SECONDS):
+            raise _overloaded_exception("AI models are still loading. Please retry shortly.")
+    except BaseException:
+        await resources.aclose()
+        raise
+
+    return StreamingResponse(
+        _stream_batch_results(items, resources, current_user, _wants_timings(debug_timings)),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.get("/masks/{mask_id}")
+async def get_segmentation_mask(
+    mask_id: str,
+    x: int = Query(0, ge=0),
+    y: int = Query(0, ge=0),
+    width: Optional[int] = Query(None, ge=1),
+    height: Optional[int] = Query(None, ge=1),
+    downsample: Optional[int] = Query(None, ge=1, le=64),
+    format: str = Query("packed", pattern="^(packed|rle)$"),
+    current_user: dict = Depends(require_any_role([UserRole.DOCTOR, UserRole.LAB_TECHNICIAN])),
+):
+    """
+    Serve a stored segmentation mask, optionally cropped to a tile and downsampled.
+    Without an explicit `downsample` the mask is reduced until it fits within
+    AI_MASK_MAX_TILE_PIXELS. `packed` returns row-wise bit-packed bytes (each row
+    padded to a byte) with the geometry in X-Mask-* headers; `rle` returns JSON
+    run lengths that alternate background/foreground, starting with background.
+    Available to whoever received the mask from an analysis, and to users who
+    may see the lab report it was recorded on.
+    """
+    await _authorize_mask(mask_id, current_user)
+    try:
+        blob = await asyncio.to_thread(load_mask, mask_id)
+    except MaskNotFound:
+        raise HTTPException(status_code=404, detail="Mask not found")
+
+    region, factor = await asyncio.to_thread(
+        read_mask_region, blob, x, y, width, height, downsample, settings.AI_MASK_MAX_TILE_PIXELS
+    )
+    geometry = {"x": x, "y": y, "width": int(region.shape[1]), "height": int(region.shape[0]), "downsample": factor}
+    if format == "rle":
+        return {**geometry, "rle": rle_runs(region.reshape(-1)).tolist()}
+
+    return Response(
+        content=pack_rows(region),
+        media_type="application/octet-stream",
+        headers={f"X-Mask-{key.title()}": str(value) for key, value in geometry.items()},
+    )
+
+
+@router.get("/models")
+async def get_model_status(
+    current_user: dict = Depends(require_any_role([UserRole.DOCTOR, UserRole.LAB_TECHNICIAN])),
+):
+    """Load state, device, load time and warmup latency for each pipeline model."""
+    return {**PIPELINE_MODELS.snapshot(), "llm": [provider.snapshot() for provider in active_providers()]}
+
+
+@router.get("/inference/stats")
+async def get_inference_stats(current_user: dict = Depends(require_role(UserRole.ADMIN))):
+    """Batch-size and queue-wait statistics per pipeline stage, for tuning the batching window."""
+    return {
+        "pool": INFERENCE_POOL.snapshot(),
+        "cache": ANALYSIS_CACHE.snapshot(),
+        "llm": [provider.snapshot() for provider in active_providers()],
+        "chatbot": REGISTRY.snapshot("chatbot_"),
+        "chatbot_cache": CHAT_CACHE.snapshot(),
+        "chatbot_sessions": CHAT_SESSIONS.snapshot(),
+        "pii_masking": PII_MASKER.snapshot(),
+        "jobs": await job_queue.snapshot(),
+        "password_hashing": password_hasher.snapshot(),
+        "stages": [batcher.snapshot() for batcher in (CNN_BATCHER, SEGMENT_BATCHER, SLICE_BATCHER)],
+    }
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from app.auth.dependencies import get_current_user, require_role
 from app.core.database import get_database
-from app.core.crypto import encrypt_text, decrypt_text
+from app.core.crypto import encrypt_text, decrypt_text, decrypt_texts_async
 from app.models.appointment import Appointment, AppointmentCreate, AppointmentStatus
 from app.models.user import UserRole
 from bson import ObjectId
@@ -67,9 +67,10 @@ async def get_appointments(
     if current_doctor_id:
         total_doctors = await db["users"].count_documents({"role": UserRole.DOCTOR.value})
 
-    for appt in appts:
+    symptoms = await decrypt_texts_async([appt.get("symptoms") for appt in appts])
+    for appt, appt_symptoms in zip(appts, symptoms):
         appt["id"] = str(appt["_id"])
-        appt["symptoms"] = decrypt_text(appt.get("symptoms"))
+        appt["symptoms"] = appt_symptoms
         appt.setdefault("doctor_id", None)
         appt["doctor_name"] = doctor_name_map.get(appt.get("doctor_id"))
         appt.setdefault("rejected_doctor_ids", [])
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Form, UploadFile, File, Request
 from fastapi.security import OAuth2PasswordRequestForm
+from app.auth.dependencies import invalidate_principal
 from app.core.database import get_database
-from app.core.security import verify_password, create_access_token, get_password_hash
+from app.core.security import PASSWORD_REHASHED, PasswordHasherBusy, create_access_token, password_hasher
 from app.models.user import Token, UserResponse, UserRole
 from datetime import timedelta, datetime
 from app.core.config import settings
@@ -16,6 +17,14 @@ import cloudinary.uploader
 router = APIRouter()
 
 
+def _hashing_busy_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-in requests right now. Please retry shortly.",
+        headers={"Retry-After": str(settings.PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+    )
+
+
 def _extract_requester_role(request: Request) -> Optional[str]:
     auth_header = request.headers.get("authorization")
     if not auth_header:
@@ -111,7 +120,10 @@ async def register(
                 detail=f"Certificate upload failed: {str(e)}"
             )
 
-    hashed_password = get_password_hash(password)
+    try:
+        hashed_password = await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _hashing_busy_exception()
 
     sleep_hours = None
     if role == UserRole.PATIENT:
@@ -165,7 +177,11 @@ async def login(
     db = Depends(get_database)
 ):
     user = await db["users"].find_one({"email": form_data.username})
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    try:
+        password_ok = bool(user) and await password_hasher.verify(form_data.password, user["hashed_password"])
+    except PasswordHasherBusy:
+        raise _hashing_busy_exception()
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -186,16 +202,25 @@ async def login(
         )
 
     client_ip = request.headers.get("x-forwarded-for") or (request.client.host if request.client else None)
+    login_fields = {
+        "last_login_at": datetime.utcnow(),
+        "last_login_ip": client_ip,
+    }
+    if password_hasher.needs_rehash(user["hashed_password"]):
+        # BCRYPT_ROUNDS changed since this hash was made; upgrade it while we have the password.
+        try:
+            login_fields["hashed_password"] = await password_hasher.hash(form_data.password)
+            PASSWORD_REHASHED.inc()
+        except PasswordHasherBusy:
+            pass
     await db["users"].update_one(
         {"_id": user["_id"]},
         {
-            "$set": {
-                "last_login_at": datetime.utcnow(),
-                "last_login_ip": client_ip,
-            },
+            "$set": login_fields,
             "$inc": {"login_count": 1},
         },
     )
+    invalidate_principal(user["email"])
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
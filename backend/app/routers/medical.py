@@ -1,14 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, Header, HTTPException, UploadFile, File, Form
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from typing import List
-from app.auth.dependencies import get_current_user, require_role
+from app.auth.dependencies import authorize_lab_report, get_current_user, require_any_role, require_role
+from app.core.config import settings
 from app.core.database import get_database
-from app.core.crypto import decrypt_text, encrypt_bytes, encrypt_text
+from app.core.crypto import EncryptedFile, StreamEncryptor, decrypt_text, decrypt_texts_async, encrypt_text, get_cipher
 from app.models.medical import (
     Prescription, PrescriptionCreate, LabRequest, LabRequestCreate, LabReport, LabRequestStatus
 )
 from app.models.user import UserRole
+from app.services.jobs import LAB_REPORT_ANALYSIS, TERMINAL_STATUSES, job_queue, public_job
+from app.services.uploads import save_upload
 from bson import ObjectId
+from datetime import datetime
+from typing import Optional
+import asyncio
+import json
+import mimetypes
 import os
+import re
 from uuid import uuid4
 
 router = APIRouter()
@@ -45,9 +56,10 @@ async def get_prescriptions(
     # Pharmacy sees all undisclosed or maybe filter by ID if passed? For now all
     
     prescriptions = await db["prescriptions"].find(query).to_list(100)
-    for p in prescriptions:
+    notes = await decrypt_texts_async([p.get("notes") for p in prescriptions])
+    for p, p_notes in zip(prescriptions, notes):
         p["id"] = str(p["_id"])
-        p["notes"] = decrypt_text(p.get("notes"))
+        p["notes"] = p_notes
     return prescriptions
 
 @router.put("/prescriptions/{rx_id}/dispense", response_model=Prescription)
@@ -122,29 +134,25 @@ async def upload_lab_report(
     _, extension = os.path.splitext(original_name)
     stored_name = f"{uuid4().hex}{extension or '.bin'}"
 
-    raw_file = await file.read()
-    if not raw_file:
-        raise HTTPException(status_code=400, detail="Empty file uploaded")
-
-    encrypted_file, was_encrypted = encrypt_bytes(raw_file)
+    # Encrypted segment by segment as it is read, so the plaintext is never
+    # held in memory or written to disk in full.
+    was_encrypted = get_cipher() is not None
+    encryptor = StreamEncryptor() if was_encrypted else None
     if was_encrypted:
         stored_name = f"{stored_name}.enc"
-
     file_location = os.path.join(upload_dir, stored_name)
-    with open(file_location, "wb") as buffer:
-        buffer.write(encrypted_file)
+    if not await save_upload(file, file_location, encryptor):
+        os.remove(file_location)
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
     
-    # Placeholder for AI analysis
-    ai_result = None
-    if ai_analysis:
-        ai_result = {"diagnosis": "Normal", "confidence": 0.98, "details": "No anomalies detected in the scan."}
-
     report_data = {
         "lab_request_id": request_id,
         "report_url": file_location,
         "report_encrypted": was_encrypted,
         "technician_id": str(current_user["_id"]),
-        "ai_analysis_result": ai_result
+        "ai_analysis_result": None,
+        "ai_analysis_status": "pending" if ai_analysis else None,
+        "created_at": datetime.utcnow(),
     }
     
     new_report = await db["lab_reports"].insert_one(report_data)
@@ -154,6 +162,20 @@ async def upload_lab_report(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid Request ID")
 
+    # AI analysis runs on the background job workers; the dashboard polls the job.
+    job_id = None
+    if ai_analysis:
+        job_id = await job_queue.enqueue(
+            LAB_REPORT_ANALYSIS,
+            {
+                "report_id": str(new_report.inserted_id),
+                "report_url": file_location,
+                "encrypted": was_encrypted,
+                "filename": original_name,
+            },
+        )
+        await db["lab_reports"].update_one({"_id": new_report.inserted_id}, {"$set": {"ai_analysis_job_id": job_id}})
+
     # Update request status
     await db["lab_requests"].update_one(
         {"_id": req_oid},
@@ -163,6 +185,8 @@ async def upload_lab_report(
     created_report = await db["lab_reports"].find_one({"_id": new_report.inserted_id})
     created_report["id"] = str(created_report["_id"])
     del created_report["_id"]
+    created_report["job_id"] = job_id
+    created_report["status"] = created_report["ai_analysis_status"]
     
     # Return a dict that matches LabReport schema partially or fully, 
     # but router return type isn't strict here due to Form/File mix complexity often needing manual return
@@ -185,3 +209,148 @@ async def get_lab_report(
     report["id"] = str(report["_id"])
     # Add privacy check here (only patient, doctor, tech involved)
     return report
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _parse_range(header: str, size: int) -> tuple[int, int]:
+    """Single ``bytes=`` range as ``(start, end)`` with ``end`` exclusive."""
+    match = _RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        raise HTTPException(status_code=416, detail="Only single byte ranges are supported",
+                            headers={"Content-Range": f"bytes */{size}"})
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last) + 1, size) if last else size
+    else:
+        start, end = max(0, size - int(last)), size
+    if start >= end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+class _PlainFile:
+    def __init__(self, path: str):
+        self._handle = open(path, "rb")
+        self.size = os.fstat(self._handle.fileno()).st_size
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None):
+        end = self.size if end is None else end
+        self._handle.seek(start)
+        while start < end:
+            chunk = self._handle.read(min(settings.UPLOAD_CHUNK_BYTES, end - start))
+            if not chunk:
+                break
+            start += len(chunk)
+            yield chunk
+
+    def close(self):
+        self._handle.close()
+
+@router.get("/lab-reports/{report_id}/file")
+async def download_lab_report_file(
+    report_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    db = Depends(get_database),
+    current_user = Depends(get_current_user)
+):
+    """The uploaded report file, decrypted as it streams. Supports a single
+    ``Range: bytes=start-end`` for partial reads; only the segments covering the
+    range are decrypted."""
+    try:
+        rep_oid = ObjectId(report_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid Report ID")
+
+    report = await db["lab_reports"].find_one({"_id": rep_oid})
+    if not report or not report.get("report_url"):
+        raise HTTPException(status_code=404, detail="Report not found")
+
+    await authorize_lab_report(db, report, current_user)
+
+    path = report["report_url"]
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Report file not found")
+    opener = EncryptedFile if report.get("report_encrypted") else _PlainFile
+    # Single-shot .enc files are decrypted whole on open, so keep that off the loop.
+    source = await asyncio.to_thread(opener, path)
+
+    headers = {"Accept-Ranges": "bytes"}
+    status_code = 200
+    start, end = 0, source.size
+    if range_header:
+        try:
+            start, end = _parse_range(range_header, source.size)
+        except HTTPException:
+            source.close()
+            raise
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{source.size}"
+    headers["Content-Length"] = str(end - start)
+
+    def body():
+        # A sync generator: StreamingResponse iterates it in the threadpool.
+        try:
+            yield from source.iter_range(start, end)
+        finally:
+            source.close()
+
+    media_type = mimetypes.guess_type(path.removesuffix(".enc"))[0] or "application/octet-stream"
+    return StreamingResponse(body(), status_code=status_code, media_type=media_type, headers=headers)
+
+# --- AI ANALYSIS JOBS ---
+
+async def _get_analysis_job(job_id: str) -> dict:
+    job = await job_queue.get(job_id)
+    if not job or job["kind"] != LAB_REPORT_ANALYSIS:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    return job
+
+async def _authorize_analysis_job(db, job: dict, current_user: dict) -> None:
+    # The job carries the report's analysis result, so it is shown to whoever may see the report.
+    try:
+        report = await db["lab_reports"].find_one({"_id": ObjectId(job["payload"]["report_id"])})
+    except Exception:
+        report = None
+    if not report:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    await authorize_lab_report(db, report, current_user)
+
+@router.get("/analysis-jobs/{job_id}")
+async def get_analysis_job(
+    job_id: str,
+    db = Depends(get_database),
+    current_user = Depends(require_any_role([UserRole.LAB_TECHNICIAN, UserRole.DOCTOR, UserRole.ADMIN]))
+):
+    """Status and progress of a lab report analysis job."""
+    job = await _get_analysis_job(job_id)
+    await _authorize_analysis_job(db, job, current_user)
+    return jsonable_encoder(public_job(job))
+
+@router.get("/analysis-jobs/{job_id}/events")
+async def analysis_job_events(
+    job_id: str,
+    db = Depends(get_database),
+    current_user = Depends(require_any_role([UserRole.LAB_TECHNICIAN, UserRole.DOCTOR, UserRole.ADMIN]))
+):
+    """Server-sent events: a ``progress`` event on every change, then ``done`` once the job finishes."""
+    job = await _get_analysis_job(job_id)
+    await _authorize_analysis_job(db, job, current_user)
+
+    async def events():
+        current, last = public_job(job), None
+        while True:
+            state = (current["status"], current["progress"], current["attempts"])
+            if current["status"] in TERMINAL_STATUSES:
+                yield f"event: done\ndata: {json.dumps(jsonable_encoder(current))}\n\n"
+                return
+            if state != last:
+                yield f"event: progress\ndata: {json.dumps(jsonable_encoder(current))}\n\n"
+                last = state
+            await asyncio.sleep(settings.JOB_EVENTS_POLL_SECONDS)
+            current = public_job(await _get_analysis_job(job_id))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
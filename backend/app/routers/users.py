@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from typing import List
-from app.auth.dependencies import get_current_user, require_role
+from app.auth.dependencies import get_current_user, invalidate_principal, require_role
 from app.core.database import get_database
 from app.models.user import UserResponse, UserRole, UserInDB
 from bson import ObjectId
@@ -58,9 +58,10 @@ async def delete_user(
     if str(obj_id) == str(current_user["_id"]):
          raise HTTPException(status_code=400, detail="Cannot delete self")
 
-    result = await db["users"].delete_one({"_id": obj_id})
-    if result.deleted_count == 0:
+    deleted = await db["users"].find_one_and_delete({"_id": obj_id}, projection={"email": 1})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="User not found")
+    invalidate_principal(deleted["email"])
     
     return {"message": "User deleted successfully"}
 
@@ -86,6 +87,7 @@ async def verify_staff_user(
         {"_id": obj_id},
         {"$set": {"is_verified": True, "is_rejected": False}},
     )
+    invalidate_principal(user["email"])
 
     updated_user = await db["users"].find_one({"_id": obj_id})
     updated_user["id"] = str(updated_user["_id"])
@@ -113,6 +115,7 @@ async def reject_staff_user(
         {"_id": obj_id},
         {"$set": {"is_verified": False, "is_rejected": True}},
     )
+    invalidate_principal(user["email"])
 
     updated_user = await db["users"].find_one({"_id": obj_id})
     updated_user["id"] = str(updated_user["_id"])
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import db
+from app.core.metrics import REGISTRY, record_timing
+
+COLLECTION_NAME = "analysis_cache"
+
+CACHE_LOOKUP_SECONDS = REGISTRY.histogram(
+    "ai_analysis_cache_lookup_seconds",
+    "Analysis cache lookup time by result (memory_hit, persistent_hit, miss, error).",
+    labelnames=("result",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+class AnalysisCache:
+    """Two-tier cache for pipeline results keyed by content hash and model versions.
+
+    Lookups hit the in-process LRU first, then the ``analysis_cache`` Mongo
+    collection (expired by a TTL index). Concurrent misses for the same key are
+    coalesced so the pipeline runs once and every caller receives its result.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.memory = TTLCache(max_entries, ttl_seconds)
+        self.persistent_hits = 0
+        self.coalesced = 0
+        self._in_flight: dict[str, asyncio.Task] = {}
+
+    def _collection(self) -> Any:
+        if db.client is None:
+            return None
+        return db.client[settings.DATABASE_NAME][COLLECTION_NAME]
+
+    async def ensure_indexes(self) -> None:
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            await collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        except Exception as exc:
+            print(f"[AI] Could not create analysis cache TTL index: {exc}")
+
+    async def get(self, key: str) -> Optional[dict[str, Any]]:
+        started = time.perf_counter()
+        result = "miss"
+        try:
+            cached = self.memory.get(key)
+            if cached is not None:
+                result = "memory_hit"
+                return copy.deepcopy(cached)
+
+            collection = self._collection()
+            if collection is None:
+                return None
+            try:
+                document = await collection.find_one({"_id": key})
+            except Exception as exc:
+                print(f"[AI] Analysis cache lookup failed: {exc}")
+                result = "error"
+                return None
+            if not document:
+                return None
+
+            result = "persistent_hit"
+            self.persistent_hits += 1
+            self.memory.set(key, document["result"])
+            return copy.deepcopy(document["result"])
+        finally:
+            elapsed = time.perf_counter() - started
+            CACHE_LOOKUP_SECONDS.observe(elapsed, result=result)
+            record_timing("cache_lookup", elapsed)
+
+    async def set(self, key: str, result: dict[str, Any]) -> None:
+        self.memory.set(key, copy.deepcopy(result))
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            await collection.replace_one(
+                {"_id": key},
+                {"_id": key, "result": result, "created_at": datetime.utcnow()},
+                upsert=True,
+            )
+        except Exception as exc:
+            print(f"[AI] Analysis cache write failed: {exc}")
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[dict[str, Any]]],
+        should_store: Callable[[dict[str, Any]], bool] = lambda _: True,
+    ) -> tuple[dict[str, Any], bool]:
+        """Return ``(result, cache_hit)``, running ``compute`` at most once per key.
+
+        The computation is shielded so coalesced callers still get it when the
+        caller that started it goes away; it can therefore outlive that caller.
+        ``compute`` is called synchronously, before this method first yields,
+        so it can take its own hold on inputs the caller will release.
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            return cached, True
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            work = compute()
+
+            async def run() -> dict[str, Any]:
+                try:
+                    result = await work
+                    if should_store(result):
+                        await self.set(key, result)
+                    return result
+                finally:
+                    self._in_flight.pop(key, None)
+
+            # A separate task so one caller disconnecting does not cancel the others.
+            task = asyncio.ensure_future(run())
+            self._in_flight[key] = task
+
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result), False
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "memory": self.memory.snapshot(),
+            "persistent_hits": self.persistent_hits,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+from typing import Any, Optional
+
+from app.core.cache import TTLCache
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+def normalize_question(text: str) -> str:
+    """Case-fold and collapse whitespace so trivially different phrasings share a key."""
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", text).strip().casefold())
+
+
+class ChatAnswerCache:
+    """TTL/LRU cache of chatbot answers keyed by the masked conversation.
+
+    Keys are built only from already-masked text, so no PII ends up in the
+    cache. The current question is normalized; the last ``history_turns``
+    messages are hashed in verbatim, so a follow-up like "what about its
+    treatment?" only hits when the preceding turns match too.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, history_turns: int) -> None:
+        self.history_turns = max(0, history_turns)
+        self.memory = TTLCache(max_entries, ttl_seconds)
+        self.bypassed = 0
+
+    def key(self, messages: list[dict[str, str]], namespace: str = "") -> str:
+        *history, current = messages
+        recent = history[-self.history_turns :] if self.history_turns else []
+        history_hash = hashlib.sha256(
+            json.dumps(
+                [(turn["role"], turn["text"]) for turn in recent],
+                ensure_ascii=False,
+            ).encode("utf-8")
+        ).hexdigest()
+        question = normalize_question(current["text"])
+        return hashlib.sha256(f"{namespace}\0{history_hash}\0{question}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        return self.memory.get(key)
+
+    def set(self, key: str, answer: str) -> None:
+        if answer:
+            self.memory.set(key, answer)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**self.memory.snapshot(), "bypassed": self.bypassed}
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import copy
+import re
+import secrets
+from datetime import datetime
+from typing import Any, Optional
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import db
+
+COLLECTION_NAME = "chat_sessions"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English prose), plus per-message overhead."""
+    return len(text) // 4 + 4
+
+
+def _first_sentence(text: str, max_chars: int) -> str:
+    sentence = _SENTENCE_END.split(_WHITESPACE.sub(" ", text).strip(), maxsplit=1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[: max_chars - 3].rstrip() + "..."
+    return sentence
+
+
+def summarize_turn(turn: dict[str, str]) -> str:
+    if turn["role"] == "user":
+        return f"- Student asked: {_first_sentence(turn['text'], 160)}"
+    return f"- Assistant explained: {_first_sentence(turn['text'], 200)}"
+
+
+def compact_history(
+    session: dict[str, Any], budget_tokens: int, min_turns: int, summary_budget_tokens: int
+) -> None:
+    """Fold the oldest turns into the session summary until the rest fit ``budget_tokens``.
+
+    At least ``min_turns`` recent turns are always kept verbatim. The summary is
+    extractive (first sentence of each folded turn), so compaction costs no
+    extra LLM call; it is itself capped at ``summary_budget_tokens`` by
+    dropping its oldest lines.
+    """
+    turns = session["turns"]
+    used = sum(estimate_tokens(turn["text"]) for turn in turns)
+    folded = 0
+    while used > budget_tokens and len(turns) - folded > min_turns:
+        used -= estimate_tokens(turns[folded]["text"])
+        folded += 1
+    if not folded:
+        return
+
+    lines = session["summary"] + [summarize_turn(turn) for turn in turns[:folded]]
+    while len(lines) > 1 and sum(estimate_tokens(line) for line in lines) > summary_budget_tokens:
+        lines.pop(0)
+    session["summary"] = lines
+    session["turns"] = turns[folded:]
+    session["compacted_turns"] += folded
+
+
+def summary_text(session: dict[str, Any]) -> str:
+    if not session["summary"]:
+        return ""
+    return "Summary of the earlier conversation:\n" + "\n".join(session["summary"])
+
+
+class ChatSessionStore:
+    """Server-side chatbot conversations, so clients send only the new message.
+
+    Turns are stored already masked, so history is never re-masked. Sessions
+    live in an in-process LRU backed by the ``chat_sessions`` Mongo collection
+    (expired by a TTL index on ``updated_at``); without Mongo they are
+    memory-only.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.memory = TTLCache(max_entries, ttl_seconds)
+        self.persistent_hits = 0
+        self.compactions = 0
+
+    def _collection(self) -> Any:
+        if db.client is None:
+            return None
+        return db.client[settings.DATABASE_NAME][COLLECTION_NAME]
+
+    async def ensure_indexes(self) -> None:
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            await collection.create_index("updated_at", expireAfterSeconds=self.ttl_seconds)
+        except Exception as exc:
+            print(f"[AI] Could not create chat session TTL index: {exc}")
+
+    @staticmethod
+    def new(owner: str, turns: Optional[list[dict[str, str]]] = None) -> dict[str, Any]:
+        now = datetime.utcnow()
+        return {
+            "_id": secrets.token_urlsafe(16),
+            "owner": owner,
+            "turns": list(turns or []),
+            "summary": [],
+            "compacted_turns": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    async def get(self, session_id: str, owner: str) -> Optional[dict[str, Any]]:
+        session = self.memory.get(session_id)
+        if session is None:
+            collection = self._collection()
+            if collection is None:
+                return None
+            try:
+                session = await collection.find_one({"_id": session_id})
+            except Exception as exc:
+                print(f"[AI] Chat session lookup failed: {exc}")
+                return None
+            if not session:
+                return None
+            self.persistent_hits += 1
+            self.memory.set(session_id, session)
+        if session["owner"] != owner:
+            return None
+        return copy.deepcopy(session)
+
+    async def save(self, session: dict[str, Any]) -> None:
+        before = session["compacted_turns"]
+        compact_history(
+            session,
+            settings.CHAT_HISTORY_TOKEN_BUDGET,
+            settings.CHAT_HISTORY_MIN_TURNS,
+            settings.CHAT_SUMMARY_TOKEN_BUDGET,
+        )
+        if session["compacted_turns"] != before:
+            self.compactions += 1
+        session["updated_at"] = datetime.utcnow()
+        self.memory.set(session["_id"], copy.deepcopy(session))
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            await collection.replace_one({"_id": session["_id"]}, session, upsert=True)
+        except Exception as exc:
+            print(f"[AI] Chat session write failed: {exc}")
+
+    async def delete(self, session_id: str, owner: str) -> bool:
+        if await self.get(session_id, owner) is None:
+            return False
+        self.memory.pop(session_id)
+        collection = self._collection()
+        if collection is not None:
+            try:
+                await collection.delete_one({"_id": session_id, "owner": owner})
+            except Exception as exc:
+                print(f"[AI] Chat session delete failed: {exc}")
+        return True
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "memory": self.memory.snapshot(),
+            "persistent_hits": self.persistent_hits,
+            "compactions": self.compactions,
+        }
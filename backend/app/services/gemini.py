@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+
+from app.core.config import settings
+
+try:
+    import h2  # type: ignore  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except Exception:
+    HTTP2_AVAILABLE = False
+
+
+class GeminiError(Exception):
+    """Raised for a non-200 response from the Gemini API."""
+
+    def __init__(self, status_code: int, body: str = "") -> None:
+        super().__init__(f"Gemini API returned {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.body = body
+
+
+class GeminiClient:
+    """App-lifetime HTTP client for the Gemini API.
+
+    One pooled ``httpx.AsyncClient`` is shared by every caller so connections
+    (and their TLS sessions) are reused across chat messages and scan reports.
+    A semaphore caps the number of concurrent upstream calls process-wide.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        http2: Optional[bool] = None,
+        max_concurrency: Optional[int] = None,
+        verify: Any = True,
+    ) -> None:
+        self.base_url = (base_url or settings.GEMINI_BASE_URL).rstrip("/")
+        self.api_key = settings.GEMINI_API_KEY if api_key is None else api_key
+        self.http2 = settings.GEMINI_HTTP2 if http2 is None else http2
+        self.max_concurrency = max_concurrency or settings.GEMINI_MAX_CONCURRENCY
+        self.verify = verify
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use as well, for code paths that run without the startup hook.
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    def _build_client(self) -> httpx.AsyncClient:
+        http2 = self.http2 and HTTP2_AVAILABLE
+        if self.http2 and not HTTP2_AVAILABLE:
+            print("[AI] h2 is not installed; Gemini client will use HTTP/1.1 keep-alive")
+        return httpx.AsyncClient(
+            http2=http2,
+            verify=self.verify,
+            limits=httpx.Limits(
+                max_connections=settings.GEMINI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GEMINI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.GEMINI_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(
+                settings.GEMINI_READ_TIMEOUT_SECONDS,
+                connect=settings.GEMINI_CONNECT_TIMEOUT_SECONDS,
+                pool=settings.GEMINI_POOL_TIMEOUT_SECONDS,
+            ),
+        )
+
+    async def start(self) -> None:
+        _ = self.client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def model_url(self, model: Optional[str] = None, method: str = "generateContent") -> str:
+        return f"{self.base_url}/models/{model or settings.GEMINI_MODEL}:{method}"
+
+    async def generate_content(
+        self,
+        payload: dict[str, Any],
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> httpx.Response:
+        # The key goes in a header so it never shows up in logged URLs.
+        headers = {"x-goog-api-key": self.api_key}
+        request_timeout = httpx.USE_CLIENT_DEFAULT if timeout is None else timeout
+        async with self._semaphore:
+            self.in_flight += 1
+            self.requests += 1
+            try:
+                return await self.client.post(
+                    self.model_url(model), json=payload, headers=headers, timeout=request_timeout
+                )
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+    async def stream_generate_content(
+        self,
+        payload: dict[str, Any],
+        model: Optional[str] = None,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Yield each response chunk of ``streamGenerateContent`` as it arrives.
+
+        The concurrency slot is held until the stream is exhausted or closed,
+        so callers should consume it with ``contextlib.aclosing``.
+        """
+        headers = {"x-goog-api-key": self.api_key, "accept": "text/event-stream"}
+        async with self._semaphore:
+            self.in_flight += 1
+            self.requests += 1
+            try:
+                async with self.client.stream(
+                    "POST",
+                    self.model_url(model, "streamGenerateContent"),
+                    params={"alt": "sse"},
+                    json=payload,
+                    headers=headers,
+                ) as response:
+                    if response.status_code != 200:
+                        body = (await response.aread()).decode("utf-8", "replace")
+                        raise GeminiError(response.status_code, body)
+                    data_lines: list[str] = []
+                    async for line in response.aiter_lines():
+                        if line.startswith("data:"):
+                            data_lines.append(line[5:].strip())
+                        elif not line and data_lines:
+                            yield json.loads("\n".join(data_lines))
+                            data_lines = []
+                    if data_lines:
+                        yield json.loads("\n".join(data_lines))
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "http2": self.http2 and HTTP2_AVAILABLE,
+            "connected": self._client is not None and not self._client.is_closed,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+def candidate_text(data: dict[str, Any]) -> str:
+    """Text of the first candidate in a ``generateContent`` response, or ``""``."""
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts") or [{}]
+    return parts[0].get("text", "")
+
+
+gemini_client = GeminiClient()
+
+
+async def start_gemini_client() -> None:
+    await gemini_client.start()
+
+
+async def close_gemini_client() -> None:
+    await gemini_client.aclose()
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+try:
+    import torch  # type: ignore
+except Exception:
+    torch = None
+
+BatchFn = Callable[[list[Any]], list[Any]]
+BatchRunner = Callable[[BatchFn, list[Any]], Awaitable[list[Any]]]
+
+
+class InferenceOverloaded(Exception):
+    """Raised when the inference pool has no room for another request."""
+
+
+# Torch thread counts are process-wide, and the inter-op count can only be set
+# once, before any parallel work. Every pool in the process shares this value.
+_torch_threads = 0
+
+
+def configure_torch_threads(threads: int) -> None:
+    """Set torch's intra-op threads (and one inter-op thread) once per process, at startup."""
+    global _torch_threads
+    if torch is None or threads <= 0 or _torch_threads:
+        return
+    _torch_threads = threads
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError as exc:
+        print(f"[Inference] Could not set torch inter-op threads: {exc}")
+
+
+class InferencePool:
+    """Bounded executor that keeps model forward passes off the event loop.
+
+    ``max_pending`` caps the number of admitted requests (running plus waiting);
+    once it is reached :meth:`admission` raises :class:`InferenceOverloaded` so
+    callers can shed load instead of queueing until they time out.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_pending: int = 32,
+        kind: str = "thread",
+    ) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.kind = kind if kind in {"thread", "process"} else "thread"
+        self.admitted = 0
+        self.rejected = 0
+        self.running = 0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # Worker processes start fresh, so they get this process's setting.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=configure_torch_threads,
+                    initargs=(_torch_threads,),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="inference",
+                )
+        return self._executor
+
+    @asynccontextmanager
+    async def admission(self) -> AsyncIterator[None]:
+        if self.admitted >= self.max_pending:
+            self.rejected += 1
+            raise InferenceOverloaded(f"inference queue full ({self.max_pending} pending)")
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.admitted -= 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        self.running += 1
+        try:
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.running -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "torch_threads": _torch_threads,
+            "admitted": self.admitted,
+            "running": self.running,
+            "rejected": self.rejected,
+        }
+
+
+class BatchStats:
+    """Rolling batch-size and queue-wait statistics for one batcher."""
+
+    def __init__(self, window: int = 1024) -> None:
+        self.batches = 0
+        self.items = 0
+        self.failures = 0
+        self.size_counts: Counter[int] = Counter()
+        self._waits_ms: deque[float] = deque(maxlen=window)
+        self._run_ms: deque[float] = deque(maxlen=window)
+
+    def record(self, size: int, waits_ms: list[float], run_ms: float, failed: bool = False) -> None:
+        self.batches += 1
+        self.items += size
+        self.size_counts[size] += 1
+        self._waits_ms.extend(waits_ms)
+        self._run_ms.append(run_ms)
+        if failed:
+            self.failures += 1
+
+    @staticmethod
+    def _percentile(values: list[float], pct: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return round(ordered[index], 3)
+
+    def snapshot(self) -> dict[str, Any]:
+        waits = list(self._waits_ms)
+        runs = list(self._run_ms)
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "failures": self.failures,
+            "mean_batch_size": round(self.items / self.batches, 3) if self.batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.size_counts.items())},
+            "queue_wait_ms": {
+                "p50": self._percentile(waits, 50),
+                "p95": self._percentile(waits, 95),
+                "p99": self._percentile(waits, 99),
+                "max": round(max(waits), 3) if waits else 0.0,
+            },
+            "batch_run_ms": {
+                "p50": self._percentile(runs, 50),
+                "p95": self._percentile(runs, 95),
+                "max": round(max(runs), 3) if runs else 0.0,
+            },
+        }
+
+
+class MicroBatcher:
+    """Collects concurrent submissions into batches bounded by size and latency.
+
+    The first queued item opens a window of ``max_wait_ms``; the batch is
+    dispatched as soon as it reaches ``max_batch_size`` or the window closes.
+    ``batch_fn`` receives the list of items and must return one result per item
+    in the same order. When ``runner`` is given the batch is executed through it
+    (e.g. :meth:`InferencePool.run`) and up to ``max_in_flight`` batches may run
+    at once; otherwise it is called inline.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batch_fn: BatchFn,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        runner: Optional[BatchRunner] = None,
+        max_in_flight: int = 1,
+    ) -> None:
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self.runner = runner
+        self.max_in_flight = max(1, max_in_flight)
+        self.stats = BatchStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop or self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._loop = loop
+            self._worker = loop.create_task(self._collect(), name=f"batcher-{self.name}")
+        return self._queue
+
+    async def submit(self, item: Any) -> Any:
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> None:
+        queue = self._queue
+        in_flight = self._in_flight
+        while True:
+            batch = [await queue.get()]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                # asyncio.wait (unlike wait_for) never swallows a cancellation
+                # that races with the getter completing.
+                getter = asyncio.ensure_future(queue.get())
+                try:
+                    done, _ = await asyncio.wait({getter}, timeout=remaining)
+                finally:
+                    if not getter.done():
+                        getter.cancel()
+                if not done:
+                    break
+                batch.append(getter.result())
+            await in_flight.acquire()
+            task = asyncio.create_task(self._dispatch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: in_flight.release())
+
+    async def _dispatch(self, batch: list[tuple[Any, asyncio.Future, float]]) -> None:
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        waits_ms = [(started - enqueued) * 1000 for _, _, enqueued in batch]
+        items = [item for item, _, _ in batch]
+        try:
+            if self.runner is not None:
+                results = await self.runner(self.batch_fn, items)
+            else:
+                results = self.batch_fn(items)
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"{self.name} batch returned {len(results)} results for {len(items)} inputs"
+                )
+        except Exception as exc:
+            self.stats.record(len(items), waits_ms, (time.perf_counter() - started) * 1000, failed=True)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        self.stats.record(len(items), waits_ms, (time.perf_counter() - started) * 1000)
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_in_flight": self.max_in_flight,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            **self.stats.snapshot(),
+        }
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+from app.core.database import db
+from app.core.metrics import REGISTRY
+
+COLLECTION_NAME = "analysis_jobs"
+LAB_REPORT_ANALYSIS = "lab_report_analysis"
+
+PENDING, RUNNING, SUCCEEDED, FAILED = "pending", "running", "succeeded", "failed"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED)
+
+JOB_RUNS = REGISTRY.counter("jobs_runs_total", "Background job attempts by kind and outcome.", labelnames=("kind", "outcome"))
+JOB_SECONDS = REGISTRY.histogram(
+    "jobs_run_seconds",
+    "Wall time of one background job attempt.",
+    labelnames=("kind",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+class JobLeaseLost(Exception):
+    """The job's visibility timeout expired and another worker may have claimed it."""
+
+
+class Job:
+    """A claimed job as seen by its handler."""
+
+    def __init__(self, queue: "JobQueue", document: dict[str, Any]) -> None:
+        self.queue = queue
+        self.id: ObjectId = document["_id"]
+        self.kind: str = document["kind"]
+        self.payload: dict[str, Any] = document.get("payload") or {}
+        self.attempts: int = document.get("attempts", 0)
+        self.max_attempts: int = document.get("max_attempts", 1)
+        self.lease: str = document["lease"]
+        self.lease_lost = False
+
+    async def progress(self, stage: str, percent: int) -> None:
+        """Report progress; also extends the lease."""
+        await self.queue.touch(self, {"progress": {"stage": stage, "percent": max(0, min(100, percent))}})
+
+
+@dataclass
+class JobHandler:
+    run: Callable[[Job], Awaitable[Optional[dict[str, Any]]]]
+    # Called once when the job has failed for the last time.
+    on_failed: Optional[Callable[[Job, str], Awaitable[None]]] = None
+
+
+def public_job(document: dict[str, Any]) -> dict[str, Any]:
+    """Job fields safe to return to clients (no payload, no lease token)."""
+    return {
+        "id": str(document["_id"]),
+        "kind": document["kind"],
+        "status": document["status"],
+        "progress": document.get("progress") or {"stage": document["status"], "percent": 0},
+        "attempts": document.get("attempts", 0),
+        "max_attempts": document.get("max_attempts", 1),
+        "error": document.get("error"),
+        "result": document.get("result"),
+        "created_at": document.get("created_at"),
+        "started_at": document.get("started_at"),
+        "finished_at": document.get("finished_at"),
+    }
+
+
+class JobQueue:
+    """Durable work queue in the ``analysis_jobs`` Mongo collection.
+
+    Workers claim the oldest visible job with one ``find_one_and_update``, so
+    a job is never handed to two workers at once. A claim is a lease: the
+    job's ``visible_at`` moves to the end of the visibility timeout, and unless
+    the worker extends it (heartbeats and progress updates do) the job becomes
+    claimable again, so jobs held by a crashed process are retried. Failed attempts are retried with exponential backoff up to
+    ``max_attempts``. Finished jobs are removed by a TTL index after
+    ``JOB_RETENTION_SECONDS``.
+    """
+
+    def __init__(
+        self,
+        visibility_timeout: float,
+        heartbeat_seconds: float,
+        max_attempts: int,
+        retry_backoff: float,
+        retention_seconds: int,
+    ) -> None:
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self.retention_seconds = retention_seconds
+        self.handlers: dict[str, JobHandler] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: list[asyncio.Task] = []
+
+    def _collection(self) -> Any:
+        if db.client is None:
+            return None
+        return db.client[settings.DATABASE_NAME][COLLECTION_NAME]
+
+    def register(
+        self,
+        kind: str,
+        run: Callable[[Job], Awaitable[Optional[dict[str, Any]]]],
+        on_failed: Optional[Callable[[Job, str], Awaitable[None]]] = None,
+    ) -> None:
+        self.handlers[kind] = JobHandler(run, on_failed)
+
+    async def ensure_indexes(self) -> None:
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            await collection.create_index([("status", 1), ("visible_at", 1)])
+            await collection.create_index("finished_at", expireAfterSeconds=self.retention_seconds)
+        except Exception as exc:
+            print(f"[Jobs] Could not create job indexes: {exc}")
+
+    async def enqueue(self, kind: str, payload: dict[str, Any], max_attempts: Optional[int] = None) -> str:
+        now = datetime.utcnow()
+        result = await self._collection().insert_one(
+            {
+                "kind": kind,
+                "payload": payload,
+                "status": PENDING,
+                "progress": {"stage": "queued", "percent": 0},
+                "attempts": 0,
+                "max_attempts": max_attempts or self.max_attempts,
+                "visible_at": now,
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return str(result.inserted_id)
+
+    async def get(self, job_id: str) -> Optional[dict[str, Any]]:
+        try:
+            oid = ObjectId(job_id)
+        except Exception:
+            return None
+        return await self._collection().find_one({"_id": oid})
+
+    async def claim(self) -> Optional[Job]:
+        """Atomically take the oldest job that is pending, or running with an expired lease."""
+        now = datetime.utcnow()
+        lease_expires = now + timedelta(seconds=self.visibility_timeout)
+        document = await self._collection().find_one_and_update(
+            {"status": {"$in": [PENDING, RUNNING]}, "visible_at": {"$lte": now}, "kind": {"$in": list(self.handlers)}},
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "lease": uuid.uuid4().hex,
+                    "visible_at": lease_expires,
+                    "started_at": now,
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("visible_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        return Job(self, document) if document else None
+
+    async def touch(self, job: Job, fields: Optional[dict[str, Any]] = None) -> None:
+        """Extend the lease (and set ``fields``); raises :class:`JobLeaseLost` if it was taken over."""
+        now = datetime.utcnow()
+        update = {"visible_at": now + timedelta(seconds=self.visibility_timeout), "updated_at": now, **(fields or {})}
+        result = await self._collection().update_one({"_id": job.id, "lease": job.lease}, {"$set": update})
+        if result.matched_count == 0:
+            job.lease_lost = True
+            raise JobLeaseLost(str(job.id))
+
+    async def _finish(self, job: Job, update: dict[str, Any]) -> bool:
+        update["updated_at"] = datetime.utcnow()
+        result = await self._collection().update_one(
+            {"_id": job.id, "lease": job.lease},
+            {"$set": update, "$unset": {"lease": ""}},
+        )
+        return result.matched_count > 0
+
+    async def complete(self, job: Job, result: Optional[dict[str, Any]]) -> None:
+        now = datetime.utcnow()
+        await self._finish(
+            job,
+            {
+                "status": SUCCEEDED,
+                "result": result,
+                "error": None,
+                "progress": {"stage": "done", "percent": 100},
+                "finished_at": now,
+            },
+        )
+
+    async def fail(self, job: Job, error: str) -> bool:
+        """Record a failed attempt; returns ``True`` if the job will not be retried."""
+        now = datetime.utcnow()
+        if job.attempts < job.max_attempts:
+            delay = self.retry_backoff * 2 ** (job.attempts - 1)
+            await self._finish(
+                job,
+                {
+                    "status": PENDING,
+                    "error": error,
+                    "visible_at": now + timedelta(seconds=delay),
+                    "progress": {"stage": "retry_scheduled", "percent": 0},
+                },
+            )
+            return False
+        return await self._finish(job, {"status": FAILED, "error": error, "finished_at": now})
+
+    async def _heartbeat(self, job: Job, task: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self.touch(job)
+            except JobLeaseLost:
+                print(f"[Jobs] Lost lease on job {job.id}; abandoning this attempt")
+                task.cancel()
+                return
+            except Exception as exc:
+                # Usually transient (e.g. Mongo unreachable). The lease still has
+                # the rest of its visibility timeout, so keep beating.
+                print(f"[Jobs] Heartbeat for job {job.id} failed, retrying: {exc}")
+
+    async def run_one(self, job: Job) -> None:
+        handler = self.handlers[job.kind]
+        if job.attempts > job.max_attempts:
+            # Claimed again after its lease expired on the last allowed attempt.
+            error = "Job exceeded its attempts (worker stopped responding)"
+            if await self._finish(job, {"status": FAILED, "error": error, "finished_at": datetime.utcnow()}):
+                JOB_RUNS.inc(kind=job.kind, outcome="failed")
+                if handler.on_failed is not None:
+                    await handler.on_failed(job, error)
+            return
+
+        started = asyncio.get_running_loop().time()
+        task = asyncio.ensure_future(handler.run(job))
+        heartbeat = asyncio.ensure_future(self._heartbeat(job, task))
+        try:
+            result = await task
+        except (asyncio.CancelledError, JobLeaseLost):
+            if not job.lease_lost:
+                raise
+            # Lease lost: another worker owns the job now, so record nothing.
+            JOB_RUNS.inc(kind=job.kind, outcome="lease_lost")
+            return
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            print(f"[Jobs] {job.kind} job {job.id} attempt {job.attempts} failed: {error}")
+            final = await self.fail(job, error)
+            JOB_RUNS.inc(kind=job.kind, outcome="failed" if final else "retried")
+            if final and handler.on_failed is not None:
+                await handler.on_failed(job, error)
+            return
+        finally:
+            heartbeat.cancel()
+            JOB_SECONDS.observe(asyncio.get_running_loop().time() - started, kind=job.kind)
+        await self.complete(job, result)
+        JOB_RUNS.inc(kind=job.kind, outcome="succeeded")
+
+    async def _worker(self, index: int, poll_seconds: float) -> None:
+        while True:
+            try:
+                job = await self.claim()
+            except Exception as exc:
+                print(f"[Jobs] Worker {index} could not claim a job: {exc}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run_one(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"[Jobs] Worker {index} error on job {job.id}: {exc}")
+
+    def start(self, workers: int, poll_seconds: float) -> None:
+        if self._workers or self._collection() is None:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self._worker(index, poll_seconds)) for index in range(workers)]
+        print(f"[Jobs] Started {workers} background job workers")
+
+    async def stop(self) -> None:
+        # Jobs interrupted here keep their lease and are retried once it expires.
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._wakeup = None
+
+    async def snapshot(self) -> dict[str, Any]:
+        counts = {status: 0 for status in (PENDING, RUNNING, SUCCEEDED, FAILED)}
+        collection = self._collection()
+        if collection is not None:
+            async for row in collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+                counts[row["_id"]] = row["count"]
+        return {"workers": len(self._workers), "jobs": counts}
+
+
+job_queue = JobQueue(
+    visibility_timeout=settings.JOB_VISIBILITY_TIMEOUT_SECONDS,
+    heartbeat_seconds=settings.JOB_HEARTBEAT_SECONDS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retry_backoff=settings.JOB_RETRY_BACKOFF_SECONDS,
+    retention_seconds=settings.JOB_RETENTION_SECONDS,
+)
+
+
+async def ensure_job_indexes() -> None:
+    await job_queue.ensure_indexes()
+
+
+async def start_job_workers() -> None:
+    if settings.JOB_WORKERS > 0:
+        job_queue.start(settings.JOB_WORKERS, settings.JOB_POLL_SECONDS)
+
+
+async def stop_job_workers() -> None:
+    await job_queue.stop()
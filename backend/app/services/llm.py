@@ -0,0 +1,571 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Optional
+
+from app.core.config import settings
+from app.core.metrics import REGISTRY
+from app.services.gemini import GeminiClient, GeminiError, candidate_text, gemini_client
+from app.services.inference import InferencePool, MicroBatcher
+
+try:
+    import torch  # type: ignore
+except Exception:
+    torch = None
+
+try:
+    from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache  # type: ignore
+except Exception:
+    AutoModelForCausalLM = AutoTokenizer = DynamicCache = None
+
+try:
+    from peft import PeftModel  # type: ignore
+except Exception:
+    PeftModel = None
+
+
+class LLMUnavailable(Exception):
+    """Raised when a provider cannot serve a request (not configured, loading, or failed)."""
+
+
+@dataclass
+class GenerationOptions:
+    temperature: float = 0.7
+    top_k: Optional[int] = None
+    top_p: Optional[float] = None
+    max_output_tokens: int = 512
+
+
+class LLMProvider(ABC):
+    """Text generation backend for the chatbot and the report (VLM) stage.
+
+    ``messages`` are ``{"role": "user" | "model", "text": ...}`` dicts, already
+    masked by the caller.
+    """
+
+    name = "base"
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    @property
+    def model_id(self) -> str:
+        return self.name
+
+    async def start(self) -> None:
+        pass
+
+    @abstractmethod
+    async def generate(
+        self, messages: list[dict[str, str]], system: Optional[str] = None, options: Optional[GenerationOptions] = None
+    ) -> str:
+        """The whole answer to ``messages`` as one string."""
+
+    async def stream(
+        self, messages: list[dict[str, str]], system: Optional[str] = None, options: Optional[GenerationOptions] = None
+    ) -> AsyncIterator[str]:
+        # Providers without native streaming yield the whole answer at once.
+        yield await self.generate(messages, system, options)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"name": self.name, "available": self.available}
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, client: GeminiClient) -> None:
+        self.client = client
+
+    @property
+    def available(self) -> bool:
+        return bool(self.client.api_key)
+
+    @property
+    def model_id(self) -> str:
+        return f"gemini:{settings.GEMINI_MODEL}"
+
+    @staticmethod
+    def payload(
+        messages: list[dict[str, str]], system: Optional[str], options: GenerationOptions
+    ) -> dict[str, Any]:
+        config: dict[str, Any] = {"temperature": options.temperature}
+        if options.top_k is not None:
+            config["topK"] = options.top_k
+        if options.top_p is not None:
+            config["topP"] = options.top_p
+        config["maxOutputTokens"] = options.max_output_tokens
+        payload: dict[str, Any] = {
+            "contents": [{"role": message["role"], "parts": [{"text": message["text"]}]} for message in messages],
+            "generationConfig": config,
+        }
+        if system:
+            payload["systemInstruction"] = {"parts": [{"text": system}]}
+        return payload
+
+    async def generate(
+        self, messages: list[dict[str, str]], system: Optional[str] = None, options: Optional[GenerationOptions] = None
+    ) -> str:
+        response = await self.client.generate_content(self.payload(messages, system, options or GenerationOptions()))
+        if response.status_code != 200:
+            raise GeminiError(response.status_code, response.text)
+        return candidate_text(response.json())
+
+    async def stream(
+        self, messages: list[dict[str, str]], system: Optional[str] = None, options: Optional[GenerationOptions] = None
+    ) -> AsyncIterator[str]:
+        chunks = self.client.stream_generate_content(self.payload(messages, system, options or GenerationOptions()))
+        try:
+            async for chunk in chunks:
+                text = candidate_text(chunk)
+                if text:
+                    yield text
+        finally:
+            await chunks.aclose()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**super().snapshot(), "model": settings.GEMINI_MODEL, "client": self.client.snapshot()}
+
+
+# Prompt layout used by Dr_Tmuor.ipynb when fine-tuning the StableLM adapter.
+INSTRUCTION_PREFIX = "### Instruction:\n"
+RESPONSE_PREFIX = "\n\n### Response:\n"
+TURN_SEPARATOR = "\n\n"
+STOP_MARKER = "###"
+
+DECODE_STEP_SECONDS = REGISTRY.histogram(
+    "llm_local_decode_step_seconds",
+    "Wall time of one batched decode step of the local LLM (one token per active sequence).",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5),
+)
+PREFILL_SECONDS = REGISTRY.histogram(
+    "llm_local_prefill_seconds",
+    "Wall time to prefill one prompt on the local LLM, by whether a cached prefix was reused.",
+    labelnames=("prefix_cache",),
+)
+GENERATED_TOKENS = REGISTRY.counter("llm_local_generated_tokens_total", "Tokens generated by the local LLM.")
+
+
+@dataclass
+class GenerationRequest:
+    segments: list[str]
+    options: GenerationOptions
+    on_text: Optional[Callable[[str], None]] = None
+    cancelled: bool = False
+    prefix_tokens: int = 0
+    result: str = field(default="", init=False)
+
+
+class PrefixKVCache:
+    """LRU of per-layer key/value tensors keyed by the token prefix they encode.
+
+    Bounded by the total number of cached tokens, since KV memory scales with
+    sequence length rather than entry count.
+    """
+
+    def __init__(self, max_tokens: int) -> None:
+        self.max_tokens = max(0, max_tokens)
+        self.tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[int, list[tuple[Any, Any]]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token_ids: list[int]) -> str:
+        return hashlib.sha256(",".join(map(str, token_ids)).encode("ascii")).hexdigest()
+
+    def longest_prefix(self, token_ids: list[int], boundaries: list[int]) -> tuple[int, Optional[list[tuple[Any, Any]]]]:
+        with self._lock:
+            for boundary in sorted(boundaries, reverse=True):
+                key = self.key(token_ids[:boundary])
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return boundary, entry[1]
+            self.misses += 1
+        return 0, None
+
+    def put(self, token_ids: list[int], layers: list[tuple[Any, Any]]) -> None:
+        length = len(token_ids)
+        if not length or length > self.max_tokens:
+            return
+        key = self.key(token_ids)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (length, layers)
+            self.tokens += length
+            while self.tokens > self.max_tokens and self._entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.tokens -= evicted
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "tokens": self.tokens,
+            "max_tokens": self.max_tokens,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _cache_layers(cache: Any) -> list[tuple[Any, Any]]:
+    """Per-layer ``(key, value)`` tensors from any transformers cache representation."""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [(key, value) for key, value in cache]
+
+
+def _make_cache(layers: list[tuple[Any, Any]]) -> Any:
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(layers)
+
+
+def _sample(logits: Any, options: GenerationOptions) -> int:
+    if options.temperature <= 0:
+        return int(torch.argmax(logits))
+    logits = logits / options.temperature
+    if options.top_k:
+        threshold = torch.topk(logits, min(options.top_k, logits.shape[-1])).values[-1]
+        logits = logits.masked_fill(logits < threshold, float("-inf"))
+    probs = torch.softmax(logits, dim=-1)
+    if options.top_p is not None and 0 < options.top_p < 1:
+        sorted_probs, order = torch.sort(probs, descending=True)
+        outside = torch.cumsum(sorted_probs, dim=-1) - sorted_probs > options.top_p
+        sorted_probs = sorted_probs.masked_fill(outside, 0.0)
+        probs = torch.zeros_like(probs).scatter(-1, order, sorted_probs)
+    return int(torch.multinomial(probs, 1))
+
+
+class _Sequence:
+    def __init__(self, request: GenerationRequest, prompt_length: int, first_logits: Any) -> None:
+        self.request = request
+        self.position = prompt_length
+        self.next_logits = first_logits
+        self.token_ids: list[int] = []
+        self.emitted = 0
+        self.done = False
+
+
+class LocalLLMProvider(LLMProvider):
+    """Self-hosted causal LM (e.g. the notebook's StableLM + LoRA) on CPU.
+
+    At load time the LoRA adapter is merged into the base weights and linear
+    layers are dynamically quantized to int8. Generations are micro-batched:
+    each prompt is prefilled on its own, reusing the KV cache of the longest
+    previously seen conversation prefix, then all sequences in the batch decode
+    together with a left-padded shared cache.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        model_path: str,
+        adapter_path: str = "",
+        quantize: bool = True,
+        max_batch_size: int = 4,
+        batch_wait_ms: float = 20.0,
+        kv_cache_tokens: int = 8192,
+        max_new_tokens: int = 256,
+    ) -> None:
+        self.model_path = model_path
+        self.max_new_tokens = max_new_tokens
+        self.adapter_path = adapter_path
+        self.quantize = quantize
+        self.model: Any = None
+        self.tokenizer: Any = None
+        self.status: dict[str, Any] = {"state": "not_loaded"}
+        self.prefix_cache = PrefixKVCache(kv_cache_tokens)
+        self._lock = threading.Lock()
+        self._loading: Optional[asyncio.Future] = None
+        self._token_ms: deque[float] = deque(maxlen=2048)
+        # One worker: the model is not re-entrant and already uses every intra-op thread.
+        self.pool = InferencePool(max_workers=1, max_pending=1024)
+        self.batcher = MicroBatcher(
+            "llm-local",
+            self._generate_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=batch_wait_ms,
+            runner=self.pool.run,
+        )
+
+    @property
+    def available(self) -> bool:
+        return bool(self.model_path) and torch is not None and AutoModelForCausalLM is not None and (
+            self.status["state"] != "failed"
+        )
+
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
+
+    @property
+    def model_id(self) -> str:
+        return f"local:{self.model_path}:{self.adapter_path}:{'int8' if self.quantize else 'fp32'}"
+
+    def load(self) -> None:
+        with self._lock:
+            if self.model is not None or not self.available:
+                return
+            self.status = {"state": "loading"}
+            started = time.perf_counter()
+            try:
+                tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+                # Checkpoints may be bf16; CPU kernels and dynamic quantization want fp32.
+                model = AutoModelForCausalLM.from_pretrained(self.model_path).float()
+                if self.adapter_path:
+                    if PeftModel is None:
+                        raise RuntimeError("peft is required to apply a LoRA adapter")
+                    # Folding the adapter into the base weights removes the per-layer LoRA matmuls.
+                    model = PeftModel.from_pretrained(model, self.adapter_path).merge_and_unload()
+                model.eval()
+                if self.quantize:
+                    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                if tokenizer.pad_token_id is None:
+                    tokenizer.pad_token = tokenizer.eos_token
+                self.tokenizer = tokenizer
+                self.model = model
+                self.status = {"state": "loaded", "load_seconds": round(time.perf_counter() - started, 3)}
+                print(f"[AI] Loaded local LLM {self.model_path} (adapter={self.adapter_path or 'none'})")
+            except Exception as exc:
+                self.status = {"state": "failed", "error": str(exc)}
+                print(f"[AI] Failed loading local LLM ({self.model_path}): {exc}")
+
+    async def start(self) -> None:
+        if self.available and self._loading is None:
+            self._loading = asyncio.ensure_future(self.pool.run(self.load))
+
+    async def _require_loaded(self) -> None:
+        if self.model is None:
+            # Without preloading, the first request starts the load and falls back meanwhile.
+            await self.start()
+            raise LLMUnavailable(f"local LLM is {self.status['state']}")
+
+    @staticmethod
+    def prompt_segments(messages: list[dict[str, str]], system: Optional[str]) -> list[str]:
+        """Prompt text split at turn boundaries, which is where KV prefixes can be reused."""
+        segments = [f"{system}{TURN_SEPARATOR}"] if system else []
+        for message in messages:
+            if message["role"] == "user":
+                segments.append(f"{INSTRUCTION_PREFIX}{message['text']}{RESPONSE_PREFIX}")
+            else:
+                segments.append(f"{message['text']}{TURN_SEPARATOR}")
+        return segments
+
+    def _tokenize_segments(self, segments: list[str]) -> tuple[list[int], list[int]]:
+        token_ids: list[int] = []
+        boundaries: list[int] = []
+        for index, segment in enumerate(segments):
+            token_ids.extend(self.tokenizer(segment, add_special_tokens=index == 0)["input_ids"])
+            boundaries.append(len(token_ids))
+        return token_ids, boundaries
+
+    def _prefill(self, request: GenerationRequest) -> tuple[int, list[tuple[Any, Any]], Any]:
+        started = time.perf_counter()
+        token_ids, boundaries = self._tokenize_segments(request.segments)
+        reused, layers = self.prefix_cache.longest_prefix(token_ids, boundaries[:-1])
+        if reused == len(token_ids):
+            reused, layers = 0, None
+        request.prefix_tokens = reused
+        inputs = torch.tensor([token_ids[reused:]])
+        outputs = self.model(
+            input_ids=inputs,
+            past_key_values=_make_cache(layers) if layers is not None else None,
+            use_cache=True,
+        )
+        prompt_layers = _cache_layers(outputs.past_key_values)
+        self.prefix_cache.put(token_ids, prompt_layers)
+        if len(boundaries) > 1 and boundaries[0] > reused:
+            # The system prompt / opening turn is shared by every later turn; slices are views.
+            first = boundaries[0]
+            self.prefix_cache.put(token_ids[:first], [(key[:, :, :first], value[:, :, :first]) for key, value in prompt_layers])
+        PREFILL_SECONDS.observe(time.perf_counter() - started, prefix_cache="hit" if reused else "miss")
+        return len(token_ids), prompt_layers, outputs.logits[0, -1]
+
+    def _emit(self, sequence: _Sequence, final: bool = False) -> None:
+        text = self.tokenizer.decode(sequence.token_ids, skip_special_tokens=True)
+        marker = text.find(STOP_MARKER)
+        if marker >= 0:
+            text = text[:marker]
+            sequence.done = True
+            final = True
+        if not final:
+            # Hold back a trailing "#"/"##" that may become the stop marker, and
+            # partial UTF-8 characters that decode as U+FFFD until complete.
+            text = text.rstrip("#\ufffd")
+        if sequence.request.on_text and len(text) > sequence.emitted:
+            sequence.request.on_text(text[sequence.emitted :])
+        sequence.emitted = max(sequence.emitted, len(text))
+        sequence.request.result = text
+
+    def _generate_batch(self, requests: list[GenerationRequest]) -> list[str]:
+        if self.model is None:
+            raise LLMUnavailable("local LLM is not loaded")
+        eos_id = self.tokenizer.eos_token_id
+        with torch.inference_mode():
+            prefilled = [self._prefill(request) for request in requests]
+            sequences = [_Sequence(request, length, logits) for request, (length, _, logits) in zip(requests, prefilled)]
+
+            # Left-pad every prompt cache to the longest one so the batch decodes together.
+            longest = max(length for length, _, _ in prefilled)
+            layer_count = len(prefilled[0][1])
+            layers = []
+            for layer in range(layer_count):
+                keys, values = [], []
+                for length, prompt_layers, _ in prefilled:
+                    key, value = prompt_layers[layer]
+                    pad = longest - length
+                    keys.append(torch.nn.functional.pad(key, (0, 0, pad, 0)))
+                    values.append(torch.nn.functional.pad(value, (0, 0, pad, 0)))
+                layers.append((torch.cat(keys), torch.cat(values)))
+            attention = torch.zeros(len(sequences), longest, dtype=torch.long)
+            for row, (length, _, _) in enumerate(prefilled):
+                attention[row, longest - length :] = 1
+
+            active = list(range(len(sequences)))
+            step = 0
+            while active:
+                next_tokens = []
+                for index in active:
+                    sequence = sequences[index]
+                    token = _sample(sequence.next_logits, sequence.request.options)
+                    sequence.token_ids.append(token)
+                    GENERATED_TOKENS.inc()
+                    if token == eos_id:
+                        sequence.done = True
+                    else:
+                        self._emit(sequence)
+                    limit = min(sequence.request.options.max_output_tokens, self.max_new_tokens)
+                    if sequence.request.cancelled or len(sequence.token_ids) >= limit:
+                        sequence.done = True
+                    next_tokens.append(token)
+
+                keep = [position for position, index in enumerate(active) if not sequences[index].done]
+                if len(keep) < len(active):
+                    # Drop finished rows so they stop costing compute.
+                    selector = torch.tensor(keep, dtype=torch.long)
+                    layers = [(key.index_select(0, selector), value.index_select(0, selector)) for key, value in layers]
+                    attention = attention.index_select(0, selector)
+                    next_tokens = [next_tokens[position] for position in keep]
+                    active = [active[position] for position in keep]
+                if not active:
+                    break
+
+                started = time.perf_counter()
+                attention = torch.cat([attention, torch.ones(len(active), 1, dtype=torch.long)], dim=1)
+                positions = torch.tensor([[sequences[index].position + step] for index in active])
+                outputs = self.model(
+                    input_ids=torch.tensor([[token] for token in next_tokens]),
+                    attention_mask=attention,
+                    position_ids=positions,
+                    past_key_values=_make_cache(layers),
+                    use_cache=True,
+                )
+                layers = _cache_layers(outputs.past_key_values)
+                for row, index in enumerate(active):
+                    sequences[index].next_logits = outputs.logits[row, -1]
+                elapsed = time.perf_counter() - started
+                DECODE_STEP_SECONDS.observe(elapsed)
+                self._token_ms.append(elapsed * 1000)
+                step += 1
+
+        for sequence in sequences:
+            self._emit(sequence, final=True)
+        return [sequence.request.result.strip() for sequence in sequences]
+
+    async def generate(
+        self, messages: list[dict[str, str]], system: Optional[str] = None, options: Optional[GenerationOptions] = None
+    ) -> str:
+        await self._require_loaded()
+        request = GenerationRequest(self.prompt_segments(messages, system), options or GenerationOptions())
+        return await self.batcher.submit(request)
+
+    async def stream(
+        self, messages: list[dict[str, str]], system: Optional[str] = None, options: Optional[GenerationOptions] = None
+    ) -> AsyncIterator[str]:
+        await self._require_loaded()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        request = GenerationRequest(
+            self.prompt_segments(messages, system),
+            options or GenerationOptions(),
+            on_text=lambda text: loop.call_soon_threadsafe(queue.put_nowait, text),
+        )
+        task = asyncio.ensure_future(self.batcher.submit(request))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                text = await queue.get()
+                if text is None:
+                    break
+                yield text
+            task.result()
+        finally:
+            request.cancelled = True
+
+    def snapshot(self) -> dict[str, Any]:
+        samples = sorted(self._token_ms)
+
+        def pick(q: float) -> float:
+            return round(samples[min(len(samples) - 1, int(q * len(samples)))], 3) if samples else 0.0
+
+        return {
+            **super().snapshot(),
+            "model_path": self.model_path,
+            "adapter_path": self.adapter_path,
+            "quantized": self.quantize,
+            **self.status,
+            "decode_step_ms": {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)},
+            "prefix_cache": self.prefix_cache.snapshot(),
+            "batcher": self.batcher.snapshot(),
+        }
+
+
+_PROVIDERS: dict[str, LLMProvider] = {}
+
+
+def get_provider(name: str) -> LLMProvider:
+    """Shared provider instance by name ("gemini" or "local")."""
+    if name not in _PROVIDERS:
+        if name == "gemini":
+            from app.services.resilience import resilient
+
+            _PROVIDERS[name] = resilient(GeminiProvider(gemini_client))
+        elif name == "local":
+            _PROVIDERS[name] = LocalLLMProvider(
+                settings.LOCAL_LLM_MODEL_PATH or settings.VLM_MODEL_PATH,
+                adapter_path=settings.LOCAL_LLM_ADAPTER_PATH,
+                quantize=settings.LOCAL_LLM_QUANTIZE,
+                max_batch_size=settings.LOCAL_LLM_MAX_BATCH_SIZE,
+                batch_wait_ms=settings.LOCAL_LLM_BATCH_WAIT_MS,
+                kv_cache_tokens=settings.LOCAL_LLM_KV_CACHE_TOKENS,
+                max_new_tokens=settings.LOCAL_LLM_MAX_NEW_TOKENS,
+            )
+        else:
+            raise ValueError(f"Unknown LLM provider: {name}")
+    return _PROVIDERS[name]
+
+
+def active_providers() -> list[LLMProvider]:
+    return list(_PROVIDERS.values())
+
+
+async def start_llm_providers() -> None:
+    if not settings.AI_PRELOAD_MODELS:
+        return
+    for provider in active_providers():
+        await provider.start()
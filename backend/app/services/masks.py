@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import os
+import re
+import struct
+from typing import Any, Optional
+
+from app.core.config import settings
+
+try:
+    import numpy as np  # type: ignore
+except Exception:
+    np = None
+
+MASK_MAGIC = b"DTMK"
+MASK_VERSION = 1
+ENCODING_PACKED = 0
+ENCODING_RLE = 1
+# magic, version, encoding, height, width
+_HEADER = struct.Struct("<4sBBII")
+
+MASK_ID_PATTERN = re.compile(r"^[0-9a-f]{16,64}$")
+
+
+class MaskNotFound(LookupError):
+    """Raised when a mask id does not exist in the store."""
+
+
+def pack_rows(mask: Any) -> bytes:
+    # Each row is padded to a whole byte so row ranges can be read without decoding the rest.
+    return np.packbits(mask.astype(bool), axis=1).tobytes()
+
+
+def rle_runs(flat: Any) -> Any:
+    """Alternating run lengths over the flattened mask, starting with background."""
+    flat = flat.astype(np.uint8)
+    changes = np.flatnonzero(np.diff(flat)) + 1
+    boundaries = np.concatenate(([0], changes, [flat.size]))
+    runs = np.diff(boundaries)
+    if flat.size and flat[0]:
+        runs = np.concatenate(([0], runs))
+    return runs.astype(np.uint32)
+
+
+def encode_mask(mask: Any) -> bytes:
+    """Serialize a 2D boolean mask, using RLE or row bit-packing, whichever is smaller."""
+    mask = np.asarray(mask, dtype=bool)
+    if mask.ndim != 2:
+        raise ValueError("mask must be two-dimensional")
+    height, width = mask.shape
+    packed = pack_rows(mask)
+    runs = rle_runs(mask.reshape(-1))
+    if runs.nbytes < len(packed):
+        encoding, payload = ENCODING_RLE, runs.astype("<u4").tobytes()
+    else:
+        encoding, payload = ENCODING_PACKED, packed
+    return _HEADER.pack(MASK_MAGIC, MASK_VERSION, encoding, height, width) + payload
+
+
+def _parse_header(blob: bytes) -> tuple[int, int, int]:
+    magic, version, encoding, height, width = _HEADER.unpack_from(blob)
+    if magic != MASK_MAGIC or version != MASK_VERSION:
+        raise ValueError("not a mask blob")
+    return encoding, height, width
+
+
+def mask_shape(blob: bytes) -> tuple[int, int]:
+    _, height, width = _parse_header(blob)
+    return height, width
+
+
+def decode_mask(blob: bytes, rows: Optional[tuple[int, int]] = None) -> Any:
+    """Decode a mask, or only the ``[start, stop)`` row range for bit-packed masks."""
+    encoding, height, width = _parse_header(blob)
+    start, stop = rows or (0, height)
+    payload = memoryview(blob)[_HEADER.size :]
+    if encoding == ENCODING_PACKED:
+        row_bytes = (width + 7) // 8
+        packed = np.frombuffer(payload, dtype=np.uint8, count=(stop - start) * row_bytes, offset=start * row_bytes)
+        return np.unpackbits(packed.reshape(stop - start, row_bytes), axis=1, count=width).astype(bool)
+
+    runs = np.frombuffer(payload, dtype="<u4")
+    values = np.arange(runs.size) % 2 == 1
+    return np.repeat(values, runs).reshape(height, width)[start:stop]
+
+
+def downsample_mask(mask: Any, factor: int) -> Any:
+    """Block max-pool: an output pixel is set if any pixel in its block is set."""
+    if factor <= 1:
+        return mask
+    height, width = mask.shape
+    padded = np.zeros((-(-height // factor) * factor, -(-width // factor) * factor), dtype=bool)
+    padded[:height, :width] = mask
+    return padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor).any(axis=(1, 3))
+
+
+def mask_path(mask_id: str) -> str:
+    if not MASK_ID_PATTERN.match(mask_id):
+        raise MaskNotFound(mask_id)
+    return os.path.join(settings.AI_MASK_DIR, f"{mask_id}.mask")
+
+
+def save_mask(mask_id: str, mask: Any) -> int:
+    """Persist a mask under ``mask_id``; returns the stored size in bytes."""
+    path = mask_path(mask_id)
+    os.makedirs(settings.AI_MASK_DIR, exist_ok=True)
+    blob = encode_mask(mask)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as handle:
+        handle.write(blob)
+    os.replace(temp_path, path)
+    return len(blob)
+
+
+def load_mask(mask_id: str) -> bytes:
+    try:
+        with open(mask_path(mask_id), "rb") as handle:
+            return handle.read()
+    except FileNotFoundError:
+        raise MaskNotFound(mask_id)
+
+
+def read_mask_region(
+    blob: bytes,
+    x: int = 0,
+    y: int = 0,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    downsample: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+) -> tuple[Any, int]:
+    """Crop and downsample a stored mask; returns ``(region, factor)``.
+
+    When no factor is given, the smallest one that keeps the output within
+    ``max_pixels`` is chosen, so a full-resolution mask is only ever returned
+    when it is small enough.
+    """
+    mask_height, mask_width = mask_shape(blob)
+    x = min(max(0, x), mask_width)
+    y = min(max(0, y), mask_height)
+    width = mask_width - x if width is None else min(max(0, width), mask_width - x)
+    height = mask_height - y if height is None else min(max(0, height), mask_height - y)
+
+    factor = max(1, downsample or 1)
+    if downsample is None and max_pixels:
+        while -(-width // factor) * -(-height // factor) > max_pixels:
+            factor *= 2
+
+    region = decode_mask(blob, rows=(y, y + height))[:, x : x + width]
+    return downsample_mask(region, factor), factor
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import inspect
+import time
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+try:
+    import torch  # type: ignore
+except Exception:
+    torch = None
+
+try:
+    import onnxruntime  # type: ignore
+except Exception:
+    onnxruntime = None
+
+# "torchscript" loads the *_MODEL_PATH file as is. The ONNX backends load a file
+# exported next to it by export_models.py: cnn.pt -> cnn.onnx / cnn.int8.onnx.
+BACKENDS = ("torchscript", "onnx", "onnx_int8")
+ONNX_SUFFIXES = {"onnx": ".onnx", "onnx_int8": ".int8.onnx"}
+
+
+class BackendUnavailable(RuntimeError):
+    """The requested backend cannot serve this model here (missing runtime or file)."""
+
+
+def artifact_path(model_path: str, backend: str) -> Path:
+    """File a backend loads for the model configured at ``model_path``."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    path = Path(model_path)
+    if backend == "torchscript":
+        return path
+    for known in (".int8.onnx", ".onnx"):
+        if path.name.endswith(known):
+            stem = path.name[: -len(known)]
+            break
+    else:
+        stem = path.stem
+    return path.with_name(stem + ONNX_SUFFIXES[backend])
+
+
+class OnnxModel:
+    """ONNX Runtime session with the calling convention of a TorchScript module.
+
+    Takes a float tensor batch and returns the first output as a CPU float
+    tensor, so ``_forward_tensor`` and the stage post-processing are unchanged.
+    """
+
+    def __init__(self, path: Path, intra_op_threads: int = 0) -> None:
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def eval(self) -> "OnnxModel":
+        return self
+
+    def __call__(self, inputs: Any) -> Any:
+        array = inputs.detach().to("cpu", torch.float32).contiguous().numpy()
+        outputs = self.session.run(None, {self.input_name: array})
+        return torch.from_numpy(outputs[0])
+
+
+def load_model(backend: str, model_path: str, device: str, intra_op_threads: int = 0) -> tuple[Any, Path]:
+    """Load one model with ``backend``; returns ``(model, file loaded)``."""
+    path = artifact_path(model_path, backend)
+    if not path.exists():
+        hint = "" if backend == "torchscript" else " (create it with export_models.py)"
+        raise BackendUnavailable(f"{path} not found{hint}")
+    if backend == "torchscript":
+        model = torch.jit.load(str(path), map_location=device)
+        model.eval()
+        return model, path
+    if onnxruntime is None:
+        raise BackendUnavailable("onnxruntime is not installed")
+    return OnnxModel(path, intra_op_threads), path
+
+
+# --- Offline export and parity checking (used by export_models.py) ---
+
+
+def export_onnx(model_path: str, output: Path, input_size: int, opset: int = 17) -> Path:
+    """Export a TorchScript model to ONNX with a dynamic batch dimension."""
+    model = torch.jit.load(str(model_path), map_location="cpu")
+    model.eval()
+    sample = torch.zeros(2, 1, input_size, input_size)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    # The TorchScript-based exporter is the one that accepts ScriptModules; newer
+    # torch releases default to the dynamo exporter, older ones lack the flag.
+    extra = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        model,
+        (sample,),
+        str(output),
+        input_names=["input"],
+        output_names=["output"],
+        dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+        opset_version=opset,
+        **extra,
+    )
+    return output
+
+
+# ONNX Runtime's integer convolution (ConvInteger) is several times slower than
+# its float Conv on CPU, so by default only the matrix multiplications are
+# quantized; convolutions keep float weights.
+DEFAULT_INT8_OPS = ("MatMul", "Gemm")
+
+
+def quantize_onnx(source: Path, output: Path, op_types: Iterable[str] = DEFAULT_INT8_OPS) -> Path:
+    """Dynamic int8 quantization: int8 weights, activations quantized per batch at run time."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared = output.with_name(output.name + ".pre")
+    try:
+        # Shape inference and graph cleanup first, as ONNX Runtime recommends.
+        quant_pre_process(str(source), str(prepared))
+        quantize_dynamic(str(prepared), str(output), weight_type=QuantType.QInt8, op_types_to_quantize=list(op_types))
+    finally:
+        prepared.unlink(missing_ok=True)
+    return output
+
+
+def sample_inputs(batches: int, batch_size: int, input_size: int, seed: int = 0) -> list[Any]:
+    """Inputs in [0, 1] like ``_preprocess`` output: noise, smooth gradients and blobs."""
+    generator = torch.Generator().manual_seed(seed)
+    samples = []
+    for index in range(batches):
+        shape = (batch_size, 1, input_size, input_size)
+        noise = torch.rand(shape, generator=generator)
+        if index % 3 == 1:
+            noise = torch.nn.functional.avg_pool2d(noise, 9, stride=1, padding=4)
+        elif index % 3 == 2:
+            grid = torch.linspace(-1, 1, input_size)
+            radius = grid[None, :] ** 2 + grid[:, None] ** 2
+            noise = noise * 0.3 + (radius < torch.rand(batch_size, 1, 1, 1, generator=generator) * 0.5).float() * 0.7
+        samples.append(noise.clamp_(0, 1))
+    return samples
+
+
+def decisions(outputs: Any) -> Any:
+    """What the pipeline reads from an output: class argmax, or sign of a single logit / mask logit."""
+    if outputs.dim() >= 2 and outputs.shape[1] > 1:
+        return outputs.argmax(dim=1)
+    return outputs > 0
+
+
+def parity_report(reference: Any, candidate: Any, inputs: Iterable[Any], repeat: int = 3) -> dict[str, Any]:
+    """Compare a candidate backend's outputs and latency with the float TorchScript model."""
+    max_abs = 0.0
+    total_abs = 0.0
+    elements = 0
+    agree = 0
+    decided = 0
+    timings: dict[str, float] = {"reference": 0.0, "candidate": 0.0}
+    inputs = list(inputs)
+    with torch.inference_mode():
+        # One untimed call each, so one-off initialisation is not measured.
+        reference(inputs[0])
+        candidate(inputs[0])
+        for batch in inputs:
+            outputs = {}
+            for name, model in (("reference", reference), ("candidate", candidate)):
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    result = model(batch)
+                timings[name] += (time.perf_counter() - started) / repeat
+                if isinstance(result, (tuple, list)):
+                    result = result[0]
+                outputs[name] = result.float().cpu()
+            diff = (outputs["reference"] - outputs["candidate"]).abs()
+            max_abs = max(max_abs, float(diff.max()))
+            total_abs += float(diff.sum())
+            elements += diff.numel()
+            same = decisions(outputs["reference"]) == decisions(outputs["candidate"])
+            agree += int(same.sum())
+            decided += same.numel()
+    return {
+        "max_abs_diff": max_abs,
+        "mean_abs_diff": total_abs / max(elements, 1),
+        "decision_agreement": agree / max(decided, 1),
+        "reference_ms": round(timings["reference"] * 1000, 3),
+        "candidate_ms": round(timings["candidate"] * 1000, 3),
+        "speedup": round(timings["reference"] / max(timings["candidate"], 1e-9), 2),
+    }
+
+
+def file_size_mb(path: Optional[Path]) -> Optional[float]:
+    if path is None or not path.exists():
+        return None
+    return round(path.stat().st_size / 1e6, 3)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+# A non-email match that runs straight into an "@" may overlap an email the
+# sequential passes would have masked first (see PIIMasker.mask).
+_EMAIL_AHEAD = re.compile(r"[\w.-]*@")
+
+
+@dataclass(frozen=True)
+class Detector:
+    """One kind of sensitive value: a regex and the placeholder that replaces it."""
+
+    name: str
+    pattern: str
+    placeholder: str
+    flags: int = 0
+    # Character class every match contains; texts without one skip the detector.
+    requires: str = r"\d"
+    regex: re.Pattern = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "regex", re.compile(self.pattern, self.flags))
+
+
+# Each pattern opens with a lookahead on its possible first characters, which
+# lets the combined scan skip most positions without trying the alternative.
+EMAIL = Detector(
+    "email",
+    r"(?=[\w.-])\b[\w\.-]+@[\w\.-]+\.\w+\b",
+    "[EMAIL_MASKED]",
+    re.IGNORECASE,
+    requires="@",
+)
+# The negative lookahead only rejects starts that cannot match: a leading digit
+# run that runs into a letter, or one longer than the 23 digits the pattern can
+# span. It stops the nested groups from backtracking through every split of
+# long numeric tokens such as accession numbers or DICOM values.
+PHONE = Detector(
+    "phone",
+    r"(?=[+(\d])\b(?!\+?\(?(?:\d+[^\W\d]|\d{24}))"
+    r"(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?){2,4}\d{2,4}\b",
+    "[PHONE_MASKED]",
+)
+ID = Detector("id", r"(?=\d)\b\d{3,4}[-\s]?\d{3,4}[-\s]?\d{3,4}\b", "[ID_MASKED]")
+MRN = Detector(
+    "mrn",
+    r"(?=[mph])\b(?:MRN|medical\s+record\s+(?:number|no\.?)|patient\s+id|hospital\s+(?:number|no\.?))"
+    r"\s*[:#]?\s*[A-Z]{0,3}-?\d{4,12}\b",
+    "[MRN_MASKED]",
+    re.IGNORECASE,
+)
+
+DETECTORS = {detector.name: detector for detector in (EMAIL, PHONE, ID, MRN)}
+# The patterns _mask_sensitive_text has always applied, in their original order.
+LEGACY_DETECTORS = (EMAIL, PHONE, ID)
+
+
+def detectors_by_name(names: str | Iterable[str]) -> list[Detector]:
+    """Resolve names such as ``"email,mrn,phone,id"`` in order; unknown names raise ``ValueError``."""
+    if isinstance(names, str):
+        names = names.split(",")
+    resolved = []
+    for name in names:
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in DETECTORS:
+            raise ValueError(f"Unknown PII detector: {name}")
+        resolved.append(DETECTORS[name])
+    return resolved
+
+
+class PlaceholderMapping:
+    """Numbers placeholders per distinct value, consistently across calls.
+
+    With ``"[EMAIL_MASKED]"`` a reader cannot tell two addresses apart; sharing
+    one mapping across a conversation turns them into ``[EMAIL_MASKED_1]`` and
+    ``[EMAIL_MASKED_2]`` and keeps each number stable. Only a hash of each value
+    is kept, so the mapping holds no PII.
+    """
+
+    def __init__(self) -> None:
+        self._numbers: dict[tuple[str, str], int] = {}
+        self._counts: dict[str, int] = {}
+
+    def placeholder(self, detector: Detector, value: str) -> str:
+        key = (detector.name, hashlib.sha256(value.encode("utf-8")).hexdigest())
+        number = self._numbers.get(key)
+        if number is None:
+            number = self._numbers[key] = self._counts.get(detector.name, 0) + 1
+            self._counts[detector.name] = number
+        return f"{detector.placeholder[:-1]}_{number}]"
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+
+class PIIMasker:
+    """Masks sensitive values in one scan with a combined alternation of all detectors.
+
+    Output is identical to applying each detector's ``re.sub`` in turn (the
+    order given is the priority). The combined scan is leftmost-first while
+    the sequential passes give an earlier detector priority over the whole
+    text, so the two can only disagree where a match touches another match or
+    runs into an "@" (i.e. digits glued to an email address). Those rare texts
+    are re-masked with the sequential passes.
+
+    Detectors whose required character (a digit, "@") does not occur in the
+    text are left out of the scan, so plain prose costs one character search.
+    """
+
+    def __init__(self, detectors: Iterable[Detector] = LEGACY_DETECTORS) -> None:
+        self.detectors = list(detectors)
+        if not self.detectors:
+            raise ValueError("PIIMasker needs at least one detector")
+        self._requirements = {requires: re.compile(requires) for requires in {d.requires for d in self.detectors}}
+        self._any_required = re.compile("|".join(self._requirements))
+        # Combined patterns per subset of detectors that can match a given text.
+        self._combined: dict[tuple[int, ...], re.Pattern] = {}
+        self.scans = 0
+        self.sequential_fallbacks = 0
+
+    @property
+    def placeholders(self) -> dict[str, str]:
+        return {detector.name: detector.placeholder for detector in self.detectors}
+
+    def combined(self, indexes: tuple[int, ...]) -> re.Pattern:
+        pattern = self._combined.get(indexes)
+        if pattern is None:
+            pattern = self._combined[indexes] = re.compile(
+                "|".join(
+                    f"(?P<d{index}>{'(?i:' if self.detectors[index].flags & re.IGNORECASE else '(?:'}"
+                    f"{self.detectors[index].pattern}))"
+                    for index in indexes
+                )
+            )
+        return pattern
+
+    def mask(self, text: str, mapping: Optional[PlaceholderMapping] = None) -> str:
+        if not text or not self._any_required.search(text):
+            return text
+        present = {requires: pattern.search(text) is not None for requires, pattern in self._requirements.items()}
+        indexes = tuple(index for index, detector in enumerate(self.detectors) if present[detector.requires])
+        if not indexes:
+            return text
+        self.scans += 1
+        check_email = "@" in text
+        ambiguous = False
+        last_end = -1
+
+        def replace(match: re.Match) -> str:
+            nonlocal ambiguous, last_end
+            if match.start() == last_end or (check_email and _EMAIL_AHEAD.match(text, match.end())):
+                ambiguous = True
+            last_end = match.end()
+            detector = self.detectors[int(match.lastgroup[1:])]
+            return detector.placeholder if mapping is None else mapping.placeholder(detector, match.group())
+
+        masked = self.combined(indexes).sub(replace, text)
+        if ambiguous:
+            self.sequential_fallbacks += 1
+            return self.mask_sequential(text, mapping)
+        return masked
+
+    def mask_sequential(self, text: str, mapping: Optional[PlaceholderMapping] = None) -> str:
+        """Reference implementation: one ``re.sub`` pass per detector, in priority order."""
+        if not text:
+            return text
+        for detector in self.detectors:
+            if mapping is None:
+                text = detector.regex.sub(detector.placeholder, text)
+            else:
+                text = detector.regex.sub(lambda match, d=detector: mapping.placeholder(d, match.group()), text)
+        return text
+
+    def snapshot(self) -> dict[str, object]:
+        return {
+            "detectors": [detector.name for detector in self.detectors],
+            "scans": self.scans,
+            "sequential_fallbacks": self.sequential_fallbacks,
+        }
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any
+
+from fastapi import status
+from jose import JWTError, jwt
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+from app.core.database import db
+from app.core.metrics import REGISTRY
+
+COLLECTION_NAME = "rate_limits"
+
+RATE_LIMITED = REGISTRY.counter(
+    "rate_limit_rejected_total",
+    "Requests shed by admission control, by route class and reason (rate or concurrency).",
+    labelnames=("route_class", "reason"),
+)
+ADMITTED = REGISTRY.counter("rate_limit_admitted_total", "Requests admitted, by route class.", labelnames=("route_class",))
+IN_FLIGHT = REGISTRY.gauge("rate_limit_in_flight", "Requests in flight per capped route class.", labelnames=("route_class",))
+
+
+@dataclass(frozen=True)
+class RouteClass:
+    """A group of routes sharing one token bucket per client and an optional concurrency cap.
+
+    Buckets refill at ``per_minute`` tokens a minute up to ``burst``; each
+    request takes one. ``max_concurrency`` (0 = unlimited) caps requests in
+    flight across all clients in this worker process. ``per_minute`` 0
+    turns the bucket off.
+    """
+
+    name: str
+    per_minute: float
+    burst: int
+    max_concurrency: int = 0
+    # Key buckets by client IP even when the request carries a token.
+    by_ip: bool = False
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60.0
+
+
+class MemoryRateLimitBackend:
+    """Token buckets in this process; the default for single-worker deployments."""
+
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self.max_keys = max(1, max_keys)
+        self.errors = 0
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Take one token; returns 0 if allowed, else seconds until a token is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - updated) * rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        # Least recently used buckets go first; an evicted bucket restarts full.
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"backend": "memory", "buckets": len(self._buckets), "max_keys": self.max_keys, "errors": self.errors}
+
+
+class MongoRateLimitBackend:
+    """Token buckets shared by all workers in the ``rate_limits`` collection.
+
+    Each take is one atomic ``find_one_and_update`` with an update pipeline
+    that refills, checks and decrements the bucket, so concurrent workers never
+    hand out the same token. Idle buckets are removed by a TTL index.
+    """
+
+    def __init__(self, idle_seconds: int = 3600) -> None:
+        self.idle_seconds = idle_seconds
+        self.errors = 0
+
+    def _collection(self) -> Any:
+        if db.client is None:
+            return None
+        return db.client[settings.DATABASE_NAME][COLLECTION_NAME]
+
+    async def ensure_indexes(self) -> None:
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as exc:
+            print(f"[RateLimit] Could not create rate limit indexes: {exc}")
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        collection = self._collection()
+        if collection is None:
+            return 0.0
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}
+        bucket = await collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": {"$min": [burst, refilled]}}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {
+                    "$set": {
+                        "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                        "updated_at": now,
+                        "expires_at": now + timedelta(seconds=self.idle_seconds),
+                    }
+                },
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / rate
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"backend": "mongo", "errors": self.errors}
+
+
+def _route_classes() -> list[tuple[str, re.Pattern[str], RouteClass]]:
+    ai = RouteClass(
+        "ai_analysis",
+        settings.RATE_LIMIT_AI_PER_MINUTE,
+        settings.RATE_LIMIT_AI_BURST,
+        settings.RATE_LIMIT_AI_CONCURRENCY,
+    )
+    chat = RouteClass(
+        "chat",
+        settings.RATE_LIMIT_CHAT_PER_MINUTE,
+        settings.RATE_LIMIT_CHAT_BURST,
+        settings.RATE_LIMIT_CHAT_CONCURRENCY,
+    )
+    auth = RouteClass("auth", settings.RATE_LIMIT_AUTH_PER_MINUTE, settings.RATE_LIMIT_AUTH_BURST, by_ip=True)
+    public = RouteClass("public", settings.RATE_LIMIT_PUBLIC_PER_MINUTE, settings.RATE_LIMIT_PUBLIC_BURST, by_ip=True)
+    return [
+        ("POST", re.compile(r"^/ai/analyze-(image|volume|batch)$"), ai),
+        ("POST", re.compile(r"^/ai/chatbot(/stream)?$"), chat),
+        ("POST", re.compile(r"^/auth/(login|register)$"), auth),
+        ("GET", re.compile(r"^/admin/public-stats$"), public),
+    ]
+
+
+class RateLimitMiddleware:
+    """Admission control in front of the routers.
+
+    Every request takes a token from the bucket of its route class and client.
+    The client is the token subject, or the IP address for anonymous requests
+    and IP-keyed classes. Heavy classes also have a per-process concurrency cap.
+    Refused requests get 429 with Retry-After straight away rather than
+    waiting in a queue. If the shared backend fails, requests are let through.
+
+    The IP address is the socket peer unless ``trusted_proxies`` is set: with
+    ``n`` proxies in front, each appending to X-Forwarded-For, it is the ``n``-th
+    entry from the right. Entries further left come from the client and are
+    never used, so a forged header cannot pick a fresh bucket. Left at 0
+    behind a proxy, every client shares the proxy's bucket.
+    """
+
+    EXEMPT_PATHS = ("/", "/metrics")
+
+    def __init__(self, app: Any, backend: Any, trusted_proxies: int = 0) -> None:
+        self.app = app
+        self.backend = backend
+        self.trusted_proxies = max(0, trusted_proxies)
+        self._warned_forwarded = False
+        self.routes = _route_classes()
+        self.default = RouteClass("default", settings.RATE_LIMIT_DEFAULT_PER_MINUTE, settings.RATE_LIMIT_DEFAULT_BURST)
+        self.in_flight: dict[str, int] = {}
+
+    def classify(self, method: str, path: str) -> RouteClass:
+        for route_method, pattern, route_class in self.routes:
+            if method == route_method and pattern.match(path):
+                return route_class
+        return self.default
+
+    def _client_ip(self, scope: dict, headers: dict[bytes, bytes]) -> str:
+        forwarded = headers.get(b"x-forwarded-for")
+        if forwarded and self.trusted_proxies:
+            hops = [hop.strip() for hop in forwarded.decode("latin-1").split(",")]
+            # Fewer hops than proxies means the request skipped one; use the
+            # leftmost, which the first proxy appended.
+            return hops[-min(self.trusted_proxies, len(hops))] or "unknown"
+        if forwarded and not self._warned_forwarded:
+            self._warned_forwarded = True
+            print(
+                "[RateLimit] Requests carry X-Forwarded-For but RATE_LIMIT_TRUSTED_PROXIES is 0; "
+                "IP-keyed buckets use the peer address, shared by everyone behind the proxy"
+            )
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def client_key(self, scope: dict, route_class: RouteClass) -> str:
+        headers = dict(scope.get("headers", []))
+        if not route_class.by_ip:
+            scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    subject = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]).get("sub")
+                except JWTError:
+                    subject = None
+                if subject:
+                    return f"user:{subject}"
+        return f"ip:{self._client_ip(scope, headers)}"
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in self.EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.classify(scope["method"], scope["path"])
+        cap = route_class.max_concurrency
+        if cap and self.in_flight.get(route_class.name, 0) >= cap:
+            RATE_LIMITED.inc(route_class=route_class.name, reason="concurrency")
+            await _send_rate_limited(send, settings.RATE_LIMIT_CONCURRENCY_RETRY_AFTER_SECONDS, "Server is busy")
+            return
+
+        retry_after = 0.0
+        if route_class.per_minute > 0:
+            key = f"{route_class.name}:{self.client_key(scope, route_class)}"
+            try:
+                retry_after = await self.backend.take(key, route_class.rate, route_class.burst)
+            except Exception as exc:
+                self.backend.errors += 1
+                print(f"[RateLimit] Backend error, admitting request: {exc}")
+        if retry_after > 0:
+            RATE_LIMITED.inc(route_class=route_class.name, reason="rate")
+            await _send_rate_limited(send, retry_after, "Too many requests")
+            return
+
+        ADMITTED.inc(route_class=route_class.name)
+        if not cap:
+            await self.app(scope, receive, send)
+            return
+        self.in_flight[route_class.name] = self.in_flight.get(route_class.name, 0) + 1
+        IN_FLIGHT.inc(route_class=route_class.name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[route_class.name] -= 1
+            IN_FLIGHT.dec(route_class=route_class.name)
+
+
+async def _send_rate_limited(send: Any, retry_after: float, message: str) -> None:
+    seconds = max(1, math.ceil(retry_after))
+    body = ('{"detail":"%s. Please retry in %d seconds."}' % (message, seconds)).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status.HTTP_429_TOO_MANY_REQUESTS,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(seconds).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def build_backend(name: str) -> Any:
+    if name == "mongo":
+        return MongoRateLimitBackend(settings.RATE_LIMIT_IDLE_SECONDS)
+    if name != "memory":
+        print(f"[RateLimit] Unknown RATE_LIMIT_BACKEND {name!r}; using memory")
+    return MemoryRateLimitBackend(settings.RATE_LIMIT_MEMORY_KEYS)
+
+
+rate_limit_backend = build_backend(settings.RATE_LIMIT_BACKEND)
+
+
+async def ensure_rate_limit_indexes() -> None:
+    if isinstance(rate_limit_backend, MongoRateLimitBackend):
+        await rate_limit_backend.ensure_indexes()
@@ -0,0 +1,449 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.core.metrics import REGISTRY
+from app.services.gemini import GeminiError
+from app.services.llm import GenerationOptions, LLMProvider, LLMUnavailable
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = REGISTRY.gauge(
+    "llm_circuit_state", "Circuit breaker state per LLM provider (0 closed, 1 half-open, 2 open).", labelnames=("provider",)
+)
+CIRCUIT_TRANSITIONS = REGISTRY.counter(
+    "llm_circuit_transitions_total", "Circuit breaker state changes.", labelnames=("provider", "state")
+)
+LLM_CALLS = REGISTRY.counter(
+    "llm_calls_total",
+    "Upstream LLM calls by outcome (success, failure, error, rejected_open, rejected_limit).",
+    labelnames=("provider", "outcome"),
+)
+CONCURRENCY_LIMIT = REGISTRY.gauge(
+    "llm_concurrency_limit", "Current adaptive concurrency limit per LLM provider.", labelnames=("provider",)
+)
+HEDGES = REGISTRY.counter(
+    "llm_hedges_total", "Hedged LLM requests, launched and won by the second attempt.", labelnames=("provider", "result")
+)
+
+
+class CircuitOpen(LLMUnavailable):
+    """Raised without calling the upstream while its circuit is open."""
+
+
+class ConcurrencyLimited(LLMUnavailable):
+    """Raised when no concurrency slot frees up within the queue timeout."""
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Errors that say the upstream is unhealthy, as opposed to a bad request."""
+    if isinstance(exc, GeminiError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """Failure-ratio breaker over a sliding window of recent calls.
+
+    Calls slower than ``slow_call_seconds`` count as failures, so a degraded
+    upstream trips it before requests have to hit the client timeout. After
+    ``open_seconds`` up to ``half_open_calls`` probes are let through; one
+    failure reopens the circuit, that many successes close it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_ratio: float = 0.5,
+        min_calls: int = 5,
+        window: int = 20,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 2,
+        slow_call_seconds: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_calls = max(1, min_calls)
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self.slow_call_seconds = slow_call_seconds
+        self.clock = clock
+        self.outcomes: deque[bool] = deque(maxlen=max(self.min_calls, window))
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_successes = 0
+        self.transitions = 0
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], provider=name)
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        print(f"[AI] LLM circuit for {self.name}: {self.state} -> {state}")
+        self.state = state
+        self.transitions += 1
+        self.probes = self.probe_successes = 0
+        if state == OPEN:
+            self.opened_at = self.clock()
+        self.outcomes.clear()
+        CIRCUIT_STATE.set(_STATE_VALUES[state], provider=self.name)
+        CIRCUIT_TRANSITIONS.inc(provider=self.name, state=state)
+
+    def allow(self) -> None:
+        """Reserve a call or raise :class:`CircuitOpen`; every allowed call must be recorded."""
+        if self.state == OPEN:
+            if self.clock() - self.opened_at < self.open_seconds:
+                raise CircuitOpen(f"{self.name} circuit is open")
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes >= self.half_open_calls:
+                raise CircuitOpen(f"{self.name} circuit is half-open and probing")
+            self.probes += 1
+
+    def record(self, success: bool, duration: float = 0.0) -> None:
+        failed = not success or duration > self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if failed:
+                self._transition(OPEN)
+            else:
+                self.probe_successes += 1
+                if self.probe_successes >= self.half_open_calls:
+                    self._transition(CLOSED)
+            return
+        if self.state == OPEN:
+            return
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.failure_ratio:
+            self._transition(OPEN)
+
+    def release(self) -> None:
+        """Give back a probe slot for a call that ended without a verdict (e.g. a client disconnect)."""
+        if self.state == HALF_OPEN and self.probes:
+            self.probes -= 1
+
+    def snapshot(self) -> dict[str, Any]:
+        window = list(self.outcomes)
+        return {
+            "state": self.state,
+            "failure_ratio": round(sum(window) / len(window), 3) if window else 0.0,
+            "window_calls": len(window),
+            "transitions": self.transitions,
+            "open_for_seconds": round(max(0.0, self.open_seconds - (self.clock() - self.opened_at)), 1)
+            if self.state == OPEN
+            else 0.0,
+        }
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD cap on in-flight upstream calls.
+
+    The limit grows by about one per ``limit`` healthy calls and halves on a
+    failure or slow call. Callers over the limit queue for at most
+    ``queue_seconds`` and are then rejected, so a slow upstream sheds load
+    instead of tying up every worker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int = 8,
+        minimum: int = 1,
+        maximum: int = 32,
+        queue_seconds: float = 2.0,
+    ) -> None:
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.queue_seconds = queue_seconds
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        CONCURRENCY_LIMIT.set(int(self.limit), provider=name)
+
+    def try_acquire(self) -> bool:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        if self.try_acquire():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up.
+                self.release()
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            self.rejected += 1
+            raise ConcurrencyLimited(f"{self.name} is at its concurrency limit ({int(self.limit)})") from None
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def record(self, healthy: bool) -> None:
+        if healthy:
+            self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+        else:
+            self.limit = max(float(self.minimum), self.limit / 2)
+        CONCURRENCY_LIMIT.set(int(self.limit), provider=self.name)
+        self._wake()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "rejected": self.rejected,
+        }
+
+
+async def hedged(
+    call: Callable[[], Awaitable[Any]],
+    delay: float,
+    can_hedge: Callable[[], bool] = lambda: True,
+    on_hedge: Optional[Callable[[], None]] = None,
+) -> tuple[Any, bool]:
+    """Run ``call``; if it has not finished after ``delay`` seconds, start a second one.
+
+    Returns ``(result, hedge_won)`` from the first attempt to succeed and cancels
+    the other. ``can_hedge`` is checked before the second attempt is launched.
+    """
+    first = asyncio.ensure_future(call())
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and can_hedge():
+            if on_hedge is not None:
+                on_hedge()
+            tasks.add(asyncio.ensure_future(call()))
+        error: Optional[BaseException] = None
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.discard(task)
+                if task.exception() is None:
+                    return task.result(), task is not first
+                error = error or task.exception()
+        raise error  # type: ignore[misc]
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class ResilientProvider(LLMProvider):
+    """Wraps an upstream provider with a circuit breaker, a concurrency limiter
+    and optional request hedging.
+
+    While the circuit is open, calls raise :class:`CircuitOpen` immediately,
+    which the chatbot and the VLM stage already turn into their local
+    fallbacks. Only transport errors, 429s and 5xx responses count against the
+    upstream; other errors pass through without tripping anything.
+    """
+
+    def __init__(
+        self,
+        inner: LLMProvider,
+        breaker: CircuitBreaker,
+        limiter: AdaptiveConcurrencyLimiter,
+        hedge: bool = False,
+        hedge_delay_ms: float = 0.0,
+    ) -> None:
+        self.inner = inner
+        self.name = inner.name
+        self.breaker = breaker
+        self.limiter = limiter
+        self.hedge = hedge
+        self.hedge_delay_ms = hedge_delay_ms
+        self._latencies: deque[float] = deque(maxlen=200)
+
+    def __getattr__(self, item: str) -> Any:
+        # Provider-specific attributes (e.g. ``loaded``, ``client``) come from the wrapped provider.
+        return getattr(self.inner, item)
+
+    @property
+    def available(self) -> bool:
+        return self.inner.available
+
+    @property
+    def model_id(self) -> str:
+        return self.inner.model_id
+
+    async def start(self) -> None:
+        await self.inner.start()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds before hedging: the configured delay, else the recent p95 latency."""
+        if self.hedge_delay_ms > 0:
+            return self.hedge_delay_ms / 1000
+        if len(self._latencies) < 20:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def _admit(self) -> None:
+        try:
+            self.breaker.allow()
+        except CircuitOpen:
+            LLM_CALLS.inc(provider=self.name, outcome="rejected_open")
+            raise
+
+    def _record(self, exc: Optional[BaseException], duration: float) -> None:
+        if exc is None:
+            healthy = duration <= self.breaker.slow_call_seconds
+            self._latencies.append(duration)
+            self.breaker.record(True, duration)
+            self.limiter.record(healthy)
+            LLM_CALLS.inc(provider=self.name, outcome="success")
+        elif is_upstream_failure(exc):
+            self.breaker.record(False, duration)
+            self.limiter.record(False)
+            LLM_CALLS.inc(provider=self.name, outcome="failure")
+        else:
+            self.breaker.release()
+            LLM_CALLS.inc(provider=self.name, outcome="error")
+
+    async def _limited(self) -> None:
+        try:
+            await self.limiter.acquire()
+        except BaseException as exc:
+            # Rejected or cancelled while queued: the call never reached the
+            # upstream, so its breaker reservation (maybe a half-open probe) goes back.
+            self.breaker.release()
+            if isinstance(exc, ConcurrencyLimited):
+                LLM_CALLS.inc(provider=self.name, outcome="rejected_limit")
+            raise
+
+    async def generate(
+        self, messages: list[dict[str, str]], system: Optional[str] = None, options: Optional[GenerationOptions] = None
+    ) -> str:
+        self._admit()
+        await self._limited()
+        started = time.perf_counter()
+        hedge_slot = False
+
+        def can_hedge() -> bool:
+            nonlocal hedge_slot
+            # Never hedge into a struggling upstream or past the concurrency limit.
+            hedge_slot = self.breaker.state == CLOSED and self.limiter.try_acquire()
+            return hedge_slot
+
+        def on_hedge() -> None:
+            HEDGES.inc(provider=self.name, result="launched")
+
+        try:
+            delay = self.hedge_delay() if self.hedge else None
+            if delay is None:
+                text = await self.inner.generate(messages, system, options)
+            else:
+                text, hedge_won = await hedged(
+                    lambda: self.inner.generate(messages, system, options), delay, can_hedge, on_hedge
+                )
+                if hedge_won:
+                    HEDGES.inc(provider=self.name, result="won")
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as exc:
+            self._record(exc, time.perf_counter() - started)
+            raise
+        else:
+            self._record(None, time.perf_counter() - started)
+            return text
+        finally:
+            self.limiter.release()
+            if hedge_slot:
+                self.limiter.release()
+
+    async def stream(
+        self, messages: list[dict[str, str]], system: Optional[str] = None, options: Optional[GenerationOptions] = None
+    ) -> AsyncIterator[str]:
+        # Streams are not hedged; the breaker judges them by time to first chunk.
+        self._admit()
+        await self._limited()
+        started = time.perf_counter()
+        first_chunk: Optional[float] = None
+        chunks = self.inner.stream(messages, system, options)
+        try:
+            async for text in chunks:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                yield text
+        except GeneratorExit:
+            # The client went away; that says nothing about the upstream.
+            self.breaker.release()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as exc:
+            self._record(exc, time.perf_counter() - started)
+            raise
+        else:
+            self._record(None, first_chunk if first_chunk is not None else time.perf_counter() - started)
+        finally:
+            await chunks.aclose()
+            self.limiter.release()
+
+    def snapshot(self) -> dict[str, Any]:
+        delay = self.hedge_delay() if self.hedge else None
+        return {
+            **self.inner.snapshot(),
+            "circuit": self.breaker.snapshot(),
+            "concurrency": self.limiter.snapshot(),
+            "hedging": {
+                "enabled": self.hedge,
+                "delay_ms": round(delay * 1000, 1) if delay is not None else None,
+                "launched": HEDGES.value(provider=self.name, result="launched"),
+                "won": HEDGES.value(provider=self.name, result="won"),
+            },
+        }
+
+
+def resilient(provider: LLMProvider) -> ResilientProvider:
+    """Wrap ``provider`` with the breaker/limiter/hedging configured in settings."""
+    return ResilientProvider(
+        provider,
+        CircuitBreaker(
+            provider.name,
+            failure_ratio=settings.LLM_BREAKER_FAILURE_RATIO,
+            min_calls=settings.LLM_BREAKER_MIN_CALLS,
+            window=settings.LLM_BREAKER_WINDOW,
+            open_seconds=settings.LLM_BREAKER_OPEN_SECONDS,
+            half_open_calls=settings.LLM_BREAKER_HALF_OPEN_CALLS,
+            slow_call_seconds=settings.LLM_SLOW_CALL_SECONDS,
+        ),
+        AdaptiveConcurrencyLimiter(
+            provider.name,
+            initial=settings.LLM_CONCURRENCY_INITIAL,
+            minimum=settings.LLM_CONCURRENCY_MIN,
+            maximum=settings.LLM_CONCURRENCY_MAX,
+            queue_seconds=settings.LLM_CONCURRENCY_QUEUE_SECONDS,
+        ),
+        hedge=settings.LLM_HEDGE_ENABLED,
+        hedge_delay_ms=settings.LLM_HEDGE_DELAY_MS,
+    )
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Iterable, Optional
+
+INDEX_FORMAT_VERSION = 1
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    """
+    a about above after again against all am an and any are as at be because been before being below between
+    both but by can could did do does doing down during each few for from further had has have having he her
+    here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not
+    now of off on once only or other our ours ourselves out over own same she should so some such than that the
+    their theirs them themselves then there these they this those through to too under until up very was we were
+    what when where which while who whom why will with would you your yours yourself yourselves explain tell
+    please simple terms answer question medical
+    """.split()
+)
+
+# Spelling variants and abbreviations mapped onto the form used in the corpus.
+SYNONYMS = {
+    "tumour": "tumor",
+    "tumours": "tumor",
+    "gbm": "glioblastoma",
+    "mets": "metastasis",
+    "chemo": "chemotherapy",
+    "radiotherapy": "radiation",
+    "srs": "radiosurgery",
+    "csf": "cerebrospinal",
+    "tb": "tuberculosis",
+    "kid": "children",
+    "kids": "children",
+    "child": "children",
+    "pediatric": "children",
+    "paediatric": "children",
+}
+
+
+def _stem(token: str) -> str:
+    # Light plural folding only; enough for "tumors"/"tumor" without mangling medical terms.
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        token = SYNONYMS.get(token, token)
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        tokens.append(_stem(token))
+    return tokens
+
+
+class BM25Index:
+    """Inverted index over a small document corpus, ranked with Okapi BM25.
+
+    Postings map each term to ``[(doc_id, term_frequency), ...]``; per-document
+    length normalization is precomputed so a query only walks the postings of
+    its own terms.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.documents: list[dict[str, Any]] = []
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self.doc_lengths: list[int] = []
+        self._idf: dict[str, float] = {}
+        self._length_norm: list[float] = []
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[dict[str, Any]], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        index = cls(k1=k1, b=b)
+        postings: dict[str, list[tuple[int, int]]] = {}
+        for doc_id, document in enumerate(documents):
+            index.documents.append(document)
+            # Titles and questions are short and on-topic, so they count twice.
+            lead = f"{document.get('title', '')} {document.get('question', '')}"
+            counts = Counter(tokenize(lead) * 2 + tokenize(document["text"]))
+            index.doc_lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                postings.setdefault(term, []).append((doc_id, frequency))
+        index.postings = postings
+        index._prepare()
+        return index
+
+    def _prepare(self) -> None:
+        count = len(self.documents)
+        average = (sum(self.doc_lengths) / count) if count else 0.0
+        self._idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in self.postings.items()
+        }
+        self._length_norm = [
+            self.k1 * (1 - self.b + self.b * (length / average if average else 0.0)) for length in self.doc_lengths
+        ]
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def search(self, query: str, limit: int = 3) -> list[tuple[float, dict[str, Any]]]:
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self._idf[term]
+            for doc_id, frequency in docs:
+                score = idf * frequency * (self.k1 + 1) / (frequency + self._length_norm[doc_id])
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(round(score, 4), self.documents[doc_id]) for doc_id, score in best]
+
+    def save(self, path: str) -> None:
+        payload = {
+            "version": INDEX_FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "documents": self.documents,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        opener = gzip.open if path.endswith(".gz") else open
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with opener(path, "wt", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as handle:
+            payload = json.load(handle)
+        if payload.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported retrieval index version in {path}")
+        index = cls(k1=payload["k1"], b=payload["b"])
+        index.documents = payload["documents"]
+        index.doc_lengths = payload["doc_lengths"]
+        index.postings = {term: [tuple(entry) for entry in docs] for term, docs in payload["postings"].items()}
+        index._prepare()
+        return index
+
+
+def read_corpus(path: str) -> list[dict[str, Any]]:
+    """Read corpus documents from JSONL.
+
+    Accepts ``{"title", "text", "source"}`` records and the
+    ``{"instruction", "output"}`` records produced by the fine-tuning notebook.
+    """
+    documents = []
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "text" in record and "instruction" not in record:
+                documents.append(
+                    {
+                        "title": record.get("title", ""),
+                        "text": record["text"],
+                        "source": record.get("source", ""),
+                    }
+                )
+            elif record.get("instruction") and record.get("output"):
+                documents.append(
+                    {
+                        "question": _instruction_question(record["instruction"]),
+                        "text": str(record["output"]).strip(),
+                        "source": record.get("source", "dataset"),
+                    }
+                )
+    return documents
+
+
+def _instruction_question(instruction: str) -> str:
+    # Notebook prompts look like "Answer the medical question: <q>\n\nContext: <abstract>".
+    question = instruction.split("\n\nContext:", 1)[0]
+    return re.sub(r"^Answer (?:the|this) medical question:\s*", "", question).strip()
+
+
+def build_index(corpus_paths: Iterable[str]) -> BM25Index:
+    documents: list[dict[str, Any]] = []
+    for path in corpus_paths:
+        documents.extend(read_corpus(path))
+    return BM25Index.from_documents(documents)
+
+
+def load_or_build_index(index_path: Optional[str], corpus_paths: Iterable[str]) -> BM25Index:
+    """Load the prebuilt index when present, otherwise index the corpus files."""
+    if index_path and os.path.exists(index_path):
+        return BM25Index.load(index_path)
+    return build_index([path for path in corpus_paths if path and os.path.exists(path)])
+
+
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "medical_corpus.jsonl")
+
+
+class FallbackRetriever:
+    """Lazily loaded retrieval index used when the chatbot's LLM is unavailable."""
+
+    def __init__(self, index_path: str = "", corpus_paths: Iterable[str] = (), min_score: float = 0.0) -> None:
+        self.index_path = index_path
+        self.corpus_paths = [DEFAULT_CORPUS_PATH, *corpus_paths]
+        self.min_score = min_score
+        self.index: Optional[BM25Index] = None
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self) -> BM25Index:
+        if self.index is None:
+            with self._lock:
+                if self.index is None:
+                    started = time.perf_counter()
+                    self.index = load_or_build_index(self.index_path, self.corpus_paths)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    print(f"[AI] Retrieval index ready: {len(self.index)} documents in {elapsed_ms:.1f} ms")
+        return self.index
+
+    def best_answer(self, query: str) -> Optional[str]:
+        hits = self.ensure_loaded().search(query, limit=1)
+        if not hits or hits[0][0] < self.min_score:
+            return None
+        return hits[0][1]["text"]
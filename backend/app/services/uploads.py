@@ -0,0 +1,351 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+from fastapi import HTTPException, UploadFile, status
+
+from app.core.config import settings
+
+
+class SpooledUpload:
+    """Upload body kept in memory up to a threshold, then spooled to a temp file.
+
+    The SHA-256 of the content is computed while the data is written, and
+    :meth:`view` exposes the stored bytes as a zero-copy ``memoryview`` (backed
+    by ``mmap`` once spooled to disk), so pipeline stages never need a second
+    full-size copy of the upload.
+    """
+
+    def __init__(
+        self,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+        memory_limit: int = 4 * 1024 * 1024,
+    ) -> None:
+        self.filename = filename
+        self.content_type = content_type
+        self.memory_limit = memory_limit
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._buffer: Optional[bytearray] = bytearray()
+        self._file: Optional[BinaryIO] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._reverse_digest: Optional[bytes] = None
+        self._leases = 0
+        self._closed = False
+
+    @classmethod
+    def from_bytes(cls, payload: bytes, filename: Optional[str] = None) -> "SpooledUpload":
+        upload = cls(filename=filename, memory_limit=max(len(payload), 1))
+        upload.write(payload)
+        return upload
+
+    @property
+    def spooled_to_disk(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes) -> None:
+        if self._mmap is not None:
+            raise ValueError("upload is sealed")
+        self._hasher.update(chunk)
+        self.size += len(chunk)
+        if self._file is None and self.size > self.memory_limit:
+            self._file = tempfile.TemporaryFile(prefix="upload-")
+            self._file.write(self._buffer)
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer.extend(chunk)
+
+    @property
+    def digest(self) -> bytes:
+        return self._hasher.digest()
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    def hasher(self) -> Any:
+        """A copy of the running SHA-256 state, for digests of ``content + suffix``."""
+        return self._hasher.copy()
+
+    def view(self) -> memoryview:
+        if self._file is None:
+            return memoryview(self._buffer)
+        if self._mmap is None:
+            if self.size == 0:
+                return memoryview(b"")
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def reader(self) -> BinaryIO:
+        """A fresh file-like reader positioned at the start of the content."""
+        if self._file is None:
+            return io.BytesIO(self._buffer)
+        return _MemoryViewReader(self.view())
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024) -> Iterator[memoryview]:
+        view = self.view()
+        for offset in range(0, self.size, chunk_size):
+            yield view[offset : offset + chunk_size]
+
+    def reverse_digest(self) -> bytes:
+        """SHA-256 of the content in reverse byte order, computed chunk by chunk."""
+        if self._reverse_digest is None:
+            hasher = hashlib.sha256()
+            view = self.view()
+            chunk_size = 1024 * 1024
+            for end in range(self.size, 0, -chunk_size):
+                hasher.update(bytes(view[max(0, end - chunk_size) : end])[::-1])
+            self._reverse_digest = hasher.digest()
+        return self._reverse_digest
+
+    def retain(self) -> Callable[[], None]:
+        """Keep the content alive past :meth:`close` until the returned release is called.
+
+        For work that can outlive the request owning the upload, such as a
+        shielded analysis that coalesced callers still wait on.
+        """
+        self._leases += 1
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if released:
+                return
+            released = True
+            self._leases -= 1
+            if self._closed and not self._leases:
+                self._release()
+
+        return release
+
+    def close(self) -> None:
+        self._closed = True
+        if not self._leases:
+            self._release()
+
+    def _release(self) -> None:
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A stage still holds a view; the mapping is released with it.
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = bytearray()
+
+    def __reduce__(self) -> tuple:
+        # Process-pool workers receive a plain in-memory copy.
+        return (SpooledUpload.from_bytes, (bytes(self.view()), self.filename))
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class _MemoryViewReader(io.RawIOBase):
+    """Seekable read-only file object over a memoryview, without copying it."""
+
+    def __init__(self, view: memoryview) -> None:
+        self._view = view
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        chunk = self._view[self._position : self._position + len(buffer)]
+        buffer[: len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File exceeds the upload limit of {max_bytes} bytes",
+    )
+
+
+async def ingest_upload(
+    file: UploadFile, max_bytes: Optional[int] = None, memory_limit: Optional[int] = None
+) -> SpooledUpload:
+    """Read an upload in chunks, hashing as it goes and enforcing ``max_bytes``."""
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    upload = SpooledUpload(
+        filename=file.filename,
+        content_type=file.content_type,
+        memory_limit=settings.UPLOAD_SPOOL_MEMORY_BYTES if memory_limit is None else memory_limit,
+    )
+    try:
+        while True:
+            chunk = await file.read(settings.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            if upload.size + len(chunk) > max_bytes:
+                raise _too_large(max_bytes)
+            upload.write(chunk)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+def _write_chunk(out: BinaryIO, chunk: bytes, encryptor: Optional[Any]) -> None:
+    out.write(encryptor.update(chunk) if encryptor is not None else chunk)
+
+
+def _finish_file(out: BinaryIO, encryptor: Optional[Any]) -> None:
+    try:
+        if encryptor is not None:
+            out.write(encryptor.finalize())
+    finally:
+        out.close()
+
+
+def _discard_file(out: BinaryIO, path: str) -> None:
+    out.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def save_upload(
+    file: UploadFile, path: str, encryptor: Optional[Any] = None, max_bytes: Optional[int] = None
+) -> int:
+    """Stream an upload to ``path`` chunk by chunk, through ``encryptor`` if given
+    (a :class:`~app.core.crypto.StreamEncryptor`); returns the plaintext size.
+
+    Only one chunk is held in memory. Encryption and disk writes run in a worker
+    thread, so a large upload does not stall the event loop. The file is removed
+    if the upload fails.
+    """
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    size = 0
+    out = await asyncio.to_thread(open, path, "wb")
+    try:
+        while True:
+            chunk = await file.read(settings.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large(max_bytes)
+            await asyncio.to_thread(_write_chunk, out, chunk, encryptor)
+        await asyncio.to_thread(_finish_file, out, encryptor)
+    except BaseException:
+        # Synchronous: a cancelled request must still clean up.
+        _discard_file(out, path)
+        raise
+    return size
+
+
+_TOO_LARGE_DETAIL = "Request body exceeds the upload limit"
+
+
+class _RequestBodyTooLarge(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=_TOO_LARGE_DETAIL)
+
+
+class UploadSizeLimitMiddleware:
+    """Rejects request bodies over the upload limit before they are parsed.
+
+    A declared Content-Length over the limit is refused without reading the
+    body. Chunked bodies have no Content-Length, so the bytes actually
+    received are counted too, and reading stops with 413 as soon as the count
+    passes the limit. Starlette never spools more than that while parsing
+    the multipart form.
+
+    ``path_limits`` gives specific paths (e.g. bulk analysis) their own limit
+    instead of ``max_bytes``.
+    """
+
+    # Allowance for multipart boundaries and form fields around the file.
+    OVERHEAD_BYTES = 1024 * 1024
+
+    def __init__(self, app: Any, max_bytes: int, path_limits: Optional[dict[str, int]] = None) -> None:
+        self.app = app
+        self.max_bytes = max_bytes + self.OVERHEAD_BYTES
+        self.path_limits = {path: limit + self.OVERHEAD_BYTES for path, limit in (path_limits or {}).items()}
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                if value.isdigit() and int(value) > max_bytes:
+                    await _send_too_large(send)
+                    return
+                break
+
+        received = 0
+        response_started = False
+
+        async def limited_receive() -> dict:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise _RequestBodyTooLarge()
+            return message
+
+        async def tracked_send(message: dict) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _RequestBodyTooLarge:
+            # Routes turn it into a 413 themselves; this covers bodies read elsewhere.
+            if response_started:
+                raise
+            await _send_too_large(send)
+
+
+async def _send_too_large(send: Any) -> None:
+    body = ('{"detail":"%s"}' % _TOO_LARGE_DETAIL).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
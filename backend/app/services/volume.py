@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import gzip
+import math
+import struct
+from typing import Any, Iterator, Optional
+
+from app.core.config import settings
+from app.services.uploads import SpooledUpload
+
+try:
+    import numpy as np  # type: ignore
+except Exception:
+    np = None
+
+NIFTI1_HEADER_SIZE = 348
+
+# NIfTI-1 datatype codes -> numpy dtype strings (byte order added at parse time).
+NIFTI_DTYPES = {
+    2: "u1",
+    4: "i2",
+    8: "i4",
+    16: "f4",
+    64: "f8",
+    256: "i1",
+    512: "u2",
+    768: "u4",
+}
+
+# Array axis that is held fixed for each plane, assuming the usual RAS voxel order.
+PLANE_AXES = {"sagittal": 0, "coronal": 1, "axial": 2}
+
+
+class VolumeError(ValueError):
+    """Raised for uploads that are not a supported NIfTI-1 volume."""
+
+
+def is_nifti_filename(filename: Optional[str]) -> bool:
+    name = (filename or "").lower()
+    return name.endswith(".nii") or name.endswith(".nii.gz")
+
+
+def decompress_gzip(upload: SpooledUpload) -> SpooledUpload:
+    """Inflate a ``.nii.gz`` upload chunk by chunk into a new spooled buffer."""
+    inflated = SpooledUpload(filename=upload.filename, memory_limit=settings.UPLOAD_SPOOL_MEMORY_BYTES)
+    try:
+        with gzip.GzipFile(fileobj=upload.reader()) as stream:
+            while True:
+                chunk = stream.read(settings.UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if inflated.size + len(chunk) > settings.AI_VOLUME_MAX_BYTES:
+                    raise VolumeError("Decompressed volume exceeds the upload limit")
+                inflated.write(chunk)
+    except (OSError, EOFError) as exc:
+        inflated.close()
+        raise VolumeError(f"Invalid gzip data: {exc}") from exc
+    except BaseException:
+        inflated.close()
+        raise
+    return inflated
+
+
+class NiftiVolume:
+    """A NIfTI-1 volume whose voxels are a read-only view over the upload buffer.
+
+    Nothing is decoded up front: the voxel array is an ``np.ndarray`` over the
+    spooled (mmap-backed) upload, and only the slices being scored are copied
+    and converted to float.
+    """
+
+    def __init__(self, upload: SpooledUpload) -> None:
+        if np is None:
+            raise VolumeError("NumPy is required for volume analysis")
+        view = upload.view()
+        if upload.size < NIFTI1_HEADER_SIZE:
+            raise VolumeError("File is too small to be a NIfTI volume")
+
+        header = bytes(view[:NIFTI1_HEADER_SIZE])
+        if struct.unpack("<i", header[:4])[0] == NIFTI1_HEADER_SIZE:
+            endian = "<"
+        elif struct.unpack(">i", header[:4])[0] == NIFTI1_HEADER_SIZE:
+            endian = ">"
+        else:
+            raise VolumeError("Only single-file NIfTI-1 volumes are supported")
+        if header[344:347] != b"n+1":
+            raise VolumeError("Only single-file NIfTI-1 (.nii) volumes are supported")
+
+        dims = struct.unpack(f"{endian}8h", header[40:56])
+        datatype, _bitpix = struct.unpack(f"{endian}2h", header[70:74])
+        vox_offset = struct.unpack(f"{endian}f", header[108:112])[0]
+        slope, intercept = struct.unpack(f"{endian}2f", header[112:120])
+
+        # Single-file volumes keep their voxels after the header (and any extensions).
+        if not math.isfinite(vox_offset) or vox_offset < NIFTI1_HEADER_SIZE:
+            raise VolumeError("Invalid voxel data offset in NIfTI header")
+        vox_offset = int(vox_offset)
+        if datatype not in NIFTI_DTYPES:
+            raise VolumeError(f"Unsupported NIfTI datatype code {datatype}")
+        ndim = dims[0]
+        if ndim < 3 or any(size < 1 for size in dims[1:4]):
+            raise VolumeError("Volume must have at least three spatial dimensions")
+
+        self.shape = tuple(int(size) for size in dims[1:4])
+        self.dtype = np.dtype(endian + NIFTI_DTYPES[datatype])
+        self.slope = slope if slope and np.isfinite(slope) else 1.0
+        self.intercept = intercept if np.isfinite(intercept) else 0.0
+
+        voxel_count = self.shape[0] * self.shape[1] * self.shape[2]
+        needed = vox_offset + voxel_count * self.dtype.itemsize
+        if upload.size < needed:
+            raise VolumeError("Volume data is truncated")
+
+        # Voxels are stored x-fastest (Fortran order); a 4D series uses its first frame.
+        self.data = np.frombuffer(view, dtype=self.dtype, count=voxel_count, offset=vox_offset).reshape(
+            self.shape, order="F"
+        )
+
+    def slice_count(self, plane: str) -> int:
+        return self.shape[PLANE_AXES[plane]]
+
+    def get_slice(self, plane: str, index: int) -> Any:
+        """One 2D slice as a contiguous float32 array with NIfTI scaling applied."""
+        axis = PLANE_AXES[plane]
+        raw = np.take(self.data, index, axis=axis)
+        return np.ascontiguousarray(raw, dtype=np.float32) * self.slope + self.intercept
+
+    def get_slices(self, refs: list[tuple[str, int]]) -> list[Any]:
+        return [self.get_slice(plane, index) for plane, index in refs]
+
+    def iter_slice_refs(
+        self, planes: list[str], batch_size: int, stride: int = 1
+    ) -> Iterator[list[tuple[str, int]]]:
+        """Yield ``(plane, index)`` batches; slices are only read when requested."""
+        batch: list[tuple[str, int]] = []
+        for plane in planes:
+            for index in range(0, self.slice_count(plane), max(1, stride)):
+                batch.append((plane, index))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "shape": list(self.shape),
+            "dtype": str(self.dtype),
+            "slices": {plane: self.slice_count(plane) for plane in PLANE_AXES},
+        }
+
+
+def open_volume(upload: SpooledUpload) -> tuple[NiftiVolume, Optional[SpooledUpload]]:
+    """Open an uploaded volume; returns the volume and any inflated buffer to close."""
+    inflated = None
+    if (upload.filename or "").lower().endswith(".gz"):
+        inflated = decompress_gzip(upload)
+    try:
+        return NiftiVolume(inflated or upload), inflated
+    except BaseException:
+        if inflated is not None:
+            inflated.close()
+        raise
@@ -0,0 +1,271 @@
+"""Latency, throughput and peak memory of the scan analysis pipeline
+(``/ai/analyze-image``) at several concurrency levels.
+
+Synthetic grayscale PNG scans are generated up front (``--scans`` distinct
+images of ``--size`` pixels square, about half with a bright lesion-like blob)
+and replayed at each concurrency level. Two modes, each in a fresh process so
+memory is not shared:
+
+* ``in_process`` calls the pipeline stages directly (``_run_pipeline``),
+  without HTTP, auth or the result cache.
+* ``http`` serves the FastAPI app with uvicorn and posts multipart uploads to
+  ``/ai/analyze-image``; auth is stubbed and MongoDB is not used.
+
+The VLM stage talks to a local ``generateContent`` stand-in (``--vlm-latency-ms``)
+instead of Gemini. Models come from the usual settings (CNN_MODEL_PATH, ...);
+without them the stages run their fallback logic. The result cache is off so
+every request runs the pipeline (``--cache`` to keep it)::
+
+    python -m benchmarks.ai_pipeline --scans 64 --size 256 --concurrency 1,4,16 --output ai_pipeline.json
+
+``--output`` writes the results with the commit and settings they were
+measured with, for diffing between commits.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import struct
+import subprocess
+import time
+import zlib
+from collections import defaultdict
+from typing import Any
+
+from benchmarks.common import StubServer, percentiles, print_report
+from benchmarks.gemini_client import make_stub_app
+
+MODES = ("in_process", "http")
+
+
+def _png(width: int, height: int, pixels: bytes) -> bytes:
+    """8-bit grayscale PNG (no Pillow needed)."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\0" + pixels[row * width : (row + 1) * width] for row in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, 6)) + chunk(b"IEND", b"")
+
+
+def synthetic_scans(count: int, size: int, seed: int = 0) -> list[bytes]:
+    """Noisy radial-gradient "slices"; odd-numbered ones carry a bright blob."""
+    import torch
+
+    generator = torch.Generator().manual_seed(seed)
+    grid = torch.linspace(-1, 1, size)
+    radius = (grid[None, :] ** 2 + grid[:, None] ** 2).sqrt()
+    scans = []
+    for index in range(count):
+        image = (1 - radius).clamp(0, 1) * 0.5 + torch.rand(size, size, generator=generator) * 0.2
+        if index % 2:
+            cx, cy = (torch.rand(2, generator=generator) - 0.5).tolist()
+            blob_radius = 0.1 + float(torch.rand(1, generator=generator)) * 0.2
+            blob = ((grid[None, :] - cx) ** 2 + (grid[:, None] - cy) ** 2).sqrt() < blob_radius
+            image = torch.where(blob, image + 0.4, image)
+        pixels = (image.clamp(0, 1) * 255).to(torch.uint8).contiguous().numpy().tobytes()
+        scans.append(_png(size, size, pixels))
+    return scans
+
+
+def _peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def run_level(call: Any, scans: list[bytes], requests: int, concurrency: int) -> dict[str, Any]:
+    samples: list[float] = []
+    stages: dict[str, list[float]] = defaultdict(list)
+    outcomes: dict[str, int] = defaultdict(int)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await call(f"scan{index}.png", scans[index % len(scans)])
+            except Exception as exc:
+                outcomes[f"error_{type(exc).__name__}"] += 1
+                return
+            samples.append((time.perf_counter() - started) * 1000)
+            skipped = result["pipeline"]["skipped_after_cnn"]
+            outcomes["skipped_after_cnn" if skipped else "full"] += 1
+            for name, value in (result.get("timings") or {}).items():
+                stages[name].append(value)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+    stats = percentiles(samples)
+    stats["throughput_rps"] = round(len(samples) / elapsed, 2)
+    stats.update(sorted(outcomes.items()))
+    # Mean per-stage wall time; model stages include micro-batch queueing.
+    for name in sorted(stages):
+        if name != "total_ms":
+            stats[f"{name[:-3]}_mean_ms"] = round(sum(stages[name]) / len(stages[name]), 3)
+    stats["peak_rss_mb"] = _peak_rss_mb()
+    return stats
+
+
+async def _measure(mode: str, args: dict[str, Any], scans: list[bytes]) -> dict[str, Any]:
+    from app.core.metrics import collect_timings
+    from app.routers import ai
+    from app.services.gemini import close_gemini_client, start_gemini_client
+    from app.services.llm import start_llm_providers
+    from app.services.uploads import SpooledUpload
+
+    results: dict[str, Any] = {}
+    if mode == "in_process":
+
+        async def call(filename: str, payload: bytes) -> dict[str, Any]:
+            with collect_timings() as timings, SpooledUpload.from_bytes(payload, filename) as upload:
+                result = await ai._run_pipeline(upload, filename)
+            return {**result, "timings": dict(timings)}
+
+        await start_gemini_client()
+        await start_llm_providers()
+        if not await ai.PIPELINE_MODELS.wait_ready(300):
+            raise RuntimeError("models did not load")
+        try:
+            for concurrency in args["concurrency"]:
+                await call("warmup.png", scans[0])
+                results[f"c{concurrency}"] = await run_level(call, scans, args["requests"], concurrency)
+        finally:
+            ai.shutdown_inference()
+            await close_gemini_client()
+        return results
+
+    import httpx
+
+    from app.auth import dependencies
+    from app.core.database import close_mongo_connection, connect_to_mongo
+    from app.main import app
+
+    async def benchmark_user() -> dict[str, Any]:
+        return {"_id": "benchmark", "email": "benchmark@example.com", "role": "doctor", "is_verified": True}
+
+    app.dependency_overrides[dependencies.get_current_user] = benchmark_user
+    app.router.on_startup = [hook for hook in app.router.on_startup if hook is not connect_to_mongo]
+    app.router.on_shutdown = [hook for hook in app.router.on_shutdown if hook is not close_mongo_connection]
+    limits = httpx.Limits(max_connections=max(args["concurrency"]), max_keepalive_connections=max(args["concurrency"]))
+    with StubServer(app, tls=False) as server:
+        async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=300.0) as client:
+
+            async def call(filename: str, payload: bytes) -> dict[str, Any]:
+                response = await client.post(
+                    "/ai/analyze-image",
+                    files={"file": (filename, payload, "image/png")},
+                    headers={"X-Debug-Timings": "1"},
+                )
+                response.raise_for_status()
+                return response.json()
+
+            for concurrency in args["concurrency"]:
+                await call("warmup.png", scans[0])
+                results[f"c{concurrency}"] = await run_level(call, scans, args["requests"], concurrency)
+    return results
+
+
+def measure(mode: str, args: dict[str, Any]) -> dict[str, Any]:
+    scans = synthetic_scans(args["scans"], args["size"])
+    return asyncio.run(_measure(mode, args, scans))
+
+
+def main(args: argparse.Namespace) -> None:
+    options = {
+        "scans": args.scans,
+        "size": args.size,
+        "requests": args.requests or args.scans,
+        "concurrency": [int(level) for level in args.concurrency.split(",")],
+        "cache": args.cache,
+    }
+    context = multiprocessing.get_context("spawn")
+    results: dict[str, Any] = {}
+    with StubServer(make_stub_app(args.vlm_latency_ms), tls=False) as vlm:
+        # Settings are read when app.core.config is imported, so the measuring
+        # processes pick these up from the environment they are spawned with.
+        os.environ.update(
+            {
+                "GEMINI_BASE_URL": f"{vlm.base_url}/v1beta",
+                "GEMINI_API_KEY": "benchmark",
+                "VLM_PROVIDER": "gemini",
+                "AI_CACHE_ENABLED": "true" if args.cache else "false",
+                # The load is the point here, so admission control stays out of the way.
+                "RATE_LIMIT_ENABLED": "false",
+            }
+        )
+        for mode in args.modes.split(","):
+            with context.Pool(1) as pool:
+                try:
+                    levels = pool.apply(measure, (mode, options))
+                except Exception as exc:
+                    results[mode] = {"error": f"{type(exc).__name__}: {exc}"}
+                    continue
+            for level, stats in levels.items():
+                results[f"{mode}/{level}"] = stats
+
+    print_report("ai_pipeline", results, as_json=args.json)
+    if args.output:
+        from app.core.config import settings
+
+        report = {
+            "benchmark": "ai_pipeline",
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "options": {**options, "vlm_latency_ms": args.vlm_latency_ms},
+            "settings": {
+                name: getattr(settings, name)
+                for name in (
+                    "AI_EXECUTOR",
+                    "AI_WORKERS",
+                    "AI_MAX_PENDING",
+                    "AI_TORCH_THREADS",
+                    "AI_BATCH_MAX_SIZE",
+                    "AI_BATCH_MAX_WAIT_MS",
+                    "AI_INPUT_SIZE",
+                    "CNN_MODEL_PATH",
+                    "CNN_MODEL_BACKEND",
+                    "SEGMENT_MODEL_PATH",
+                    "SEGMENT_MODEL_BACKEND",
+                    "SLICE_MODEL_PATH",
+                    "SLICE_MODEL_BACKEND",
+                )
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+        print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--scans", type=int, default=64, help="distinct synthetic scans")
+    parser.add_argument("--size", type=int, default=256, help="scan width and height in pixels")
+    parser.add_argument("--requests", type=int, default=0, help="requests per concurrency level (default: --scans)")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--vlm-latency-ms", type=float, default=50.0, help="latency of the Gemini stand-in")
+    parser.add_argument("--cache", action="store_true", help="keep the analysis result cache on")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,131 @@
+"""Helpers shared by the benchmark scripts (run from ``backend/``)."""
+
+from __future__ import annotations
+
+import datetime
+import ipaddress
+import json
+import os
+import socket
+import ssl
+import statistics
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+import uvicorn
+
+
+def percentiles(samples_ms: list[float]) -> dict[str, float]:
+    if not samples_ms:
+        return {"count": 0}
+    ordered = sorted(samples_ms)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def print_report(title: str, results: dict[str, Any], as_json: bool = False) -> None:
+    if as_json:
+        print(json.dumps({"benchmark": title, "results": results}, indent=2))
+        return
+    print(f"== {title}")
+    for name, stats in results.items():
+        fields = "  ".join(f"{key}={value}" for key, value in stats.items())
+        print(f"  {name:<24} {fields}")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def self_signed_cert(directory: str) -> tuple[str, str]:
+    """Write a throwaway certificate for 127.0.0.1; returns ``(certfile, keyfile)``."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    certfile = os.path.join(directory, "stub.crt")
+    keyfile = os.path.join(directory, "stub.key")
+    with open(certfile, "wb") as handle:
+        handle.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as handle:
+        handle.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return certfile, keyfile
+
+
+class StubServer:
+    """Runs an ASGI app with uvicorn on a background thread, optionally over TLS."""
+
+    def __init__(self, app: Any, tls: bool = True) -> None:
+        self.app = app
+        self.tls = tls
+        self.port = free_port()
+        self._tempdir: Optional[tempfile.TemporaryDirectory] = None
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+        self.ssl_context: Any = True
+
+    @property
+    def base_url(self) -> str:
+        scheme = "https" if self.tls else "http"
+        return f"{scheme}://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "StubServer":
+        ssl_kwargs: dict[str, Any] = {}
+        if self.tls:
+            self._tempdir = tempfile.TemporaryDirectory()
+            certfile, keyfile = self_signed_cert(self._tempdir.name)
+            ssl_kwargs = {"ssl_certfile": certfile, "ssl_keyfile": keyfile}
+            self.ssl_context = ssl.create_default_context(cafile=certfile)
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning", **ssl_kwargs)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("stub server did not start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
@@ -0,0 +1,110 @@
+"""Decrypting encrypted text fields for list endpoints: one ``decrypt_text``
+call per field vs the batch API, cold and with the plaintext cache, and how
+long the event loop stalls while a batch runs inline vs offloaded.
+
+Encrypts ``--fields`` synthetic symptom/notes strings, then decrypts them in
+pages of ``--page-size`` (one list request each)::
+
+    python -m benchmarks.field_decryption --fields 4000 --page-size 100
+
+Keep ``--fields`` within DECRYPT_CACHE_MAX_ENTRIES, or the warm pass cycles
+the LRU and misses every time.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from typing import Any, Callable
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+from app.core.config import settings  # noqa: E402
+from app.core.crypto import (  # noqa: E402
+    DECRYPTED_TEXT_CACHE,
+    decrypt_text,
+    decrypt_texts,
+    decrypt_texts_async,
+    encrypt_text,
+)
+from benchmarks.common import percentiles, print_report  # noqa: E402
+
+WORDS = "headache fever nausea persistent mild severe since days weeks vision blurred dizziness fatigue left right".split()
+
+
+def synthetic_fields(count: int, words: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [encrypt_text(" ".join(rng.choice(WORDS) for _ in range(words))) for _ in range(count)]
+
+
+def run_pages(decrypt_page: Callable[[list[str]], Any], pages: list[list[str]]) -> dict[str, Any]:
+    samples = []
+    started = time.perf_counter()
+    for page in pages:
+        page_started = time.perf_counter()
+        decrypt_page(page)
+        samples.append((time.perf_counter() - page_started) * 1000)
+    stats = percentiles(samples)
+    stats["fields_per_s"] = round(sum(len(page) for page in pages) / (time.perf_counter() - started))
+    return stats
+
+
+async def loop_stall(pages: list[list[str]], offload_threshold: int) -> dict[str, Any]:
+    """Longest gap a 1 ms ticker sees while the pages are decrypted with the async API."""
+    settings.DECRYPT_OFFLOAD_THRESHOLD = offload_threshold
+    DECRYPTED_TEXT_CACHE.clear()
+    gaps: list[float] = []
+    done = False
+
+    async def ticker() -> None:
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            gaps.append((now - last) * 1000)
+            last = now
+
+    task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    for page in pages:
+        await decrypt_texts_async(page, use_cache=False)
+    elapsed = time.perf_counter() - started
+    done = True
+    await task
+    return {
+        "wall_ms": round(elapsed * 1000, 1),
+        "loop_gap_p99_ms": percentiles(gaps)["p99_ms"],
+        "loop_gap_max_ms": round(max(gaps), 3),
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    fields = synthetic_fields(args.fields, args.words)
+    pages = [fields[start : start + args.page_size] for start in range(0, len(fields), args.page_size)]
+    results: dict[str, Any] = {}
+
+    results["per_field"] = run_pages(lambda page: [decrypt_text(value) for value in page], pages)
+    results["batch_no_cache"] = run_pages(lambda page: decrypt_texts(page, use_cache=False), pages)
+    DECRYPTED_TEXT_CACHE.clear()
+    results["batch_cache_cold"] = run_pages(decrypt_texts, pages)
+    # A dashboard refresh: the same records again.
+    results["batch_cache_warm"] = run_pages(decrypt_texts, pages)
+
+    # One big list request, so the inline vs offloaded difference is visible.
+    big_pages = [fields]
+    results["async_inline"] = asyncio.run(loop_stall(big_pages, offload_threshold=len(fields) + 1))
+    results["async_offloaded"] = asyncio.run(loop_stall(big_pages, offload_threshold=1))
+    print_report("field_decryption", results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fields", type=int, default=4000)
+    parser.add_argument("--page-size", type=int, default=100, help="fields per list request")
+    parser.add_argument("--words", type=int, default=30, help="words per field")
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,105 @@
+"""Per-request latency of Gemini calls: a new client per call vs the shared pooled client.
+
+Runs against a local TLS stub of ``generateContent`` so only connection setup
+and client overhead differ between the two modes::
+
+    python -m benchmarks.gemini_client --requests 200 --concurrency 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+import httpx
+
+from app.services.gemini import GeminiClient
+from benchmarks.common import StubServer, percentiles, print_report
+
+STUB_RESPONSE = (
+    b'{"candidates":[{"content":{"role":"model","parts":[{"text":"Stub answer from the benchmark server."}]}}]}'
+)
+
+PAYLOAD = {
+    "contents": [{"role": "user", "parts": [{"text": "What is a glioma?"}]}],
+    "generationConfig": {"temperature": 0.7, "maxOutputTokens": 64},
+}
+
+
+def make_stub_app(latency_ms: float) -> Any:
+    async def app(scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            return
+        while True:
+            message = await receive()
+            if not message.get("more_body"):
+                break
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": STUB_RESPONSE})
+
+    return app
+
+
+async def run_mode(call: Any, requests: int, concurrency: int) -> dict[str, Any]:
+    samples: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await call()
+            response.raise_for_status()
+            samples.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stats = percentiles(samples)
+    stats["throughput_rps"] = round(requests / elapsed, 1)
+    return stats
+
+
+async def main(args: argparse.Namespace) -> None:
+    with StubServer(make_stub_app(args.latency_ms), tls=not args.no_tls) as server:
+        gemini = GeminiClient(base_url=f"{server.base_url}/v1beta", api_key="benchmark", verify=server.ssl_context)
+        url = gemini.model_url()
+
+        async def per_request() -> httpx.Response:
+            # What chatbot/_vlm_stage used to do: a fresh client (and handshake) per call.
+            async with httpx.AsyncClient(verify=server.ssl_context) as client:
+                return await client.post(url, json=PAYLOAD, headers={"x-goog-api-key": "benchmark"}, timeout=30.0)
+
+        async def shared() -> httpx.Response:
+            return await gemini.generate_content(PAYLOAD)
+
+        # Warm both paths (imports, first connection) before measuring.
+        await per_request()
+        await shared()
+
+        results = {
+            "client_per_request": await run_mode(per_request, args.requests, args.concurrency),
+            "shared_pooled_client": await run_mode(shared, args.requests, args.concurrency),
+        }
+        await gemini.aclose()
+
+    print_report("gemini_client", results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated model latency in the stub")
+    parser.add_argument("--no-tls", action="store_true", help="serve the stub over plain HTTP")
+    parser.add_argument("--json", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,134 @@
+"""Chatbot-style latency while the upstream LLM degrades and recovers, with and
+without the resilience layer (circuit breaker + adaptive concurrency cap).
+
+Runs against a local fault-injecting stub of ``generateContent`` that goes
+through healthy -> slow -> failing (HTTP 503) -> recovered -> steady phases::
+
+    python -m benchmarks.llm_resilience --requests-per-phase 60 --concurrency 8 --slow-ms 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from app.core.metrics import REGISTRY
+from app.services.gemini import GeminiClient
+from app.services.llm import GeminiProvider, GenerationOptions, LLMProvider
+from app.services.resilience import AdaptiveConcurrencyLimiter, CircuitBreaker, ResilientProvider
+from benchmarks.common import StubServer, percentiles, print_report
+
+STUB_RESPONSE = b'{"candidates":[{"content":{"role":"model","parts":[{"text":"Stub answer."}]}}]}'
+PHASES = ("healthy", "slow", "failing", "recovered", "steady")
+
+
+class FaultInjector:
+    """ASGI app whose behaviour is switched per phase: ``healthy``, ``slow`` or ``failing``."""
+
+    def __init__(self, latency_ms: float, slow_ms: float) -> None:
+        self.mode = "healthy"
+        self.latency_ms = latency_ms
+        self.slow_ms = slow_ms
+        self.requests = 0
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            return
+        while True:
+            message = await receive()
+            if not message.get("more_body"):
+                break
+        self.requests += 1
+        status, body = 200, STUB_RESPONSE
+        delay = self.latency_ms
+        if self.mode == "slow":
+            delay = self.slow_ms
+        elif self.mode == "failing":
+            status, body = 503, b'{"error":{"code":503,"status":"UNAVAILABLE"}}'
+        await asyncio.sleep(delay / 1000)
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def run_phase(provider: LLMProvider, requests: int, concurrency: int) -> dict[str, Any]:
+    samples: list[float] = []
+    fallbacks = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    messages = [{"role": "user", "text": "What is a glioma?"}]
+
+    async def one() -> None:
+        nonlocal fallbacks
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await provider.generate(messages, options=GenerationOptions(max_output_tokens=64))
+            except Exception:
+                # Where /chatbot would answer from get_fallback_response().
+                fallbacks += 1
+            samples.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    stats = percentiles(samples)
+    stats["fallbacks"] = fallbacks
+    stats["wall_s"] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+async def run_scenario(name: str, provider: LLMProvider, stub: FaultInjector, args: argparse.Namespace) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    for phase in PHASES:
+        stub.mode = phase if phase in ("slow", "failing") else "healthy"
+        if phase == "recovered":
+            # Give an open breaker time to move to half-open before measuring.
+            await asyncio.sleep(args.open_seconds)
+        before = stub.requests
+        stats = await run_phase(provider, args.requests_per_phase, args.concurrency)
+        stats["upstream_calls"] = stub.requests - before
+        if isinstance(provider, ResilientProvider):
+            stats["circuit"] = provider.breaker.state
+            stats["limit"] = int(provider.limiter.limit)
+        results[f"{name}/{phase}"] = stats
+    return results
+
+
+async def main(args: argparse.Namespace) -> None:
+    stub = FaultInjector(args.latency_ms, args.slow_ms)
+    with StubServer(stub, tls=False) as server:
+        client = GeminiClient(base_url=f"{server.base_url}/v1beta", api_key="benchmark", max_concurrency=64)
+        await client.generate_content({"contents": []})
+
+        results = await run_scenario("unprotected", GeminiProvider(client), stub, args)
+        resilient = ResilientProvider(
+            GeminiProvider(client),
+            CircuitBreaker(
+                "benchmark",
+                min_calls=5,
+                window=20,
+                open_seconds=args.open_seconds,
+                slow_call_seconds=args.slow_call_ms / 1000,
+            ),
+            AdaptiveConcurrencyLimiter("benchmark", initial=args.concurrency, maximum=args.concurrency * 2, queue_seconds=0.5),
+        )
+        results.update(await run_scenario("resilient", resilient, stub, args))
+        transitions = REGISTRY.get("llm_circuit_transitions_total")
+        results["breaker_transitions"] = {
+            state: transitions.value(provider="benchmark", state=state) for state in ("open", "half_open", "closed")
+        }
+        await client.aclose()
+
+    print_report("llm_resilience", results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests-per-phase", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="healthy upstream latency")
+    parser.add_argument("--slow-ms", type=float, default=2000.0, help="upstream latency in the slow phase")
+    parser.add_argument("--slow-call-ms", type=float, default=500.0, help="calls slower than this count as failures")
+    parser.add_argument("--open-seconds", type=float, default=1.0, help="how long the breaker stays open")
+    parser.add_argument("--json", action="store_true")
+    asyncio.run(main(parser.parse_args()))
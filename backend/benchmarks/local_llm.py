@@ -0,0 +1,121 @@
+"""Latency of the self-hosted LLM provider: per-token decode time, time to first
+token, and throughput with and without batching / KV prefix reuse.
+
+    python -m benchmarks.local_llm --model-path stabilityai/stablelm-2-1_6b \\
+        --adapter-path ./tumor-chatbot --concurrency 4 --max-new-tokens 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from app.routers.ai import SYSTEM_PROMPT
+from app.services.llm import GenerationOptions, LocalLLMProvider
+from benchmarks.common import percentiles, print_report
+
+QUESTIONS = [
+    "What is glioblastoma?",
+    "How does MRI help diagnose brain tumors?",
+    "Explain meningioma for a medical student.",
+    "What are common symptoms of a brain tumor?",
+    "How is radiation therapy used for brain tumors?",
+    "What is the difference between benign and malignant tumors?",
+]
+
+
+async def timed_stream(provider: LocalLLMProvider, messages: list[dict[str, str]], options: GenerationOptions) -> dict[str, Any]:
+    started = time.perf_counter()
+    first = None
+    text = []
+    async for chunk in provider.stream(messages, SYSTEM_PROMPT, options):
+        if first is None:
+            first = time.perf_counter() - started
+        text.append(chunk)
+    total = time.perf_counter() - started
+    tokens = len(provider.tokenizer("".join(text), add_special_tokens=False)["input_ids"])
+    return {"ttft_ms": (first or total) * 1000, "total_ms": total * 1000, "tokens": tokens, "text": "".join(text)}
+
+
+async def run_round(provider: LocalLLMProvider, conversations: list[list[dict[str, str]]], concurrency: int, options: GenerationOptions) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    provider._token_ms.clear()
+
+    async def one(messages: list[dict[str, str]]) -> dict[str, Any]:
+        async with semaphore:
+            return await timed_stream(provider, messages, options)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(messages) for messages in conversations))
+    elapsed = time.perf_counter() - started
+    tokens = sum(result["tokens"] for result in results)
+    ttft = percentiles([result["ttft_ms"] for result in results])
+    step = percentiles(list(provider._token_ms))
+    summary = {
+        "requests": len(results),
+        "ttft_p50_ms": ttft.get("p50_ms"),
+        "ttft_p95_ms": ttft.get("p95_ms"),
+        "decode_step_p50_ms": step.get("p50_ms"),
+        "decode_step_p95_ms": step.get("p95_ms"),
+        "tokens_per_second": round(tokens / elapsed, 1),
+    }
+    return summary, results
+
+
+async def main(args: argparse.Namespace) -> None:
+    provider = LocalLLMProvider(
+        args.model_path,
+        adapter_path=args.adapter_path,
+        quantize=not args.no_quantize,
+        max_batch_size=args.concurrency,
+        batch_wait_ms=args.batch_wait_ms,
+        max_new_tokens=args.max_new_tokens,
+    )
+    started = time.perf_counter()
+    provider.load()
+    if not provider.loaded:
+        raise SystemExit(f"model failed to load: {provider.status}")
+    load_seconds = time.perf_counter() - started
+    options = GenerationOptions(temperature=0, max_output_tokens=args.max_new_tokens)
+    first_turns = [[{"role": "user", "text": QUESTIONS[i % len(QUESTIONS)]}] for i in range(args.requests)]
+
+    # Warm up kernels and the allocator.
+    await provider.generate(first_turns[0], SYSTEM_PROMPT, GenerationOptions(temperature=0, max_output_tokens=4))
+
+    results: dict[str, Any] = {}
+    results["sequential"], _ = await run_round(provider, first_turns, 1, options)
+    results[f"batched_x{args.concurrency}"], answers = await run_round(provider, first_turns, args.concurrency, options)
+
+    # Second turns extend the first ones, so their prompts share a cached prefix.
+    follow_ups = [
+        messages + [{"role": "model", "text": answer["text"]}, {"role": "user", "text": "Can you say more about treatment?"}]
+        for messages, answer in zip(first_turns, answers)
+    ]
+    results["follow_up_prefix_reuse"], _ = await run_round(provider, follow_ups, 1, options)
+    provider.prefix_cache.max_tokens = 0
+    provider.prefix_cache._entries.clear()
+    provider.prefix_cache.tokens = 0
+    results["follow_up_no_reuse"], _ = await run_round(provider, follow_ups, 1, options)
+
+    results["model"] = {
+        "load_seconds": round(load_seconds, 2),
+        "quantized": provider.quantize,
+        "max_new_tokens": args.max_new_tokens,
+    }
+    provider.pool.shutdown()
+    print_report("local_llm", results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the self-hosted LLM provider")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--adapter-path", default="")
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-wait-ms", type=float, default=20.0)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--json", action="store_true")
+    asyncio.run(main(parser.parse_args()))
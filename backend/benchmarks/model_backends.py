@@ -0,0 +1,86 @@
+"""CPU latency and memory of each pipeline model per inference backend
+(TorchScript, ONNX Runtime float, ONNX Runtime int8).
+
+Each backend is measured in a fresh process so resident memory is not shared
+between them. Create the ONNX files first with ``python export_models.py``::
+
+    python -m benchmarks.model_backends --model-path uploads/models/cnn.pt --batch-sizes 1,8 --iterations 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import resource
+import time
+from typing import Any
+
+from benchmarks.common import percentiles, print_report
+
+BACKENDS = ("torchscript", "onnx", "onnx_int8")
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status", encoding="ascii") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(backend: str, model_path: str, batch_sizes: list[int], iterations: int, threads: int, input_size: int) -> dict[str, Any]:
+    import torch
+
+    from app.services.model_backends import load_model, sample_inputs
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    before = _rss_mb()
+    started = time.perf_counter()
+    model, path = load_model(backend, model_path, "cpu", threads)
+    load_ms = (time.perf_counter() - started) * 1000
+    results: dict[str, Any] = {"file": path.name, "load_ms": round(load_ms, 1)}
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            batch = sample_inputs(1, batch_size, input_size)[0]
+            for _ in range(3):
+                model(batch)
+            samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                model(batch)
+                samples.append((time.perf_counter() - started) * 1000)
+            stats = percentiles(samples)
+            results[f"batch{batch_size}_p50_ms"] = stats["p50_ms"]
+            results[f"batch{batch_size}_p95_ms"] = stats["p95_ms"]
+            results[f"batch{batch_size}_images_per_s"] = round(batch_size * 1000 / stats["mean_ms"], 1)
+    # Model weights plus runtime buffers after the largest batch.
+    results["rss_growth_mb"] = round(_rss_mb() - before, 1)
+    return results
+
+
+def main(args: argparse.Namespace) -> None:
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for backend in args.backends.split(","):
+        with context.Pool(1) as pool:
+            try:
+                results[backend] = pool.apply(
+                    measure, (backend, args.model_path, batch_sizes, args.iterations, args.threads, args.input_size)
+                )
+            except Exception as exc:
+                results[backend] = {"error": str(exc)}
+    print_report("model_backends", results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-path", required=True, help="TorchScript model; ONNX files are looked up next to it")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--batch-sizes", default="1,8")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = runtime default)")
+    parser.add_argument("--input-size", type=int, default=224)
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
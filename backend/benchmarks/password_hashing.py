@@ -0,0 +1,117 @@
+"""Login throughput, and latency of an unrelated route, during a login storm:
+bcrypt inline on the event loop vs on the bounded hashing pool.
+
+Serves a minimal app with uvicorn: ``POST /login`` checks one bcrypt hash the
+way the login route does, ``GET /ping`` stands in for every other endpoint.
+While ``--logins`` logins run at ``--concurrency``, a probe requests
+``/ping`` every ``--probe-interval-ms``::
+
+    python -m benchmarks.password_hashing --logins 64 --concurrency 16 --rounds 12
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from app.core.security import PasswordHasher, PasswordHasherBusy, get_password_hash, verify_password
+from benchmarks.common import StubServer, percentiles, print_report
+
+PASSWORD = "correct horse battery staple"
+
+
+def make_app(mode: str, hashed: str, hasher: PasswordHasher) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/login")
+    async def login() -> dict[str, bool]:
+        if mode == "inline":
+            # What the login route did before: bcrypt on the event loop.
+            return {"ok": verify_password(PASSWORD, hashed)}
+        try:
+            return {"ok": await hasher.verify(PASSWORD, hashed)}
+        except PasswordHasherBusy:
+            raise HTTPException(status_code=503, detail="busy")
+
+    @app.get("/ping")
+    async def ping() -> dict[str, bool]:
+        return {"ok": True}
+
+    return app
+
+
+async def run_storm(base_url: str, args: argparse.Namespace) -> dict[str, Any]:
+    logins: list[float] = []
+    pings: list[float] = []
+    rejected = 0
+    done = asyncio.Event()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120.0) as client:
+        await client.get("/ping")
+
+        async def login() -> None:
+            nonlocal rejected
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/login")
+                if response.status_code == 503:
+                    rejected += 1
+                    return
+                response.raise_for_status()
+                logins.append((time.perf_counter() - started) * 1000)
+
+        async def probe() -> None:
+            while not done.is_set():
+                started = time.perf_counter()
+                (await client.get("/ping")).raise_for_status()
+                pings.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(args.probe_interval_ms / 1000)
+
+        prober = asyncio.ensure_future(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    login_stats = percentiles(logins)
+    ping_stats = percentiles(pings)
+    return {
+        "logins_per_s": round(len(logins) / elapsed, 2),
+        "login_p50_ms": login_stats.get("p50_ms"),
+        "login_p99_ms": login_stats.get("p99_ms"),
+        "rejected": rejected,
+        "pings": ping_stats["count"],
+        "ping_p50_ms": ping_stats.get("p50_ms"),
+        "ping_p99_ms": ping_stats.get("p99_ms"),
+        "ping_max_ms": ping_stats.get("max_ms"),
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    hashed = get_password_hash(PASSWORD, rounds=args.rounds)
+    results = {}
+    for mode in ("inline", "pool"):
+        hasher = PasswordHasher(max_workers=args.workers, max_pending=args.max_pending, rounds=args.rounds)
+        with StubServer(make_app(mode, hashed, hasher), tls=False) as server:
+            results[mode] = asyncio.run(run_storm(server.base_url, args))
+        hasher.shutdown()
+    print_report("password_hashing", results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=2, help="hashing pool threads")
+    parser.add_argument("--max-pending", type=int, default=32, help="hashing queue limit")
+    parser.add_argument("--probe-interval-ms", type=float, default=20.0)
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
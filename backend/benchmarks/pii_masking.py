@@ -0,0 +1,114 @@
+"""Throughput of chat PII masking: the old three sequential ``re.sub`` passes vs
+the single-scan PIIMasker, per kind of message in benchmarks/data/pii_corpus.jsonl.
+
+Also checks that both produce identical output on the corpus and on random
+strings built from digits, separators and email fragments::
+
+    python -m benchmarks.pii_masking --repeat 200 --fuzz 50000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable
+
+from app.services.pii import LEGACY_DETECTORS, PIIMasker, detectors_by_name
+from benchmarks.common import print_report
+
+CORPUS_PATH = Path(__file__).parent / "data" / "pii_corpus.jsonl"
+
+# _mask_sensitive_text as it was before PIIMasker, kept here as the baseline.
+LEGACY_PATTERNS = [
+    (re.compile(r"\b[\w\.-]+@[\w\.-]+\.\w+\b", flags=re.IGNORECASE), "[EMAIL_MASKED]"),
+    (re.compile(r"\b(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{2,4}\)?[-.\s]?){2,4}\d{2,4}\b"), "[PHONE_MASKED]"),
+    (re.compile(r"\b\d{3,4}[-\s]?\d{3,4}[-\s]?\d{3,4}\b"), "[ID_MASKED]"),
+]
+
+FUZZ_PIECES = list("0123456789") * 4 + list(" .-()+@_") * 2 + [
+    "a", "x", "com", "MRN ", "MRN:", "patient id ", "@b.co", "a@b.com", "+1 ", "(555)", "555-1234", "\n",
+]
+
+
+def legacy_mask(text: str) -> str:
+    masked = text
+    for pattern, replacement in LEGACY_PATTERNS:
+        masked = pattern.sub(replacement, masked)
+    return masked
+
+
+def throughput(mask: Callable[[str], str], texts: list[str], repeat: int) -> dict[str, Any]:
+    size = sum(len(text.encode("utf-8")) for text in texts) * repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            mask(text)
+    elapsed = time.perf_counter() - started
+    return {
+        "us_per_message": round(elapsed / (len(texts) * repeat) * 1e6, 2),
+        "mb_per_s": round(size / elapsed / 1e6, 2),
+    }
+
+
+def fuzz(masker: PIIMasker, reference: Callable[[str], str], cases: int, seed: int) -> int:
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(cases):
+        text = "".join(rng.choice(FUZZ_PIECES) for _ in range(rng.randint(1, 30)))
+        if masker.mask(text) != reference(text):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"MISMATCH: {text!r}")
+    return mismatches
+
+
+def main(args: argparse.Namespace) -> None:
+    corpus = [json.loads(line) for line in CORPUS_PATH.read_text(encoding="utf-8").splitlines() if line.strip()]
+    by_kind: dict[str, list[str]] = defaultdict(list)
+    for row in corpus:
+        by_kind[row["kind"]].append(row["text"])
+    by_kind["all"] = [row["text"] for row in corpus]
+
+    legacy_engine = PIIMasker(LEGACY_DETECTORS)
+    configured = PIIMasker(detectors_by_name(args.detectors))
+    results: dict[str, Any] = {}
+    for kind, texts in by_kind.items():
+        before = throughput(legacy_mask, texts, args.repeat)
+        after = throughput(legacy_engine.mask, texts, args.repeat)
+        results[kind] = {
+            "messages": len(texts),
+            "sequential_us": before["us_per_message"],
+            "single_scan_us": after["us_per_message"],
+            "speedup": round(before["us_per_message"] / max(after["us_per_message"], 1e-9), 2),
+            "single_scan_mb_per_s": after["mb_per_s"],
+        }
+
+    legacy_engine.scans = legacy_engine.sequential_fallbacks = 0
+    corpus_mismatches = sum(legacy_engine.mask(text) != legacy_mask(text) for text in by_kind["all"])
+    results["equivalence"] = {
+        "corpus_mismatches": corpus_mismatches,
+        "fuzz_cases": args.fuzz,
+        "fuzz_mismatches_legacy": fuzz(legacy_engine, legacy_mask, args.fuzz, args.seed),
+        f"fuzz_mismatches_{args.detectors.replace(',', '+')}": fuzz(
+            configured, configured.mask_sequential, args.fuzz, args.seed
+        ),
+        "sequential_fallbacks": legacy_engine.sequential_fallbacks,
+    }
+    print_report("pii_masking", results, as_json=args.json)
+    if corpus_mismatches or any(value for key, value in results["equivalence"].items() if "mismatches" in key):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--fuzz", type=int, default=50000, help="random strings to compare (0 to skip)")
+    parser.add_argument("--seed", type=int, default=15)
+    parser.add_argument("--detectors", default="email,mrn,phone,id", help="detector set for the second fuzz run")
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args())
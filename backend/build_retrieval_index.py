@@ -0,0 +1,44 @@
+"""Build the chatbot's offline retrieval index.
+
+The bundled corpus (app/data/medical_corpus.jsonl) is always included. Extra
+JSONL files can be added, e.g. the PubMedQA/MedMCQA-derived dataset prepared in
+Dr_Tmuor.ipynb, exported with ``tumor_dataset.to_json("tumor_dataset.jsonl")``::
+
+    python build_retrieval_index.py --corpus tumor_dataset.jsonl --output app/data/retrieval_index.json.gz
+
+Then point CHAT_RETRIEVAL_INDEX_PATH at the output file.
+"""
+
+import argparse
+import time
+
+from app.services.retrieval import DEFAULT_CORPUS_PATH, BM25Index, read_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the chatbot retrieval index")
+    parser.add_argument("--corpus", action="append", default=[], help="extra JSONL corpus file (repeatable)")
+    parser.add_argument("--output", required=True, help="index file to write (.json or .json.gz)")
+    parser.add_argument(
+        "--min-answer-chars",
+        type=int,
+        default=40,
+        help="skip dataset answers shorter than this (e.g. bare 'yes'/'no' labels)",
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    documents = read_corpus(DEFAULT_CORPUS_PATH)
+    for path in args.corpus:
+        extra = [doc for doc in read_corpus(path) if len(doc["text"]) >= args.min_answer_chars]
+        print(f"{path}: {len(extra)} documents")
+        documents.extend(extra)
+
+    index = BM25Index.from_documents(documents)
+    index.save(args.output)
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {len(index)} documents ({len(index.postings)} terms) into {args.output} in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
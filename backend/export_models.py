@@ -0,0 +1,112 @@
+"""Export the pipeline models for the ONNX Runtime backends and check parity.
+
+For each TorchScript model configured in CNN/SEGMENT/SLICE_MODEL_PATH this
+writes ``<name>.onnx`` (float) and ``<name>.int8.onnx`` (dynamically quantized;
+by default only MatMul/Gemm, see ``--int8-ops``) next to it, then compares both
+against the float TorchScript model on synthetic inputs: output difference, agreement of the decisions the
+pipeline takes from the output (class argmax / mask pixels), and latency::
+
+    python export_models.py --models cnn,segment,slice --backends onnx,onnx_int8
+
+Then select a backend per model, e.g. CNN_MODEL_BACKEND=onnx_int8. The command
+exits non-zero if a backend misses its parity threshold; ``--check-only``
+re-runs the comparison on existing files.
+"""
+
+import argparse
+import json
+import sys
+
+from app.core.config import settings
+from app.services.model_backends import (
+    DEFAULT_INT8_OPS,
+    ONNX_SUFFIXES,
+    artifact_path,
+    export_onnx,
+    file_size_mb,
+    load_model,
+    parity_report,
+    quantize_onnx,
+    sample_inputs,
+)
+
+MODEL_PATHS = {"cnn": "CNN_MODEL_PATH", "segment": "SEGMENT_MODEL_PATH", "slice": "SLICE_MODEL_PATH"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export pipeline models to ONNX / int8 and check parity")
+    parser.add_argument("--models", default="cnn,segment,slice", help="comma-separated subset of cnn,segment,slice")
+    parser.add_argument("--backends", default="onnx,onnx_int8", help="comma-separated subset of onnx,onnx_int8")
+    parser.add_argument("--check-only", action="store_true", help="skip export, compare existing files")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument(
+        "--int8-ops",
+        default=",".join(DEFAULT_INT8_OPS),
+        help="ONNX op types to quantize (add Conv to quantize convolutions too)",
+    )
+    parser.add_argument("--batches", type=int, default=6, help="synthetic input batches for the parity check")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=settings.AI_TORCH_THREADS, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--max-abs-diff", type=float, default=1e-3, help="float ONNX tolerance vs TorchScript")
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="int8 decision agreement threshold")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    unknown = [name for name in backends if name not in ONNX_SUFFIXES]
+    if unknown:
+        parser.error(f"unknown backend(s): {', '.join(unknown)}")
+    models = [name.strip().lower() for name in args.models.split(",") if name.strip()]
+    unknown = [name for name in models if name not in MODEL_PATHS]
+    if unknown:
+        parser.error(f"unknown model(s): {', '.join(unknown)} (choose from {', '.join(MODEL_PATHS)})")
+    inputs = sample_inputs(args.batches, args.batch_size, settings.AI_INPUT_SIZE)
+
+    results = {}
+    failed = False
+    for name in models:
+        model_path = getattr(settings, MODEL_PATHS[name])
+        if not model_path:
+            print(f"{name}: {MODEL_PATHS[name]} is not set, skipping")
+            continue
+        reference, source = load_model("torchscript", model_path, "cpu")
+        float_onnx = artifact_path(model_path, "onnx")
+        if not args.check_only:
+            export_onnx(model_path, float_onnx, settings.AI_INPUT_SIZE, args.opset)
+            print(f"{name}: exported {float_onnx}")
+            if "onnx_int8" in backends:
+                int8_onnx = quantize_onnx(
+                    float_onnx, artifact_path(model_path, "onnx_int8"), [op.strip() for op in args.int8_ops.split(",")]
+                )
+                print(f"{name}: quantized {int8_onnx}")
+
+        results[name] = {"torchscript": {"file": str(source), "size_mb": file_size_mb(source)}}
+        for backend in backends:
+            candidate, path = load_model(backend, model_path, "cpu", args.threads)
+            report = parity_report(reference, candidate, inputs)
+            if backend == "onnx":
+                report["passed"] = report["max_abs_diff"] <= args.max_abs_diff
+            else:
+                report["passed"] = report["decision_agreement"] >= args.min_agreement
+            failed = failed or not report["passed"]
+            results[name][backend] = {"file": str(path), "size_mb": file_size_mb(path), **report}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, entries in results.items():
+            print(f"\n{name}: torchscript {entries['torchscript']['size_mb']} MB")
+            for backend in backends:
+                entry = entries[backend]
+                print(
+                    f"  {backend:<10} {entry['size_mb']} MB  max|diff| {entry['max_abs_diff']:.2e}  "
+                    f"mean|diff| {entry['mean_abs_diff']:.2e}  agreement {entry['decision_agreement']:.4f}  "
+                    f"{entry['reference_ms']} -> {entry['candidate_ms']} ms/batch ({entry['speedup']}x)  "
+                    f"{'ok' if entry['passed'] else 'FAILED'}"
+                )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,11 +7,32 @@ const LabDashboard = () => {
     const [requests, setRequests] = useState([]);
     const [uploading, setUploading] = useState(null); // ID of request being uploaded
     const [file, setFile] = useState(null);
+    const [jobs, setJobs] = useState({}); // request ID -> AI analysis job status
 
     useEffect(() => {
         fetchRequests();
     }, []);
 
+    // Poll AI analysis jobs until they finish.
+    useEffect(() => {
+        const active = Object.entries(jobs).filter(([, job]) => job.status === 'pending' || job.status === 'running');
+        if (active.length === 0) return undefined;
+        const timer = setTimeout(async () => {
+            const updates = {};
+            for (const [reqId, job] of active) {
+                try {
+                    const res = await medicalAPI.getAnalysisJob(job.id);
+                    updates[reqId] = res.data;
+                    if (res.data.status === 'failed') toast.error('AI analysis failed');
+                } catch (error) {
+                    console.error(error);
+                }
+            }
+            setJobs(prev => ({ ...prev, ...updates }));
+        }, 2000);
+        return () => clearTimeout(timer);
+    }, [jobs]);
+
     const fetchRequests = async () => {
         try {
             const res = await medicalAPI.getLabRequests();
@@ -29,8 +50,11 @@ const LabDashboard = () => {
         formData.append('ai_analysis', 'true');
 
         try {
-            await medicalAPI.uploadLabReport(reqId, formData);
-            toast.success('Report Uploaded & AI Analysis Requested');
+            const res = await medicalAPI.uploadLabReport(reqId, formData);
+            if (res.data.job_id) {
+                setJobs(prev => ({ ...prev, [reqId]: { id: res.data.job_id, status: res.data.status, progress: { stage: 'queued', percent: 0 } } }));
+            }
+            toast.success('Report Uploaded & AI Analysis Queued');
             setFile(null);
             setUploading(null);
             fetchRequests();
@@ -77,7 +101,13 @@ const LabDashboard = () => {
                                     {req.status === 'completed' && (
                                         <div className="text-right">
                                             <p className="text-xs text-slate-500">Report ID: {req.result_id}</p>
-                                            <span className="text-xs text-green-600 font-bold">AI Analysis Available</span>
+                                            {jobs[req.id] && jobs[req.id].status !== 'succeeded' ? (
+                                                <span className={`text-xs font-bold ${jobs[req.id].status === 'failed' ? 'text-red-600' : 'text-yellow-600'}`}>
+                                                    AI Analysis: {jobs[req.id].status === 'failed' ? 'failed' : `${jobs[req.id].progress.stage} (${jobs[req.id].progress.percent}%)`}
+                                                </span>
+                                            ) : (
+                                                <span className="text-xs text-green-600 font-bold">AI Analysis Available</span>
+                                            )}
                                         </div>
                                     )}
                                 </div>
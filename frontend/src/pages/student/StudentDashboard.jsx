@@ -11,6 +11,7 @@ const StudentDashboard = () => {
   ]);
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [sessionId, setSessionId] = useState(null);
   const messagesEndRef = useRef(null);
   const inputRef = useRef(null);
 
@@ -38,16 +39,30 @@ const StudentDashboard = () => {
     setIsLoading(true);
 
     try {
-      // Prepare history (exclude the welcome message and current message)
-      const history = messages
+      // Prepare history for the first turn only (exclude the welcome message and current message);
+      // after that the server keeps the conversation under sessionId.
+      const history = sessionId ? [] : messages
         .filter((_, idx) => idx > 0) // Skip welcome message
         .map(msg => ({
           role: msg.role === 'assistant' ? 'model' : 'user',
           content: msg.content
         }));
 
-      const response = await chatbotAPI.sendMessage(messageText, history);
-      
+      let response;
+      try {
+        response = await chatbotAPI.sendMessage(messageText, sessionId, history);
+      } catch (error) {
+        if (!sessionId || error.response?.status !== 404) throw error;
+        // Session expired on the server: start a new one from the local transcript.
+        const fullHistory = messages
+          .filter((_, idx) => idx > 0)
+          .map(msg => ({ role: msg.role === 'assistant' ? 'model' : 'user', content: msg.content }));
+        response = await chatbotAPI.sendMessage(messageText, null, fullHistory);
+      }
+      if (response.data.session_id) {
+        setSessionId(response.data.session_id);
+      }
+
       setMessages(prev => [...prev, {
         role: 'assistant',
         content: response.data.response
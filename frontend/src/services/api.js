@@ -44,6 +44,7 @@ export const medicalAPI = {
       headers: { 'Content-Type': 'multipart/form-data' }
   }),
   getLabReport: (id) => api.get(`/medical/lab-reports/${id}`),
+  getAnalysisJob: (id) => api.get(`/medical/analysis-jobs/${id}`),
 };
 
 export const adminAPI = {
@@ -57,7 +58,9 @@ export const adminAPI = {
 };
 
 export const chatbotAPI = {
-    sendMessage: (message, history) => api.post('/ai/chatbot', { message, history }),
+    // With a session_id the server keeps the (masked) history, so only the new message is sent.
+    sendMessage: (message, sessionId, history = []) =>
+        api.post('/ai/chatbot', sessionId ? { message, session_id: sessionId } : { message, history }),
 };
 
 // Public API (no auth required)